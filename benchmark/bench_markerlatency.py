@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+# bench_markerlatency.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""Measure the latency and loss of markers sent to the marker server.
+
+For every combination of transport, marker rate and number of
+concurrent senders a fresh marker server is started and each sender
+process sends markers at the given rate. The payload of each marker is
+the sender, its sequence number and the time of sending. Since
+:func:`libmushu.clock.now_ns` is system wide, the latency is the
+difference between the time the server timestamped the marker and the
+time of sending.
+
+The transports are
+
+    * udp: one datagram per marker
+    * tcp: one connection per marker, the server's 'oneshot' TCP mode
+    * stream: newline terminated markers over one persistent connection
+      per sender, the server's 'stream' TCP mode
+    * unix, unix-stream: like udp and stream, but over the server's Unix
+      domain sockets
+
+Every run lasts at least ``duration`` seconds and long enough to send
+10 markers per sender. The results are written as JSON, one record per
+run with the number of markers sent and received, the loss rate, the
+achieved rate and the p50, p95, p99 and max latency in ms.
+
+Usage::
+
+    $ PYTHONPATH=. python benchmark/bench_markerlatency.py \\
+        [--transports udp,tcp,stream,unix,unix-stream] [--rates 1,10,100,1000,10000] \\
+        [--senders 1,4] [--duration 2] [--mode process] [--output FILE]
+
+"""
+
+
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import argparse
+import tempfile
+from multiprocessing import Process, Queue
+
+import numpy as np
+
+import libmushu
+from libmushu.clock import now_ns, NS_PER_S, NS_PER_MS
+from libmushu.ringbuffer import MarkerRing
+from libmushu.markerserver import get_marker_server, unix_paths, PORT, END_MARKER
+
+
+class UDPSender(object):
+
+    family = socket.AF_INET
+
+    def __init__(self, address):
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.address = address
+
+    def send(self, payload):
+        self.sock.sendto(payload, self.address)
+
+    def close(self):
+        self.sock.close()
+
+
+class TCPSender(object):
+
+    def __init__(self, address):
+        self.address = address
+
+    def send(self, payload):
+        sock = socket.create_connection(self.address)
+        try:
+            sock.sendall(payload)
+        finally:
+            sock.close()
+
+    def close(self):
+        pass
+
+
+class StreamSender(object):
+
+    def __init__(self, address):
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, payload):
+        self.sock.sendall(payload + END_MARKER.encode())
+
+    def close(self):
+        self.sock.close()
+
+
+class UnixDatagramSender(UDPSender):
+
+    family = getattr(socket, 'AF_UNIX', None)
+
+
+class UnixStreamSender(StreamSender):
+
+    def __init__(self, address):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(address)
+
+
+# transport -> sender, options of the marker server
+TRANSPORTS = {
+    'udp': (UDPSender, {}),
+    'tcp': (TCPSender, {'tcp_mode': 'oneshot'}),
+    'stream': (StreamSender, {'tcp_mode': 'stream'}),
+    'unix': (UnixDatagramSender, {}),
+    'unix-stream': (UnixStreamSender, {'tcp_mode': 'stream'}),
+}
+
+
+def wait_until(t):
+    """Sleep until ``now_ns() >= t``, spinning for the last 200us."""
+    while True:
+        remaining = t - now_ns()
+        if remaining <= 0:
+            return
+        if remaining > 200000:
+            time.sleep((remaining - 200000) / NS_PER_S)
+
+
+def send_markers(transport, address, sender_id, rate, n, results):
+    """Send ``n`` markers at ``rate`` Hz and report the number sent and
+    the time it took."""
+    sender = TRANSPORTS[transport][0](address)
+    interval = NS_PER_S / rate
+    sent = 0
+    t0 = now_ns()
+    for seq in range(n):
+        wait_until(t0 + int(seq * interval))
+        try:
+            sender.send(('%d %d %d' % (sender_id, seq, now_ns())).encode())
+        except OSError:
+            continue
+        sent += 1
+    results.put((sender_id, sent, now_ns() - t0))
+    sender.close()
+
+
+def run(transport, rate, senders, duration, mode='process'):
+    """Run one benchmark.
+
+    Returns
+    -------
+    result : dict
+
+    """
+    n = max(int(round(duration * rate)), 10)
+    address = ('127.0.0.1', PORT)
+    # every marker has a unique label, make room for all of them
+    total = n * senders
+    ring = MarkerRing(capacity=2**16, max_labels=total + 1, heap_size=32 * (total + 1))
+    options = dict(TRANSPORTS[transport][1])
+    if transport.startswith('unix'):
+        tmpdir = tempfile.mkdtemp()
+        options['unix_path'] = os.path.join(tmpdir, 'markers')
+        stream_path, dgram_path = unix_paths(options['unix_path'])
+        address = dgram_path if transport == 'unix' else stream_path
+    server = get_marker_server(mode, ring, host='127.0.0.1', port=PORT, **options)
+    server.start()
+    results = Queue()
+    processes = [Process(target=send_markers, args=(transport, address, i, rate, n, results)) for i in range(senders)]
+    markers = []
+    try:
+        for p in processes:
+            p.start()
+        reports = []
+        while len(reports) < senders:
+            markers.extend(ring.drain())
+            while not results.empty():
+                reports.append(results.get())
+            time.sleep(.001)
+        for p in processes:
+            p.join()
+        # wait for the markers still in flight
+        t_end = time.time() + .2
+        while time.time() < t_end:
+            markers.extend(ring.drain())
+            time.sleep(.001)
+    finally:
+        server.stop()
+        counters = ring.counters()
+        ring.close()
+        if transport.startswith('unix'):
+            shutil.rmtree(tmpdir)
+    received = {}
+    for t, label in markers:
+        sender_id, seq, t_sent = label.split()
+        received[int(sender_id), int(seq)] = t - int(t_sent)
+    sent = sum(r[1] for r in reports)
+    latency = np.array(list(received.values())) / NS_PER_MS
+    result = {
+        'transport': transport,
+        'rate': rate,
+        'senders': senders,
+        'markers': total,
+        'sent': sent,
+        'received': len(received),
+        'loss': 1 - len(received) / total,
+        'achieved_rate': sum(r[1] / r[2] * NS_PER_S for r in reports) / senders,
+        'ring_dropped': counters['dropped'],
+    }
+    if len(latency):
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        result.update({'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': latency.max()})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the latency and loss of markers.')
+    parser.add_argument('--transports', default='udp,tcp,stream,unix,unix-stream')
+    parser.add_argument('--rates', default='1,10,100,1000,10000')
+    parser.add_argument('--senders', default='1,4')
+    parser.add_argument('--duration', type=float, default=2)
+    parser.add_argument('--mode', default='process')
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+    report = {
+        'mushu': libmushu.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'mode': args.mode,
+        'results': [],
+    }
+    for transport in args.transports.split(','):
+        for senders in [int(i) for i in args.senders.split(',')]:
+            for rate in [float(i) for i in args.rates.split(',')]:
+                result = run(transport, rate, senders, args.duration, args.mode)
+                report['results'].append(result)
+                print('%-11s %8g Hz x %d: loss %6.2f%%, p50 %7.3f ms, p99 %7.3f ms, max %7.3f ms' % (
+                    transport, rate, senders, 100 * result['loss'], result.get('p50_ms', np.nan),
+                    result.get('p99_ms', np.nan), result.get('max_ms', np.nan)), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# bench_markers.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""Compare the per call overhead of the old multiprocessing.Queue based
+marker transport with :class:`libmushu.ringbuffer.MarkerRing`.
+
+Three costs are measured:
+
+    * poll: checking for markers in a ``get_data`` call when there are
+      none, which is what happens in almost every call
+    * drain: receiving markers put by the marker server process, per
+      marker
+    * put: handing a marker over in the marker server process, the old
+      ``handle_data`` did a put, qsize and get/put round trip
+
+Usage::
+
+    $ PYTHONPATH=. python benchmark/bench_markers.py [n]
+
+"""
+
+
+from __future__ import division
+
+import sys
+import time
+from multiprocessing import Process, Queue, Event
+
+from libmushu.clock import now_ns
+from libmushu.ringbuffer import MarkerRing
+
+
+def queue_put(queue, n):
+    for i in range(n):
+        queue.put([time.time(), 'marker %d' % (i % 10)])
+        queue.qsize()
+        item = queue.get()
+        queue.put(item)
+
+
+def ring_put(ring, n):
+    for i in range(n):
+        ring.put(now_ns(), 'marker %d' % (i % 10))
+
+
+def producer(name, put, transport, n, done):
+    t = time.time()
+    put(transport, n)
+    print('%-6s put   %8.2f us/marker' % (name, 1e6 * (time.time() - t) / n))
+    done.set()
+
+
+def queue_poll(queue, n):
+    t = time.time()
+    for i in range(n):
+        while not queue.empty():
+            queue.get()
+    return time.time() - t
+
+
+def ring_poll(ring, n):
+    t = time.time()
+    for i in range(n):
+        ring.drain()
+    return time.time() - t
+
+
+def queue_drain(queue, n):
+    markers = []
+    t = time.time()
+    while len(markers) < n:
+        while not queue.empty():
+            markers.append(queue.get())
+    return time.time() - t
+
+
+def ring_drain(ring, n):
+    markers = []
+    t = time.time()
+    while len(markers) < n:
+        markers.extend(ring.drain())
+    return time.time() - t
+
+
+def main(n=10000):
+    for name, transport, put, poll, drain in (
+            ('Queue', Queue(), queue_put, queue_poll, queue_drain),
+            ('Ring', MarkerRing(capacity=n), ring_put, ring_poll, ring_drain)):
+        print('%-6s poll  %8.2f us/call' % (name, 1e6 * poll(transport, n) / n))
+        done = Event()
+        p = Process(target=producer, args=(name, put, transport, n, done))
+        p.start()
+        done.wait()
+        print('%-6s drain %8.2f us/marker' % (name, 1e6 * drain(transport, n) / n))
+        p.join()
+        if isinstance(transport, MarkerRing):
+            transport.close()
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
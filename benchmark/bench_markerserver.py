@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# bench_markerserver.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""Measure how long it takes to start and stop the marker server in
+process and in thread mode.
+
+start is the time from starting the server until its endpoints are
+open, stop the time from stopping the server until it is joined.
+
+Usage::
+
+    $ PYTHONPATH=. python benchmark/bench_markerserver.py [repetitions]
+
+"""
+
+
+from __future__ import division
+
+import sys
+import time
+
+import numpy as np
+
+from libmushu.ringbuffer import MarkerRing
+from libmushu.markerserver import get_marker_server
+
+
+def main(repetitions=20):
+    ring = MarkerRing()
+    for mode in 'process', 'thread':
+        start, stop = [], []
+        for i in range(repetitions):
+            server = get_marker_server(mode, ring)
+            t = time.time()
+            server.start()
+            start.append(time.time() - t)
+            t = time.time()
+            server.stop()
+            stop.append(time.time() - t)
+        for name, times in ('start', start), ('stop', stop):
+            times = 1000 * np.array(times)
+            print('%-8s %-6s median %8.2f ms, max %8.2f ms' % (mode, name, np.median(times), times.max()))
+    ring.close()
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
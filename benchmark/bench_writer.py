@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# bench_writer.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""Compare the throughput of the old ``struct.pack`` based EEG writing
+with :class:`libmushu.writer.RecordingWriter`.
+
+The data is produced by :class:`libmushu.driver.randomamp.RandomAmp`
+configured with its 128 channel preset. The amp is run in timelapse by
+moving its start time into the past, so the benchmark measures only the
+writing and not the simulated blocking of the amp.
+
+Usage::
+
+    $ PYTHONPATH=. python benchmark/bench_writer.py [seconds] [blocksize]
+
+The BrainVisionWriter converts the int64 data to float32, like the old
+writer. Note that the old writer always converted to float32 while the
+RecordingWriter keeps the native data type of the amp (int64 for the
+RandomAmp), so the samples per second are reported as well.
+
+"""
+
+
+from __future__ import division
+
+import os
+import sys
+import time
+import struct
+import shutil
+import tempfile
+
+from libmushu.driver.randomamp import RandomAmp
+from libmushu.clock import NS_PER_S
+from libmushu.writer import RecordingWriter, BrainVisionWriter
+
+
+def get_blocks(seconds, blocksize):
+    amp = RandomAmp()
+    amp.configure(**amp.presets[1][1])
+    amp.start()
+    amp.t_start -= seconds * NS_PER_S
+    data, _ = amp.get_data()
+    return [data[i:i+blocksize] for i in range(0, len(data), blocksize)]
+
+
+def bench_struct(blocks, filename):
+    t = time.time()
+    with open(filename, 'wb') as fh:
+        for data in blocks:
+            fh.write(struct.pack("f"*data.size, *data.flatten()))
+    return os.path.getsize(filename), time.time() - t
+
+
+def bench_writer(blocks, filename):
+    amp = RandomAmp()
+    amp.configure(**amp.presets[1][1])
+    t = time.time()
+    writer = RecordingWriter(filename, amp.get_channels(), amp.get_sampling_frequency())
+    for data in blocks:
+        writer.write(data, [])
+    writer.close()
+    return os.path.getsize(filename + '.eeg'), time.time() - t
+
+
+def bench_brainvision(blocks, filename):
+    amp = RandomAmp()
+    amp.configure(**amp.presets[1][1])
+    t = time.time()
+    writer = BrainVisionWriter(filename, amp.get_channels(), amp.get_sampling_frequency())
+    for data in blocks:
+        writer.write(data, [])
+    writer.close()
+    return os.path.getsize(filename + '.eeg'), time.time() - t
+
+
+def main(seconds=10, blocksize=10):
+    blocks = get_blocks(seconds, blocksize)
+    samples = sum(data.size for data in blocks)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, f in (('struct.pack', bench_struct),
+                        ('RecordingWriter', bench_writer),
+                        ('BrainVision', bench_brainvision)):
+            size, dt = f(blocks, os.path.join(tmpdir, name))
+            print('%-16s %8.1f MB in %6.3fs: %8.1f MB/s, %8.1f MSamples/s' % (name, size / 1e6, dt, size / 1e6 / dt, samples / 1e6 / dt))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
@@ -32,39 +32,27 @@ automatically receive decorated amplifiers.
 
 from __future__ import division
 
-# import select
-import socket
-import time
-from multiprocessing import Process, Queue, Event
-import os
-import signal
-import struct
-import json
+import math
+import asyncio
 import logging
+import threading
 
-
-# warning: dirty hack to shut down the event loop.
-import subprocess
-import signal
-
-# we may not need those anymore
-import asyncore
-import asynchat
-
-# we definitely need this -- I don't know why it's greyed out here.
-import asyncio
+import numpy as np
 
 from libmushu.amplifier import Amplifier
+from libmushu.writer import get_writer, ThreadedWriter, CHECKPOINT_INTERVAL
+from libmushu.ringbuffer import MarkerRing, SampleRing, BroadcastRing
+from libmushu.clock import now_ns, samples_to_ns, wall_clock_mapping, NS_PER_MS
+from libmushu.markerserver import get_marker_server, END_MARKER, BUFSIZE, PORT
+
+# END_MARKER, BUFSIZE and PORT moved to libmushu.markerserver, they are
+# re-exported for code importing them from here
+__all__ = ['AmpDecorator', 'END_MARKER', 'BUFSIZE', 'PORT']
 
 logger = logging.getLogger(__name__)
 logger.info('Logger started')
 
 
-END_MARKER = '\n'
-BUFSIZE = 2**16
-PORT = 32344
-
-
 class AmpDecorator(Amplifier):
     """This class 'decorates' the Low-Level Amplifier classes with
     Network-Marker and Save-To-File functionality.
@@ -78,137 +66,238 @@ class AmpDecorator(Amplifier):
 
         amp = Ampdecorator(RandomAmp)
 
-    Waring: The network marker timings on Windows have a resolution of
-    10ms-15ms. On Linux the resolution is 1us. This is due to
-    limitations of Python's time.time method, or rather a Windows
-    specific issue.
-
-    There exists currently no precise timer, providing times which are
-    comparable between two running processes on Windows. The performance
-    counter provided on Windows, has a much better resolution but is
-    relative to the processes start time and it drifts (1s per 100s), so
-    it is only precise for a relatively short amount of time.
-
-    If a higher precision is needed one has to replace the time.time
-    calls with something which provides a better precision. For example
-    one could create a third process which provides times or regularly
-    synchronize both processes with the clock synchronization algorithm
-    as described here:
-
-        http://en.wikipedia.org/wiki/Network_Time_Protocol
-
-    Alternatively one could use `timeGetTime` from Windows' Multi Media
-    library, which is tunable via `timeBeginPeriod` and provides a
-    precision of 1-2ms. Apparently this is the way Chrome and many
-    others do it.::
-
-        from __future__ import division
-
-        from ctypes import windll
-        import time
-
-        timeBeginPeriod = windll.winmm.timeBeginPeriod
-        timeEndPeriod = windll.winmm.timeEndPeriod
-        timeGetTime = windll.winmm.timeGetTime
-
-        if __name__ == '__main__':
-            # wrap the code that needs high precision in timeBegin- and
-            # timeEndPeriod with the same parameter. The parameter is
-            # the interval in ms you want as precision. Usually the
-            # minimum value allowed is 1 (best).
-            timeBeginPeriod(1)
-            times = []
-            t_start = time.time()
-            while time.time() < (time.time() + 1):
-                times.append(timeGetTime())
-            times = sorted(list(set(times)))
-            print(1000 / len(times))
-            timeEndPeriod(1)
+    All timestamps, of the data blocks and of the network markers, are
+    taken with :func:`libmushu.clock.now_ns`, a monotonic high
+    resolution clock that is shared by all processes, and the marker
+    arithmetic is done in integer nanoseconds. The mapping of this clock
+    to the wall clock is stored in the meta data of a recording.
+
+    Network markers are timestamped on arrival, or by the sender if it
+    synchronizes its clock with the marker server, see
+    :mod:`libmushu.clocksync`.
+
+    Only one caller can own :meth:`get_data`, since every call consumes
+    the data. To share a live acquisition with other processes start
+    the amplifier with ``publish=True`` and pass the ring in
+    :attr:`broadcast` to them, each one reads it with its own
+    subscriber::
+
+        def classify(ring):
+            subscriber = ring.subscribe()
+            while not subscriber.closed:
+                data, markers, start, overrun = subscriber.read()
+                ...
+
+        amp.start(publish=True, background=True)
+        Process(target=classify, args=(amp.broadcast,)).start()
 
     """
 
     def __init__(self, ampcls):
         self.amp = ampcls()
         self.write_to_file = False
+        self.acquisition = None
+        self.broadcast = None
 
     @property
     def presets(self):
         return self.amp.presets
 
-    def start(self, filename=None, **kwargs):
+    def start(self, filename=None, writer='inline', fileformat='mushu', writer_options=None,
+              checkpoint_interval=CHECKPOINT_INTERVAL, marker_server='process', marker_options=None,
+              marker_buffer_options=None, background=False, buffer_seconds=10, publish=False,
+              publish_options=None, **kwargs):
+        """Start the amplifier and the marker server.
+
+        Parameters
+        ----------
+        filename : str, optional
+            if given, the data and markers are saved to files with this
+            base name
+        writer : str, optional
+            'inline' writes the data in :meth:`get_data`, 'thread' hands
+            it to a background writer thread so a slow disk does not
+            stall the acquisition
+        fileformat : str, optional
+            'mushu' for mushu's own format or 'brainvision' to write
+            BrainVision files (``.vhdr``, ``.vmrk`` and ``.eeg``)
+        writer_options : dict, optional
+            further options for the writer, see
+            :func:`libmushu.writer.get_writer`
+        checkpoint_interval : float, optional
+            for the 'mushu' format, the time in seconds between two
+            checkpoints of the recording, a crashed recording can be
+            recovered up to its last checkpoint at least (see
+            :func:`libmushu.io.recover`)
+        marker_server : str, optional
+            'process' runs the marker server in a separate process,
+            'thread' in a background thread of this process, which
+            starts and stops much faster, and 'loop' on the running
+            asyncio event loop of the calling thread, see
+            :meth:`aget_data`
+        marker_options : dict, optional
+            further options for the marker server, see
+            :class:`libmushu.markerserver.MarkerServer`
+        marker_buffer_options : dict, optional
+            options for the buffer of the network markers, e.g. its
+            ``capacity`` and ``overflow`` policy, see
+            :class:`libmushu.ringbuffer.MarkerRing`
+        background : bool, optional
+            poll the amplifier on a dedicated thread, which also
+            timestamps the data and markers and writes them to the
+            files. :meth:`get_data` then returns everything acquired
+            since the last call, so a slow caller does not delay the
+            polling of the amplifier.
+        buffer_seconds : float, optional
+            the size of the sample buffer of the background
+            acquisition in seconds. If the caller falls further behind,
+            the oldest samples are lost (but still written to the files)
+            and a warning is logged.
+        publish : bool, optional
+            also publish the data and markers in a
+            :class:`libmushu.ringbuffer.BroadcastRing` of
+            ``buffer_seconds``, so other processes, e.g. a GUI, a
+            recorder and a classifier, can follow the acquisition
+            without copying the data, see :attr:`broadcast`. The
+            ring is closed when the amplifier is stopped.
+        publish_options : dict, optional
+            further options for the ring, e.g. its ``dtype``
+        kwargs :
+            are passed to the low level amplifier's ``start`` method
+
+        """
         # prepare files for writing
         self.write_to_file = False
         if filename is not None:
             self.write_to_file = True
-            filename_marker = filename + '.marker'
-            filename_eeg = filename + '.eeg'
-            filename_meta = filename + '.meta'
-            for filename in filename_marker, filename_eeg, filename_meta:
-                if os.path.exists(filename):
-                    logger.error('A file "%s" already exists, aborting.' % filename)
-                    raise Exception
-            self.fh_eeg = open(filename_eeg, 'wb')
-            self.fh_marker = open(filename_marker, 'w')
-            self.fh_meta = open(filename_meta, 'w')
-            # write meta data
-            meta = {'Channels': self.amp.get_channels(),
-                    'Sampling Frequency': self.amp.get_sampling_frequency(),
-                    'Amp': str(self.amp)
-                    }
-            json.dump(meta, self.fh_meta, indent=4)
+            writer_options = dict(writer_options or {})
+            if fileformat == 'mushu':
+                writer_options.setdefault('checkpoint_interval', checkpoint_interval)
+            self.writer = get_writer(writer, filename,
+                                     self.amp.get_channels(),
+                                     self.amp.get_sampling_frequency(),
+                                     str(self.amp),
+                                     fileformat=fileformat,
+                                     **writer_options)
 
         # start the marker server
-        self.marker_queue = Queue()
-        self.tcp_reader_running = Event()
-        self.tcp_reader_running.set()
-        tcp_reader_ready = Event()
-        self.tcp_reader = Process(target=marker_reader,
-                                  args=(self.marker_queue,
-                                        self.tcp_reader_running,
-                                        tcp_reader_ready
-                                        )
-                                  )
-        self.tcp_reader.start()
+        if marker_buffer_options is None:
+            marker_buffer_options = {}
+        self.marker_ring = MarkerRing(**marker_buffer_options)
+        self.late_markers = 0
+        self.reported_drops = 0
+        if marker_options is None:
+            marker_options = {}
+        self.marker_server = get_marker_server(marker_server, self.marker_ring, **marker_options)
         logger.debug('Waiting for marker server to become ready...')
-        tcp_reader_ready.wait()
+        self.marker_server.start()
         logger.debug('Marker server is ready.')
         # zero the sample counter
         self.received_samples = 0
+        self.broadcast = None
+        if publish:
+            fs = self.amp.get_sampling_frequency()
+            options = {'capacity': int(math.ceil(buffer_seconds * fs))}
+            options.update(publish_options or {})
+            self.broadcast = BroadcastRing(len(self.amp.get_channels()), fs, **options)
         # start the amp --> hopefully this'll work?
         self.amp.start(**kwargs)
+        if background:
+            capacity = int(math.ceil(buffer_seconds * self.amp.get_sampling_frequency()))
+            self.sample_ring = SampleRing(capacity, len(self.amp.get_channels()))
+            self.acquisition_error = None
+            self.stopping = False
+            self.acquisition = threading.Thread(target=self._acquisition_loop, name='Acquisition')
+            self.acquisition.daemon = True
+            self.acquisition.start()
+
+    def _acquisition_loop(self):
+        try:
+            # the first block tells the data type, the following ones
+            # are read into a reused buffer that holds as many samples
+            # as the ring
+            out = None
+            while not self.stopping:
+                data, marker, duration = self._acquire(out)
+                self.sample_ring.write(data, [[duration + m[0], m[1]] for m in marker])
+                if out is None and len(data) > 0:
+                    out = np.empty((self.sample_ring.capacity, data.shape[1]), dtype=data.dtype)
+        except Exception as e:
+            self.acquisition_error = e
+            logger.error('Acquisition failed.', exc_info=True)
+        finally:
+            self.sample_ring.close()
 
     def stop(self):
+        # stop the acquisition thread before the amp
+        if self.acquisition is not None:
+            self.stopping = True
+            self.acquisition.join()
+            self.acquisition = None
+            if self.sample_ring.overruns > 0:
+                logger.warning('Lost %d samples, get_data was not called often enough.' % self.sample_ring.overruns)
+            if self.write_to_file:
+                self.writer.update_meta({'Overrun Samples': self.sample_ring.overruns})
         # stop the amp
         self.amp.stop()
+        if self.broadcast is not None:
+            self.broadcast.close()
         # stop the marker server
-        self.tcp_reader_running.clear()
-
-        logger.debug('Waiting for marker server process to stop...')
-        logger.debug('Using Dirty Hack and Send a KeyboardInterrupt (Linux Only for now): ...')
-
-        # try to send a keyboard CTRL-C to the process...
-        pid = self.tcp_reader.pid
-        os.kill(pid, signal.SIGINT)
-
-        self.tcp_reader.join()
-        logger.debug('Marker server process stopped.')
+        logger.debug('Waiting for marker server to stop...')
+        self.marker_server.stop()
+        logger.debug('Marker server stopped.')
+        marker_stats = self.marker_stats()
+        if marker_stats['dropped'] > 0:
+            logger.warning('Dropped %d markers, the marker ring was full.' % marker_stats['dropped'])
+        self.marker_ring.close()
         # close the files
         if self.write_to_file:
+            self.writer.update_meta({'Marker Statistics': marker_stats})
             logger.debug('Closing files.')
-            for fh in self.fh_eeg, self.fh_marker, self.fh_meta:
-                fh.close()
+            self.writer.close()
+            logger.debug('Writer stats: %s' % self.writer.stats())
         print('amplifier stopped!')
 
     def configure(self, **kwargs):
         self.amp.configure(**kwargs)
 
-    def get_data(self):
+    def marker_stats(self):
+        """Return the statistics of the network markers.
+
+        The statistics can be queried while the amplifier is running
+        and are stored in the meta data of the recording, when the
+        amplifier is stopped.
+
+        Returns
+        -------
+        stats : dict
+            the counters of
+            :meth:`libmushu.ringbuffer.MarkerRing.counters` and ``late``,
+            the number of markers that arrived after the block of data
+            they belong to was returned
+
+        """
+        stats = self.marker_ring.counters()
+        stats['late'] = self.late_markers
+        return stats
+
+    def get_data(self, timeout=None):
         """Get data from the amplifier.
 
         This method is supposed to get called as fast as possible (i.e
         hundreds of times per seconds) and returns the data and the
         markers.
 
+        If the amplifier was started with ``background=True``, this
+        method returns all data and markers acquired since the last
+        call. It blocks until there is data or the timeout expired.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            the maximum time in seconds to wait for data in background
+            mode, forever if None
+
         Returns
         -------
         data : 2darray
@@ -222,36 +311,291 @@ class AmpDecorator(Amplifier):
             marker from the last block and a marker for a future block
             respectively.
 
+        Raises
+        ------
+        IOError :
+            if the background acquisition failed
+
         """
-        # get data and marker from underlying amp
-        data, marker = self.amp.get_data()
+        return self._get_data(timeout)
+
+    def get_data_into(self, out, timeout=None):
+        """Get data from the amplifier into a preallocated array.
+
+        Like :meth:`get_data`, but the samples are written into ``out``,
+        see :meth:`libmushu.amplifier.Amplifier.get_data_into`. In
+        background mode, samples that do not fit into ``out`` are
+        returned by the next call.
+
+        Parameters
+        ----------
+        out : 2darray
+            the array (time, channels) the samples are written to
+        timeout : float, optional
+            see :meth:`get_data`
+
+        Returns
+        -------
+        n : int
+            the number of samples, the data is ``out[:n]``
+        markers : list of (float, str)
+            see :meth:`get_data`
+
+        """
+        data, marker = self._get_data(timeout, out)
+        return len(data), marker
 
-        t = time.time()
-        # length in sec of the new block according to #samples and fs
-        block_duration = len(data) / self.amp.get_sampling_frequency()
+    async def aget_data(self):
+        """Get data from the amplifier without blocking the event loop.
+
+        The coroutine version of :meth:`get_data`, it needs the
+        amplifier to be started with ``background=True``. It waits
+        until the acquisition thread has data and wakes up the event
+        loop via ``call_soon_threadsafe``, so many amplifiers and the
+        marker server (``marker_server='loop'``) can share one event
+        loop without a thread per call.
+
+        Returns
+        -------
+        data : 2darray
+            all data acquired since the last call, empty if the
+            amplifier was stopped
+        markers : list of (float, str)
+            see :meth:`get_data`
+
+        Raises
+        ------
+        RuntimeError :
+            if the amplifier was not started in background mode
+        IOError :
+            if the background acquisition failed
+
+        """
+        ring = self._async_ring()
+        await _wait_ready(ring)
+        return self._read(ring)
+
+    async def astream(self):
+        """Iterate over the data of the amplifier in an event loop.
+
+        Yields the blocks of :meth:`aget_data` until the amplifier is
+        stopped::
+
+            amp.start(marker_server='loop', background=True)
+            async for data, markers in amp.astream():
+                process(data, markers)
+
+        Yields
+        ------
+        data : 2darray
+        markers : list of (float, str)
+
+        Raises
+        ------
+        RuntimeError :
+            if the amplifier was not started in background mode
+        IOError :
+            if the background acquisition failed
+
+        """
+        ring = self._async_ring()
+        while True:
+            await _wait_ready(ring)
+            data, marker = self._read(ring)
+            if len(data) == 0 and not marker and ring.closed:
+                return
+            yield data, marker
+
+    def _async_ring(self):
+        if self.acquisition is None:
+            raise RuntimeError('The asyncio interface needs the amplifier to be started with background=True.')
+        return self.sample_ring
+
+    def _get_data(self, timeout=None, out=None):
+        if self.acquisition is None:
+            data, marker, duration = self._acquire(out)
+            return data, [[m[0] / NS_PER_MS, m[1]] for m in marker]
+        return self._read(self.sample_ring, timeout, out)
+
+    def _read(self, ring, timeout=0, out=None):
+        # read the samples of the background acquisition
+        data, marker, start, overrun = ring.read(timeout, out)
+        if overrun > 0:
+            logger.warning('Lost %d samples, get_data was not called often enough.' % overrun)
+        if len(data) == 0 and not marker and self.acquisition_error is not None:
+            raise IOError('The acquisition failed: %s' % self.acquisition_error)
+        # the markers are relative to the first sample of the session
+        onset = samples_to_ns(start, self.amp.get_sampling_frequency())
+        return data, [[(m[0] - onset) / NS_PER_MS, m[1]] for m in marker]
+
+    def _acquire(self, out=None):
+        """Get a block of data and markers from the amplifier.
+
+        The data and markers are written to the files.
+
+        Parameters
+        ----------
+        out : 2darray, optional
+            if given, the amplifier writes the data into it
+
+        Returns
+        -------
+        data : 2darray
+        marker : list of (int, str)
+            the markers in ns relative to the onset of the block
+        duration : int
+            the duration of all previous blocks in ns
+
+        """
+        # get data and marker from underlying amp
+        if out is None:
+            data, marker = self.amp.get_data()
+        else:
+            n, marker = self.amp.get_data_into(out)
+            data = out[:n]
+
+        t = now_ns()
+        fs = self.amp.get_sampling_frequency()
         # abs time of start of the block
-        t0 = t - block_duration
-        # duration of all blocks in ms except the current one
-        duration = 1000 * self.received_samples / self.amp.get_sampling_frequency()
-
-
-        # merge markers
-        tcp_marker = []
-        while not self.marker_queue.empty():
-            m = self.marker_queue.get()
-            print(m)
-            m[0] = (m[0] - t0) * 1000
-            tcp_marker.append(m)
-        marker = sorted(marker + tcp_marker)
+        t0 = t - samples_to_ns(len(data), fs)
+        # duration of all blocks in ns except the current one
+        duration = samples_to_ns(self.received_samples, fs)
+        if self.write_to_file and self.received_samples == 0 and len(data) > 0:
+            monotonic, wall = wall_clock_mapping()
+            self.writer.update_meta({'Clock': {'Source': 'time.perf_counter_ns',
+                                               'Monotonic ns': monotonic,
+                                               'Wall Clock ns': wall,
+                                               'First Sample ns': t0,
+                                               }})
+
+        # merge markers, all marker arithmetic is done in integer ns
+        # relative to the onset of the block
+        marker = [[int(round(m[0] * NS_PER_MS)), m[1]] for m in marker]
+        network_marker = [[m[0] - t0, m[1]] for m in self.marker_ring.drain()]
+        if self.received_samples > 0:
+            self.late_markers += sum(1 for m in network_marker if m[0] < 0)
+        marker += network_marker
+        marker.sort(key=lambda m: m[0])
+        dropped = self.marker_ring.dropped
+        if dropped != self.reported_drops:
+            logger.warning('Dropped %d markers, the marker ring was full.' % (dropped - self.reported_drops))
+            self.reported_drops = dropped
         # save data to files
         if self.write_to_file:
-            for m in marker:
-                self.fh_marker.write("%f %s\n" % (duration + m[0], m[1]))
-            self.fh_eeg.write(struct.pack("f"*data.size, *data.flatten()))
+            block = data
+            if out is not None and isinstance(self.writer, ThreadedWriter):
+                # the caller reuses out, the writer thread must get a
+                # block that is not modified anymore
+                block = data.copy()
+            self.writer.write(block, [[(duration + m[0]) / NS_PER_MS, m[1]] for m in marker])
+        if self.broadcast is not None:
+            self.broadcast.write(data, [[duration + m[0], m[1]] for m in marker])
         self.received_samples += len(data)
         if len(data) == 0 and len(marker) > 0:
             logger.error('Received marker but no data. This is an error, the amp should block on get_data until data is available. Marker timestamps will be unreliable.')
-        return data, marker
+        return data, marker, duration
+
+    def stream(self, block_samples, hop=None):
+        """Iterate over fixed size windows of the data.
+
+        The amplifier returns blocks of whatever size it has, this
+        generator re-chunks them into windows of exactly
+        ``block_samples`` samples, the start of consecutive windows
+        ``hop`` samples apart. The data is collected in an internal
+        buffer, in background mode with :meth:`get_data_into`; each
+        window is a view of this buffer, no arrays are concatenated.
+        The buffer grows if a consumer stalls long enough for the amp
+        to return a block that does not fit.
+
+        Parameters
+        ----------
+        block_samples : int
+            the number of samples of a window
+        hop : int, optional
+            the number of samples between the starts of two windows,
+            ``block_samples`` if None. Smaller values make the windows
+            overlap, larger ones skip samples.
+
+        Yields
+        ------
+        data : 2darray
+            the window (time, channels). It is only valid until the
+            next window is requested, copy it to keep it.
+        markers : list of (float, str)
+            the markers in ms relative to the onset of the window. A
+            marker is part of every window it falls into. Markers that
+            did not fall into any window, because they arrived too late
+            or were skipped by the hop, are part of the next window
+            with a negative time.
+
+        Examples
+        --------
+
+        Windows of one second, every 100ms:
+
+        >>> amp.start()
+        >>> for data, markers in amp.stream(1000, hop=100):
+        ...     process(data, markers)
+
+        """
+        if hop is None:
+            hop = block_samples
+        if block_samples < 1 or hop < 1:
+            raise ValueError('block_samples and hop must be positive.')
+        fs = self.get_sampling_frequency()
+        # the buffer has room for a window, a hop and two seconds of
+        # blocks from the amp, and for the first block, which holds
+        # everything acquired since start
+        slack = max(int(math.ceil(2 * fs)), 1)
+        data, marker = self.get_data()
+        capacity = max(block_samples + hop, len(data)) + slack
+        buf = np.empty((capacity, data.shape[1]), dtype=data.dtype)
+        buf[:len(data)] = data
+        # the sample number of buf[0], the end of the data in buf and
+        # the sample number of the next window
+        base, end, start = 0, len(data), 0
+        # the pending markers as [ns since the first sample, label,
+        # emitted]
+        pending = [[int(round(m[0] * NS_PER_MS)), m[1], False] for m in marker]
+        while True:
+            pending.sort(key=lambda m: m[0])
+            while start + block_samples <= base + end:
+                onset = samples_to_ns(start, fs)
+                window_end = samples_to_ns(start + block_samples, fs)
+                markers = []
+                for m in pending:
+                    if m[0] >= window_end:
+                        break
+                    if m[0] >= onset or not m[2]:
+                        markers.append([(m[0] - onset) / NS_PER_MS, m[1]])
+                        m[2] = True
+                yield buf[start-base:start-base+block_samples], markers
+                start += hop
+                next_onset = samples_to_ns(start, fs)
+                pending = [m for m in pending if not (m[2] and m[0] < next_onset)]
+            if capacity - end < slack:
+                # drop the samples before the next window
+                drop = min(start - base, end)
+                buf[:end-drop] = buf[drop:end]
+                base += drop
+                end -= drop
+            if self.acquisition is None:
+                # in foreground mode the size of a block is only known
+                # after reading it, grow the buffer if a stalled
+                # consumer let the amp collect more than fits
+                data, marker = self.get_data()
+                n = len(data)
+                if n > capacity - end:
+                    capacity = end + n + slack
+                    grown = np.empty((capacity, buf.shape[1]), dtype=buf.dtype)
+                    grown[:end] = buf[:end]
+                    buf = grown
+                buf[end:end+n] = data
+            else:
+                n, marker = self.get_data_into(buf[end:])
+            onset = samples_to_ns(base + end, fs)
+            pending += [[onset + int(round(m[0] * NS_PER_MS)), m[1], False] for m in marker]
+            end += n
 
     def get_channels(self):
         return self.amp.get_channels()
@@ -260,127 +604,36 @@ class AmpDecorator(Amplifier):
         return self.amp.get_sampling_frequency()
 
 
-def handle_data(queue, data):
-    # do the time-stamp thingy + put it into the queue.
-    timestamp = time.time()
-    markertext = data.decode("utf-8")
-    queue.put([timestamp, markertext])
-    print("%d" % queue.qsize())
-
-    # then print it out... hehe
-    item=queue.get()
-    queue.put(item)
-    print(item)
-
-
-def marker_reader(queue, running, ready):
-    # define our UDP class , which includes what to actually DO with the data:
-    # this also kind-of uses the async/await stuff!
-
-    # so if I wanna pass stuff on to a queue, I'd have to give the queue as an input argument, so we can put stuff on it, right?
-    # put the queue in dunder init
-    # why isn't this subclassed?
-    # copy/paste the following from the examples on asyncio in python docs. We also tested these.
-    class EchoServerProtocol(asyncio.DatagramProtocol):
-        # i'll just define a setter method to pass on the queue. Man.
-        def __init__(self, queue):
-            self.queue = queue
-
-        def set_queue(self, queue):
-            self.queue.queue
-
-        def connection_made(self, transport):
-            self.transport = transport
-
-        def datagram_received(self, data, addr):
-            message = data.decode()
-            print('Received %r from %s' % (message, addr))
-            print('Send %r to %s' % (message, addr))
-            self.transport.sendto(data, addr)
-
-            # so -- instead of echo-ing some stuff -- move the queue forward to
-            # -- or IN ADDITION TO echo-ing --> handle the data.
-            # data handler, along with the data.
-            handle_data(queue, data)
-
-    # Define also the TCP class, with also a 'data handler'
-    # put the queue in dunder init
-    class EchoServerClientProtocol(asyncio.Protocol):
-        def __init__(self, queue):
-            self.queue = queue
-
-        def set_queue(self, queue):
-            self.queue = queue
-
-        def connection_made(self, transport):
-            peername = transport.get_extra_info('peername')
-            print('Connection from {}'.format(peername))
-            self.transport = transport
-
-        def data_received(self, data):
-            message = data.decode()
-            print('Data received: {!r}'.format(message))
-
-            print('Send: {!r}'.format(message))
-            self.transport.write(data)
-
-            print('Close the client socket')
-            self.transport.close()
-
-            # OK and then:
-            handle_data(queue, data)
-
-    # get our event loop from asyncio -- not our own event loop stuff as shown in the youtube video:
-    # it's still a bit esotheric.
-    loop = asyncio.get_event_loop()
-
-    # add stuff to the loop. First the UDP:
-    # One protocol instance will be created to serve all client requests
-    # transport is a coroutine?
-    print("Starting UDP server")
-    listen = loop.create_datagram_endpoint(
-        lambda: EchoServerProtocol(queue), local_addr=('127.0.0.1', PORT))
-    transport, protocol = loop.run_until_complete(listen)
-
-    # then the TCP: -- why one is called a coro, and another is called 'listen', I do not know.
-    # I also wish to check whether
-    print("Starting TCP server")
-    # the docs of asyncio are abhorrent. According to docs, this returns a server object.
-    # but a server object is apparently also a coroutine?
-    coro = loop.create_server(lambda: EchoServerClientProtocol(queue), '127.0.0.1', PORT)
-    server = loop.run_until_complete(coro)
-
-    # hmmm... we CAN change things so that TCP and UDP should use different ports.
-    # do UDP and TCP use different ports to begin with??
-    # OK... so this works quite well. Was easier than I thought. It all works nicely concurrently, too.
-    # so I just need to Methodify this, match to what's written in mushu, and pass on the multiprocessing queue?
-
-    # try that...
-
-    # say that we're ready.
-    ready.set()
-
-    print("starting...")
-
-    try:
-        loop.run_forever()
-    except KeyboardInterrupt:
-        pass
+async def _wait_ready(ring):
+    """Wait until a :class:`libmushu.ringbuffer.SampleRing` can be read
+    without blocking.
 
+    The producer thread wakes up the running event loop via
+    ``call_soon_threadsafe``.
 
+    Parameters
+    ----------
+    ring : SampleRing
 
-    print("stopping...")
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
 
-    # closing statements -- do we need those?:
-    # close the transport:
-    # transport.close() .. hmm apparently, we won't have to 'close' the transport?
-    # loop.run_until_complete(transport.wait_closed()) # does this make sense --> NO
+    def wake():
+        try:
+            loop.call_soon_threadsafe(_set_ready, future)
+        except RuntimeError:
+            # the loop was closed
+            pass
 
-    # Close the server
-    # TCP:
-    server.close()
-    loop.run_until_complete(server.wait_closed())
+    ring.add_listener(wake)
+    try:
+        if not ring.ready():
+            await future
+    finally:
+        ring.remove_listener(wake)
 
-    # close the loop, plz?
-    loop.close()
 
+def _set_ready(future):
+    if not future.done():
+        future.set_result(None)
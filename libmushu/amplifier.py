@@ -145,6 +145,42 @@ class Amplifier(object):
         """
         pass
 
+    def get_data_into(self, out):
+        """Get data from the amplifier into a preallocated array.
+
+        Like :meth:`get_data`, but the samples are written into ``out``
+        instead of a new array, so a caller that reuses the same array
+        does not allocate memory for every block.
+
+        This generic implementation copies the result of
+        :meth:`get_data`. Derived classes should override it if they can
+        write their samples into ``out`` directly.
+
+        Parameters
+        ----------
+        out : ndarray
+            a numpy array (time, channels), the samples are written to
+            its first rows. It must be large enough for the largest
+            block the amplifier returns.
+
+        Returns
+        -------
+        n : int
+            the number of samples, the data is ``out[:n]``
+        markers : list of (float, str)
+            the markers, see :meth:`get_data`
+
+        Raises
+        ------
+        ValueError :
+            if the block does not fit into ``out``
+
+        """
+        data, markers = self.get_data()
+        check_block(len(data), out)
+        out[:len(data)] = data
+        return len(data), markers
+
     def get_channels(self):
         """Return the list of channel names.
 
@@ -189,3 +225,11 @@ class Amplifier(object):
         """
         raise NotImplementedError
 
+
+def check_block(samples, out):
+    """Raise a ValueError if a block of samples does not fit into
+    ``out``.
+
+    """
+    if samples > len(out):
+        raise ValueError('A block of %d samples does not fit into the buffer of %d samples.' % (samples, len(out)))
@@ -0,0 +1,125 @@
+# clock.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides the clock all of mushu's timing is based on.
+
+:func:`now_ns` returns the time of a monotonic, high resolution clock
+(:func:`time.perf_counter_ns`, i.e. ``CLOCK_MONOTONIC`` on Linux and
+the performance counter on Windows) as integer nanoseconds. Unlike
+:func:`time.time` it does not step when the wall clock is adjusted, and
+integers keep the arithmetic exact even over long sessions. The clock
+is system wide, so timestamps taken in different processes, e.g. by the
+marker server, can be compared.
+
+The clock has an arbitrary epoch. :func:`wall_clock_mapping` relates it
+to the wall clock, the mapping is stored in the meta data of a
+recording.
+
+"""
+
+from __future__ import division
+
+import time
+from fractions import Fraction
+
+
+NS_PER_S = 10**9
+NS_PER_MS = 10**6
+
+now_ns = time.perf_counter_ns
+
+
+def wall_clock_mapping(tries=5):
+    """Return a pair of simultaneous monotonic and wall clock times.
+
+    Both clocks are read several times, the pair with the smallest
+    uncertainty is returned.
+
+    Returns
+    -------
+    monotonic_ns, wall_ns : int
+        the time of :func:`now_ns` and of :func:`time.time_ns` at the
+        same moment
+
+    """
+    best = None
+    for i in range(tries):
+        t0 = now_ns()
+        wall = time.time_ns()
+        t1 = now_ns()
+        if best is None or t1 - t0 < best[0]:
+            best = t1 - t0, (t0 + t1) // 2, wall
+    return best[1], best[2]
+
+
+def realtime_to_ns(realtime_ns):
+    """Convert a wall clock time to the monotonic clock.
+
+    Use it for timestamps taken by the operating system on the wall
+    clock, e.g. kernel receive timestamps of packets.
+
+    Parameters
+    ----------
+    realtime_ns : int
+        the wall clock time in ns since the epoch
+
+    Returns
+    -------
+    t : int
+        the corresponding time of :func:`now_ns`
+
+    """
+    return realtime_ns - time.time_ns() + now_ns()
+
+
+def samples_to_ns(samples, fs):
+    """Return the duration of a number of samples in ns, exactly rounded.
+
+    Parameters
+    ----------
+    samples : int
+    fs : int, float or Fraction
+        the sampling frequency
+
+    Returns
+    -------
+    duration : int
+
+    """
+    fs = Fraction(fs)
+    return round(Fraction(samples * NS_PER_S * fs.denominator, fs.numerator))
+
+
+def ns_to_samples(duration, fs):
+    """Return the number of complete samples in a duration.
+
+    Parameters
+    ----------
+    duration : int
+        the duration in ns
+    fs : int, float or Fraction
+        the sampling frequency
+
+    Returns
+    -------
+    samples : int
+
+    """
+    fs = Fraction(fs)
+    return duration * fs.numerator // (NS_PER_S * fs.denominator)
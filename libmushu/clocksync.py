@@ -0,0 +1,188 @@
+# clocksync.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides the clock synchronization between marker clients
+and the marker server.
+
+Markers timestamped on arrival at the server carry the network jitter.
+Instead, a client can timestamp its markers with its own monotonic
+clock and synchronize this clock with the server, like NTP does:
+
+    1. the client sends a sync request with its time ``t1``
+    2. the server receives it at ``t2`` and replies with ``t1``, ``t2``
+       and its time ``t3`` when sending the reply
+    3. the client receives the reply at ``t4`` and reports all four
+       times back to the server
+
+From the four times the server estimates the offset between the
+clocks, ``((t2 - t1) + (t3 - t4)) / 2``, and the round trip delay,
+``(t4 - t1) - (t3 - t2)``. :class:`ClockSync` collects these estimates
+per client, keeps the ones with the smallest delay and fits offset and
+drift, so the client's marker times can be mapped onto the server's
+clock.
+
+The messages are text lines starting with :data:`CONTROL`, followed by
+a command character, the client id and the arguments, separated by
+spaces:
+
+    * ``S <id> <t1>``: sync request, the server replies with
+      ``S <id> <t1> <t2> <t3>``
+    * ``O <id> <t1> <t2> <t3> <t4>``: report of a completed exchange
+    * ``T <id> <t> <label>``: a marker with the client time ``t``
+
+"""
+
+from __future__ import division
+
+import collections
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+CONTROL = '\x01'
+SYNC = 'S'
+REPORT = 'O'
+TIMESTAMPED = 'T'
+
+
+class ClockSync(object):
+    """Estimate the offset and drift of a client's clock.
+
+    Parameters
+    ----------
+    window : int, optional
+        the number of exchanges to keep
+    min_span : float, optional
+        the drift is only estimated if the kept exchanges span at least
+        this many seconds, otherwise the clocks are assumed to run at
+        the same rate
+
+    """
+
+    def __init__(self, window=64, min_span=10):
+        self.exchanges = collections.deque(maxlen=window)
+        self.min_span = min_span
+        self.offset = None
+        self.drift = 0.
+        self.t_ref = 0.
+
+    def add(self, t1, t2, t3, t4):
+        """Add a completed exchange and update the estimate.
+
+        Parameters
+        ----------
+        t1, t4 : float
+            the client times of sending the request and receiving the
+            reply
+        t2, t3 : float
+            the server times of receiving the request and sending the
+            reply
+
+        """
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        delay = (t4 - t1) - (t3 - t2)
+        if delay < 0:
+            logger.warning('Ignoring clock sync exchange with negative delay.')
+            return
+        self.exchanges.append(((t1 + t4) / 2, offset, delay))
+        self._estimate()
+
+    def _estimate(self):
+        t, offset, delay = np.array(self.exchanges).T
+        # exchanges with a small round trip delay are the most accurate,
+        # keep the better half
+        best = delay <= np.median(delay)
+        t, offset = t[best], offset[best]
+        self.t_ref = t.mean()
+        if len(t) >= 4 and t.max() - t.min() >= self.min_span:
+            self.drift, self.offset = np.polyfit(t - self.t_ref, offset, 1)
+        else:
+            self.drift, self.offset = 0., offset.mean()
+
+    @property
+    def synced(self):
+        """True if at least one exchange was completed."""
+        return self.offset is not None
+
+    def to_server(self, t):
+        """Map a client time onto the server's clock.
+
+        Parameters
+        ----------
+        t : float
+            the client time
+
+        Returns
+        -------
+        t : float
+            the server time, or None if the client is not synced yet
+
+        """
+        if self.offset is None:
+            return None
+        return t + self.offset + self.drift * (t - self.t_ref)
+
+
+def format_message(command, client_id, *args):
+    """Format a control message.
+
+    Parameters
+    ----------
+    command : str
+        one of :data:`SYNC`, :data:`REPORT` and :data:`TIMESTAMPED`
+    client_id : str
+        the id of the client, must not contain spaces
+    args :
+        the arguments, floats are formatted without loss of precision
+
+    Returns
+    -------
+    message : str
+
+    """
+    args = [repr(float(a)) if isinstance(a, float) else str(a) for a in args]
+    return CONTROL + ' '.join([command, client_id] + args)
+
+
+def parse_message(message):
+    """Parse a control message.
+
+    Parameters
+    ----------
+    message : str
+        the message including the leading :data:`CONTROL`
+
+    Returns
+    -------
+    command : str
+    client_id : str
+    args : list of str
+        the arguments, for :data:`TIMESTAMPED` the time and the
+        label, which may contain spaces
+
+    """
+    command, client_id, rest = (message[1:].split(' ', 2) + ['', ''])[:3]
+    if command == TIMESTAMPED:
+        return command, client_id, rest.split(' ', 1)
+    return command, client_id, rest.split()
@@ -18,12 +18,12 @@
 from __future__ import division
 
 import time
-import math
 import json
 
 import numpy as np
 
-from libmushu.amplifier import Amplifier
+from libmushu.amplifier import Amplifier, check_block
+from libmushu.clock import now_ns, ns_to_samples, samples_to_ns, NS_PER_S
 
 
 PRESETS = [
@@ -43,26 +43,41 @@ class RandomAmp(Amplifier):
         self.fs = 100
 
     def start(self):
-        self.last_sample = time.time()
+        self.t_start = now_ns()
+        self.samples_sent = 0
+        self.rng = np.random.default_rng()
+        self.noise = np.empty((0, self.channels))
 
-    @property
-    def sample_len(self):
-        return 1 / self.fs
+    def due_samples(self):
+        # simulate blocking until we have enough data
+        elapsed = now_ns() - self.t_start
+        if ns_to_samples(elapsed, self.fs) <= self.samples_sent:
+            time.sleep((samples_to_ns(self.samples_sent + 1, self.fs) - elapsed) / NS_PER_S)
+        # ready, send all samples due by now. The sample times are
+        # derived from the start time, so they do not drift.
+        return ns_to_samples(now_ns() - self.t_start, self.fs) - self.samples_sent
 
     def get_data(self):
-        # simulate blocking until we have enough data
-        elapsed = time.time() - self.last_sample
-        if elapsed < self.sample_len:
-            time.sleep(self.sample_len - elapsed)
-        # ready
-        dt = time.time() - self.last_sample
-        samples = math.floor(self.fs * dt)
-        # actual time according to number of samples we're sending out
-        dt = samples / self.fs
+        samples = self.due_samples()
         data = np.random.randint(0, 1024, (samples, self.channels))
-        self.last_sample += dt
+        self.samples_sent += samples
         return data, []
 
+    def get_data_into(self, out):
+        samples = self.due_samples()
+        check_block(samples, out)
+        # draw the noise into a reused array, the same distribution as
+        # randint(0, 1024)
+        if len(self.noise) < samples:
+            self.noise = np.empty((max(samples, len(out)), self.channels))
+        noise = self.noise[:samples]
+        self.rng.random(out=noise)
+        noise *= 1024
+        np.floor(noise, out=noise)
+        out[:samples] = noise
+        self.samples_sent += samples
+        return samples, []
+
     def configure(self, fs, channels):
         self.fs = fs
         self.channels = channels
@@ -2,11 +2,10 @@
 
 from __future__ import division
 
-import time
-
 import numpy as np
 
-from libmushu.amplifier import Amplifier
+from libmushu.amplifier import Amplifier, check_block
+from libmushu.clock import now_ns, ns_to_samples, samples_to_ns, NS_PER_MS
 
 
 class ReplayAmp(Amplifier):
@@ -38,9 +37,12 @@ class ReplayAmp(Amplifier):
         self.data = data
         # slow python
         self.marker = marker
-        # fast numpy
-        self.marker_ts = np.array([ts for ts, s in marker])
-        self.marker_s = np.array([s for ts, s in marker])
+        # fast numpy, the marker times in ns since the first sample,
+        # sorted so each block's markers are a slice
+        marker_ns = np.round(np.array([ts for ts, s in marker], dtype=np.float64) * NS_PER_MS).astype(np.int64)
+        order = np.argsort(marker_ns, kind='stable')
+        self.marker_ns = marker_ns[order]
+        self.marker_s = np.array([s for ts, s in marker])[order]
         self.channels = channels
         self.fs = fs
         self.realtime = realtime
@@ -54,8 +56,10 @@ class ReplayAmp(Amplifier):
             self.samples = blocksize_samples
 
     def start(self):
-        self.last_sample_time = time.time()
+        self.t_start = now_ns()
         self.pos = 0
+        # the index of the next marker
+        self.marker_pos = 0
 
     def stop(self):
         pass
@@ -69,34 +73,41 @@ class ReplayAmp(Amplifier):
         first sample of that block.
 
         """
-        if self.realtime:
-            elapsed = time.time() - self.last_sample_time
-            blocks = (self.fs * elapsed) // self.samples
-            samples = blocks * self.samples
-        else:
-            samples = self.samples
-        elapsed = samples / self.fs
-        self.last_sample_time += elapsed
-        # data
+        samples = self.block_samples()
         chunk = self.data[self.pos:self.pos+samples]
-        #self.data = self.data[samples:]
-        # markers
-
-        # slow python version
-        #markers = [x for x in self.marker if x[0] < elapsed * 1000]
-        #self.marker = [x for x in self.marker if x[0] >= elapsed * 1000]
-        #self.marker = [[x[0] - elapsed * 1000, x[1]] for x in self.marker]
-
-        # fast numpy version
-        mask = self.marker_ts < (elapsed * 1000)
-        markers = zip(self.marker_ts[mask], self.marker_s[mask])
-        self.marker_ts = self.marker_ts[~mask]
-        self.marker_s = self.marker_s[~mask]
-        self.marker_ts -= elapsed * 1000
-
+        markers = self.block_markers(samples)
         self.pos += samples
         return chunk, markers
 
+    def get_data_into(self, out):
+        samples = self.block_samples()
+        chunk = self.data[self.pos:self.pos+samples]
+        check_block(len(chunk), out)
+        out[:len(chunk)] = chunk
+        markers = self.block_markers(samples)
+        self.pos += samples
+        return len(chunk), markers
+
+    def block_samples(self):
+        """Return the number of samples of the next block."""
+        if self.realtime:
+            # the complete blocks due by now
+            due = ns_to_samples(now_ns() - self.t_start, self.fs) - self.pos
+            return due // self.samples * self.samples
+        return self.samples
+
+    def block_markers(self, samples):
+        """Return the markers of the next block of ``samples`` samples."""
+        # the block boundaries are computed in integer ns so they do
+        # not accumulate rounding errors
+        onset = samples_to_ns(self.pos, self.fs)
+        end = int(np.searchsorted(self.marker_ns, samples_to_ns(self.pos + samples, self.fs)))
+        if end == self.marker_pos:
+            return []
+        i = slice(self.marker_pos, end)
+        self.marker_pos = end
+        return [list(m) for m in zip(((self.marker_ns[i] - onset) / NS_PER_MS).tolist(), self.marker_s[i].tolist())]
+
     def get_channels(self):
         return self.channels
 
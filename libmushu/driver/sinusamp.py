@@ -18,12 +18,12 @@
 from __future__ import division
 
 import time
-import math
 import json
 
 import numpy as np
 
-from libmushu.amplifier import Amplifier
+from libmushu.amplifier import Amplifier, check_block
+from libmushu.clock import now_ns, ns_to_samples, samples_to_ns, NS_PER_S
 
 
 PRESETS = [['Sine wave at 50Hz, 16Channels', {'f' : 1, 'fs' : 10, 'channels' : 16}],
@@ -37,29 +37,45 @@ class SinusAmp(Amplifier):
     def __init__(self):
         self.presets = PRESETS
         self.configure(**self.presets[0][1])
-        self.last_sample = time.time()
+        self.start()
 
-    @property
-    def sample_len(self):
-        return 1 / self.fs
+    def start(self):
+        self.t_start = now_ns()
+        self.samples_sent = 0
+        self.phase = np.empty(0)
+        self.indices = np.empty(0)
 
-    @property
-    def elapsed(self):
-        return time.time() - self.last_sample
+    def due_samples(self):
+        # simulate blocking until we have enough data
+        elapsed = now_ns() - self.t_start
+        if ns_to_samples(elapsed, self.fs) <= self.samples_sent:
+            time.sleep((samples_to_ns(self.samples_sent + 1, self.fs) - elapsed) / NS_PER_S)
+        return ns_to_samples(now_ns() - self.t_start, self.fs) - self.samples_sent
 
     def get_data(self):
-        # simulate blocking until we have enough data
-        elapsed = self.elapsed
-        if elapsed < self.sample_len:
-            time.sleep(self.sample_len - elapsed)
-        dt = self.elapsed
-        samples = math.floor(self.fs * dt)
-        t = np.linspace(self.last_sample, self.last_sample + dt, samples)
+        samples = self.due_samples()
+        # the time of each sample in s since the start
+        t = (self.samples_sent + np.arange(samples)) / self.fs
         t = np.array([t for i in range(self.channels)]).T
         data = np.sin(np.pi*2*t*self.f)
-        self.last_sample = time.time()
+        self.samples_sent += samples
         return data, []
 
+    def get_data_into(self, out):
+        samples = self.due_samples()
+        check_block(samples, out)
+        # compute the phase in reused arrays
+        if len(self.phase) < samples:
+            self.indices = np.arange(max(samples, len(out)), dtype=np.float64)
+            self.phase = np.empty(len(self.indices))
+        phase = self.phase[:samples]
+        np.add(self.indices[:samples], self.samples_sent, out=phase)
+        phase *= np.pi * 2 * self.f / self.fs
+        np.sin(phase, out=phase)
+        out[:samples] = phase[:, np.newaxis]
+        self.samples_sent += samples
+        return samples, []
+
     def configure(self, f, fs, channels):
         self.f = f
         self.fs = fs
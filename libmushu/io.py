@@ -0,0 +1,490 @@
+# io.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides :class:`Recording`, a reader for the files written
+by :class:`libmushu.ampdecorator.AmpDecorator`.
+
+The data is memory mapped, so opening a recording is instant and only
+the parts of the file that are actually accessed are read from disk.
+This allows for constant-memory passes over recordings much larger than
+the available RAM::
+
+    from libmushu.io import Recording
+
+    rec = Recording('foo')
+    # iterate over the recording in blocks of 1000 samples
+    for data, markers in rec.chunks(1000):
+        ...
+    # get the data and markers between 10s and 12s
+    data, markers = rec.window(10000, 12000)
+
+Markers are looked up in the ``.markeridx`` sidecar (see
+:mod:`libmushu.markerindex`), their timestamps are therefore aligned to
+the sample grid. For recordings without a sidecar the index is built
+from the ``.marker`` text file, use :func:`rebuild_marker_index` to save
+it for the next time.
+
+Segmented recordings are read as one recording: :attr:`Recording.data`
+behaves like one array spanning all segments and slices within a segment
+are still memory mapped views. Use :meth:`Recording.segment` to process
+the segments independently, e.g. one worker per segment.
+
+Recordings that were not closed properly (e.g. because the recording
+process crashed) can be recovered with :func:`recover`, or by opening
+them with ``autorecover=True``.
+
+Recordings written by older versions of mushu (headerless float32
+``.eeg`` files) are supported as well.
+
+"""
+
+from __future__ import division
+
+import os
+import json
+import math
+import time
+import logging
+
+import numpy as np
+
+from libmushu.writer import read_header, pack_header, read_checkpoint, checkpoint_locked, HEADER_SIZE
+from libmushu.markerindex import MarkerIndex
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+# without fcntl, recover refuses checkpoints younger than this many
+# seconds, their writer may still be alive
+RECOVER_AGE = 10.
+
+
+class Recording(object):
+    """A recording opened for reading.
+
+    Parameters
+    ----------
+    filename : str
+        the base name of the recording, i.e. without the ``.eeg``,
+        ``.marker`` and ``.meta`` extensions
+    autorecover : bool, optional
+        if True and the recording has a checkpoint, i.e. it was not
+        closed properly, it is recovered via :func:`recover` first.
+        Otherwise such a recording is opened as it is, its header may
+        not contain the samples written since the last checkpoint.
+
+    Attributes
+    ----------
+    data : 2darray or SegmentedArray
+        the memory mapped (time, channels) data
+    segments : list of 2darrays
+        the memory mapped data of each segment
+    channels : list of strings
+        the channel names
+    fs : float
+        the sampling frequency
+    markers : MarkerIndex
+        the markers of the recording
+
+    """
+
+    def __init__(self, filename, autorecover=False):
+        self.filename = filename
+        if os.path.exists(filename + '.checkpoint'):
+            if autorecover:
+                logger.warning('Recording "%s" was not closed properly, recovering it.' % filename)
+                recover(filename)
+            else:
+                logger.warning('Recording "%s" was not closed properly or is still being written.' % filename)
+        meta = {}
+        if os.path.exists(filename + '.meta'):
+            with open(filename + '.meta') as fh:
+                meta = json.load(fh)
+        if os.path.exists(filename + '.manifest'):
+            with open(filename + '.manifest') as fh:
+                manifest = json.load(fh)
+            dirname = os.path.dirname(filename)
+            files = [os.path.join(dirname, seg['File']) for seg in manifest['Segments']]
+        else:
+            files = [filename + '.eeg']
+        self.segments = []
+        for fname in files:
+            data, self.fs = _open_eeg(fname, meta)
+            self.segments.append(data)
+        if len(self.segments) == 1:
+            self.data = self.segments[0]
+        else:
+            self.data = SegmentedArray(self.segments)
+        self.channels = meta.get('Channels', ['Ch_%d' % i for i in range(self.data.shape[1])])
+        if os.path.exists(filename + '.markeridx'):
+            self.markers = MarkerIndex.load(filename + '.markeridx')
+        else:
+            self.markers = MarkerIndex.from_text(filename + '.marker', self.fs)
+
+    def __len__(self):
+        return len(self.data)
+
+    def get_markers(self, t0, t1):
+        """Get the markers in the time interval ``[t0, t1)``.
+
+        Parameters
+        ----------
+        t0, t1 : float
+            start and end of the interval in ms relative to the start of
+            the recording
+
+        Returns
+        -------
+        markers : list of (float, str)
+            the markers with their timestamps in ms relative to the
+            start of the recording
+
+        """
+        return self._markers(self._sample(t0), self._sample(t1), 0)
+
+    def find_markers(self, label):
+        """Get the timestamps of all markers with a given label.
+
+        Parameters
+        ----------
+        label : str
+
+        Returns
+        -------
+        ts : 1darray
+            the timestamps in ms relative to the start of the recording
+
+        """
+        return 1000 * self.markers.find(label) / self.fs
+
+    def window(self, t0, t1):
+        """Get the data and markers in the time interval ``[t0, t1)``.
+
+        Only the requested part of the data is read from disk.
+
+        Parameters
+        ----------
+        t0, t1 : float
+            start and end of the interval in ms relative to the start of
+            the recording
+
+        Returns
+        -------
+        data : 2darray
+            a memory mapped (time, channels) view of the data
+        markers : list of (float, str)
+            the markers in the interval, the timestamps are in ms
+            relative to the first sample of ``data``, just like the
+            markers returned by
+            :meth:`libmushu.ampdecorator.AmpDecorator.get_data`
+
+        """
+        s0, s1 = self._sample(t0), self._sample(t1)
+        i0, i1 = min(max(s0, 0), len(self)), min(max(s1, 0), len(self))
+        return self.data[i0:i1], self._markers(s0, s1, i0)
+
+    def chunks(self, samples):
+        """Iterate over the recording in chunks of a fixed size.
+
+        The last chunk may be shorter. Markers are assigned to the chunk
+        containing their timestamp. Since only one chunk is mapped into
+        memory at a time, this allows constant-memory passes over
+        arbitrarily long recordings.
+
+        Parameters
+        ----------
+        samples : int
+            the number of samples per chunk
+
+        Yields
+        ------
+        data : 2darray
+            a memory mapped (time, channels) view of the chunk
+        markers : list of (float, str)
+            the markers with timestamps in ms relative to the first
+            sample of the chunk
+
+        """
+        for i in range(0, len(self), samples):
+            # markers before the first or after the last sample belong
+            # to the first or last chunk respectively
+            s0 = i if i > 0 else None
+            s1 = i + samples if i + samples < len(self) else None
+            yield self.data[i:i+samples], self._markers(s0, s1, i)
+
+    def segment(self, i):
+        """Get the data and markers of the i-th segment.
+
+        Parameters
+        ----------
+        i : int
+            the index of the segment
+
+        Returns
+        -------
+        data : 2darray
+            the memory mapped (time, channels) data of the segment
+        markers : list of (float, str)
+            the markers with timestamps in ms relative to the first
+            sample of the segment
+
+        """
+        start = sum(len(seg) for seg in self.segments[:i])
+        stop = start + len(self.segments[i])
+        s0 = start if i > 0 else None
+        s1 = stop if i < len(self.segments) - 1 else None
+        return self.segments[i], self._markers(s0, s1, start)
+
+    def _sample(self, t):
+        # the index of the first sample at or after t ms
+        return int(math.ceil(t * self.fs / 1000))
+
+    def _markers(self, s0, s1, onset):
+        # the markers in [s0, s1) in ms relative to the sample onset
+        samples, labels = self.markers.between(s0, s1)
+        return [[1000 * (s - onset) / self.fs, label] for s, label in zip(samples, labels)]
+
+
+class SegmentedArray(object):
+    """A read-only (time, channels) array spanning several segments.
+
+    Slicing along the time axis returns a view into the segment if the
+    slice lies within one segment and a copy otherwise.
+
+    Parameters
+    ----------
+    segments : list of 2darrays
+        the data of the segments
+
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.starts = np.cumsum([0] + [len(seg) for seg in segments])
+        self.dtype = segments[0].dtype
+        self.shape = (int(self.starts[-1]), segments[0].shape[1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        data = np.concatenate(self.segments)
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        rows, cols = key[0], key[1:]
+        if isinstance(rows, slice) and rows.step in (None, 1):
+            start, stop, _ = rows.indices(len(self))
+            parts = []
+            for i, seg in enumerate(self.segments):
+                lo, hi = max(start, self.starts[i]), min(stop, self.starts[i+1])
+                if lo < hi:
+                    parts.append(seg[lo - self.starts[i]:hi - self.starts[i]])
+            if len(parts) == 1:
+                data = parts[0]
+            elif parts:
+                data = np.concatenate(parts)
+            else:
+                data = np.empty((0, self.shape[1]), dtype=self.dtype)
+        elif isinstance(rows, (int, np.integer)):
+            if rows < 0:
+                rows += len(self)
+            if not 0 <= rows < len(self):
+                raise IndexError('index %d is out of bounds' % rows)
+            i = np.searchsorted(self.starts, rows, 'right') - 1
+            data = self.segments[i][rows - self.starts[i]]
+            return data[cols]
+        else:
+            return np.asarray(self)[key]
+        return data[(slice(None), ) + cols]
+
+
+def rebuild_marker_index(filename):
+    """Rebuild the ``.markeridx`` sidecar of a recording.
+
+    Use this to add the sidecar to recordings written by older versions
+    of mushu, or to recover it from the ``.marker`` text file.
+
+    Parameters
+    ----------
+    filename : str
+        the base name of the recording
+
+    Returns
+    -------
+    index : MarkerIndex
+        the rebuilt index
+
+    """
+    fs = Recording(filename).fs
+    index = MarkerIndex.from_text(filename + '.marker', fs)
+    index.save(filename + '.markeridx')
+    return index
+
+
+def recover(filename, force=False):
+    """Recover a recording that was not closed properly.
+
+    The recording is restored to the data on disk: the current ``.eeg``
+    file is truncated to its last complete sample row and its header is
+    updated, the ``.marker`` file is truncated to its last complete
+    line and the meta file, manifest and marker index are rebuilt. The
+    last checkpoint (see :class:`libmushu.writer.RecordingWriter`) tells
+    which segment was being written and where its data was consistent.
+    If the ``.eeg`` file grew beyond the space preallocated at the last
+    checkpoint, every complete row on disk is data and kept. Otherwise
+    the end of the data can not be told from unused preallocated space
+    and the file is truncated to the checkpoint, the samples written
+    since are lost.
+
+    A recording that is still being written is not recovered: on Unix
+    its writer holds a lock of the checkpoint file, elsewhere
+    checkpoints younger than :data:`RECOVER_AGE` seconds are refused.
+
+    Parameters
+    ----------
+    filename : str
+        the base name of the recording
+    force : bool, optional
+        recover even if the recording seems to be still being written
+
+    Returns
+    -------
+    samples : int
+        the number of samples in the recovered recording
+
+    Raises
+    ------
+    IOError :
+        if the recording has no valid checkpoint or is still being
+        written
+
+    """
+    checkpoint = read_checkpoint(filename + '.checkpoint')
+    if checkpoint is None:
+        raise IOError('Recording "%s" has no valid checkpoint.' % filename)
+    if not force:
+        locked = checkpoint_locked(filename + '.checkpoint')
+        if locked:
+            raise IOError('Recording "%s" is still being written.' % filename)
+        if locked is None and time.time() - checkpoint['time'] < RECOVER_AGE:
+            raise IOError('Recording "%s" may still be written, its checkpoint is %.1fs old.' % (filename, time.time() - checkpoint['time']))
+    with open(filename + '.meta') as fh:
+        meta = json.load(fh)
+    manifest = None
+    if os.path.exists(filename + '.manifest'):
+        with open(filename + '.manifest') as fh:
+            manifest = json.load(fh)
+        # segments started after the checkpoint are incomplete
+        i = checkpoint['segment'] + 1
+        while os.path.exists('%s.%04d.eeg' % (filename, i)):
+            logger.warning('Removing incomplete segment %d.' % i)
+            os.remove('%s.%04d.eeg' % (filename, i))
+            i += 1
+        segments = manifest['Segments'][:checkpoint['segment'] + 1]
+        manifest['Segments'] = segments
+        filename_eeg = os.path.join(os.path.dirname(filename), segments[-1]['File'])
+    else:
+        filename_eeg = filename + '.eeg'
+    header = read_header(filename_eeg)
+    dtype = header['dtype']
+    if dtype is None and meta.get('Data Type'):
+        dtype = np.dtype(meta['Data Type'])
+    segment_samples = checkpoint['segment_samples']
+    if dtype is not None:
+        rowsize = dtype.itemsize * header['channels']
+        segment_samples = _complete_rows(filename_eeg, rowsize, segment_samples, checkpoint['allocated'])
+    samples = checkpoint['samples'] - checkpoint['segment_samples'] + segment_samples
+    if manifest is not None and len(segments) > 1 and segment_samples == 0:
+        # the checkpoint was written when the last segment was started
+        os.remove(filename_eeg)
+        segments.pop()
+    else:
+        with open(filename_eeg, 'r+b') as fh:
+            fh.truncate(HEADER_SIZE + segment_samples * (0 if dtype is None else rowsize))
+            fh.seek(0)
+            fh.write(pack_header(dtype, header['channels'], header['fs'],
+                                 segment_samples, header['first_sample']))
+    if manifest is not None:
+        if segments[-1]['File'] == os.path.basename(filename_eeg):
+            segments[-1]['Samples'] = segment_samples
+        manifest['Samples'] = samples
+        with open(filename + '.manifest', 'w') as fh:
+            json.dump(manifest, fh, indent=4)
+    with open(filename + '.marker', 'r+b') as fh:
+        fh.truncate(_complete_lines(fh, checkpoint['marker_offset']))
+    meta['Samples'] = samples
+    meta['Data Type'] = None if dtype is None else dtype.str
+    with open(filename + '.meta', 'w') as fh:
+        json.dump(meta, fh, indent=4)
+    index = MarkerIndex.from_text(filename + '.marker', header['fs'])
+    index.save(filename + '.markeridx')
+    os.remove(filename + '.checkpoint')
+    logger.info('Recovered %d samples and %d markers.' % (samples, len(index)))
+    return samples
+
+
+def _complete_rows(filename, rowsize, first, allocated):
+    # the number of complete rows of an .eeg file with ``first`` rows at
+    # the last checkpoint and ``allocated`` bytes preallocated: the file
+    # only grows beyond the preallocated space by writing data
+    size = os.path.getsize(filename)
+    if size <= allocated:
+        return first
+    return max((size - HEADER_SIZE) // rowsize, first)
+
+
+def _complete_lines(fh, first):
+    # the size of a text file without its last incomplete line, but at
+    # least ``first``
+    fh.seek(0, os.SEEK_END)
+    size = fh.tell()
+    if size <= first:
+        return first
+    fh.seek(first)
+    tail = fh.read()
+    return first + tail.rfind(b'\n') + 1
+
+
+def _open_eeg(filename, meta):
+    # memory map an .eeg file, return the data and sampling frequency
+    header = read_header(filename)
+    if header is not None:
+        dtype = header['dtype']
+        n_channels = header['channels']
+        fs = header['fs']
+        offset = HEADER_SIZE
+        samples = header['samples']
+    else:
+        # recordings of older mushu versions are headerless float32
+        dtype = meta.get('Data Type') or np.float32
+        n_channels = len(meta['Channels'])
+        fs = meta['Sampling Frequency']
+        offset = 0
+        rowsize = np.dtype(dtype).itemsize * n_channels
+        samples = os.path.getsize(filename) // rowsize
+    if samples > 0:
+        data = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(samples, n_channels))
+    else:
+        data = np.empty((0, n_channels), dtype=dtype or np.float32)
+    return data, fs
@@ -0,0 +1,442 @@
+# marker.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides :class:`MarkerClient` to send markers from
+stimulus code to mushu's marker server.
+
+Sending a marker never blocks the caller: :meth:`MarkerClient.send`
+only puts the marker into a queue, a background thread keeps the
+connection open, sends the markers and reconnects if the connection
+breaks::
+
+    from libmushu.marker import MarkerClient
+
+    client = MarkerClient()
+    for trial in trials:
+        present(trial)
+        client.send('S  1')
+    client.close()
+
+"""
+
+from __future__ import division
+
+import sys
+import time
+import uuid
+import queue
+import socket
+import logging
+import threading
+
+import numpy as np
+
+from libmushu.clock import now_ns, NS_PER_S
+from libmushu.clocksync import format_message, parse_message, SYNC, REPORT, TIMESTAMPED
+from libmushu.markerserver import pack_events, unix_paths, PORT, END_MARKER, BUFSIZE
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+# the maximum number of events per binary datagram
+MAX_EVENTS = 4000
+
+
+class MarkerClient(object):
+    """Send markers to a marker server in the background.
+
+    Parameters
+    ----------
+    host : str, optional
+    port : int, optional
+        the address of the marker server
+    protocol : str, optional
+        'udp' sends one text marker per datagram, 'tcp' one text marker
+        per connection (the server's 'oneshot' TCP mode), 'stream' the
+        text markers over one persistent connection (the server's
+        'stream' TCP mode) and 'binary' sends integer event codes as
+        binary datagrams, see :func:`libmushu.markerserver.pack_events`.
+        'unix' and 'unix-stream' send like 'udp' and 'stream' to the
+        Unix domain sockets of a server on the same host. The default
+        'tcp' works with the default settings of the server, 'stream'
+        is faster but needs the server's 'stream' TCP mode.
+    unix_path : str, optional
+        the ``unix_path`` of the marker server, required for the Unix
+        domain socket protocols
+    batch : bool, optional
+        send all markers queued at once in one write, or datagram for
+        'binary'. Otherwise every marker is sent on its own.
+    batch_interval : float, optional
+        if batching, wait this many seconds for more markers before
+        sending
+    timestamps : bool, optional
+        timestamp the markers in :meth:`send` with the client's clock
+        and keep it synchronized with the server, see
+        :mod:`libmushu.clocksync`. Otherwise the server timestamps the
+        markers on arrival.
+    sync_interval : float, optional
+        the time in seconds between two clock synchronizations
+    maxsize : int, optional
+        the maximum number of queued markers, further markers are
+        dropped
+    reconnect_interval : float, optional
+        the time in seconds to wait before reconnecting
+    client_id : str, optional
+        the id of the client, at most 8 characters. A random one is
+        used if not given.
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=PORT, protocol='tcp', batch=True,
+                 batch_interval=0, timestamps=False, sync_interval=1., maxsize=10000,
+                 reconnect_interval=.5, client_id=None, unix_path=None):
+        if protocol not in TRANSPORTS:
+            raise ValueError('Unknown protocol: %r' % protocol)
+        self.address = (host, port)
+        if protocol in UNIX_PROTOCOLS:
+            if unix_path is None:
+                raise ValueError('The %r protocol needs a unix_path.' % protocol)
+            stream_path, dgram_path = unix_paths(unix_path)
+            self.address = dgram_path if protocol == 'unix' else stream_path
+        self.protocol = protocol
+        self.batch = batch
+        self.batch_interval = batch_interval
+        self.timestamps = timestamps
+        self.sync_interval = sync_interval
+        self.reconnect_interval = reconnect_interval
+        self.client_id = client_id if client_id is not None else uuid.uuid4().hex[:8]
+        self.queue = queue.Queue(maxsize)
+        self.transport = None
+        self.seq = 0
+        self.last_sync = None
+        self.sent = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, name='MarkerClient')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, label):
+        """Queue a marker for sending, never blocks.
+
+        Parameters
+        ----------
+        label : str or int
+            the marker, an integer event code for the 'binary' protocol
+
+        Returns
+        -------
+        success : bool
+            False if the queue was full and the marker was dropped
+
+        Raises
+        ------
+        ValueError :
+            if the label is not an integer for the 'binary' protocol
+
+        """
+        if self.protocol == 'binary' and int(label) != label:
+            raise ValueError('Binary markers must be integer codes, got %r.' % label)
+        try:
+            self.queue.put_nowait((now_ns() / NS_PER_S, label))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self, timeout=None):
+        """Send the queued markers and close the connection.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            the maximum time in seconds to wait for the queued markers
+            to be sent
+
+        """
+        self.closing = True
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def stats(self):
+        """Return statistics about the client.
+
+        Returns
+        -------
+        stats : dict
+            ``sent`` the number of markers sent, ``dropped`` the number
+            of markers dropped because the queue was full, ``queued``
+            the number of markers waiting to be sent and ``reconnects``
+            the number of reconnects
+
+        """
+        return {'sent': self.sent,
+                'dropped': self.dropped,
+                'queued': self.queue.qsize(),
+                'reconnects': self.reconnects,
+                }
+
+    def _run(self):
+        closing = False
+        while not closing:
+            timeout = None
+            if self.timestamps:
+                timeout = self.sync_interval
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            batch = []
+            if item is None:
+                closing = True
+            elif item:
+                batch.append(item)
+            if self.batch and batch and self.batch_interval > 0:
+                time.sleep(self.batch_interval)
+            while self.batch and not closing:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                else:
+                    batch.append(item)
+            self._send(batch)
+        if self.transport is not None:
+            self.transport.close()
+
+    def _send(self, batch):
+        # send a batch, reconnecting until it succeeded or the client is
+        # closed. The batch is encoded once, a retry sends the same
+        # sequence numbers again
+        messages = self._encode(batch) if batch else []
+        while True:
+            try:
+                if self.transport is None:
+                    self.transport = TRANSPORTS[self.protocol](self.address)
+                    self.last_sync = None
+                if self.timestamps and (self.last_sync is None or now_ns() / NS_PER_S - self.last_sync >= self.sync_interval):
+                    self._sync()
+                if messages:
+                    self.transport.send(messages)
+                    self.sent += len(batch)
+                return
+            except (OSError, ValueError) as e:
+                logger.warning('Could not send markers to %s: %s' % (self.address, e))
+                if self.transport is not None:
+                    self.transport.close()
+                    self.transport = None
+                self.reconnects += 1
+                time.sleep(self.reconnect_interval)
+                if self.closing:
+                    logger.error('Closing, dropping %d markers.' % len(batch))
+                    self.dropped += len(batch)
+                    return
+
+    def _sync(self):
+        t1 = now_ns() / NS_PER_S
+        reply = self.transport.request(format_message(SYNC, self.client_id, t1).encode('utf-8'))
+        t4 = now_ns() / NS_PER_S
+        command, client_id, args = parse_message(reply.decode('utf-8'))
+        if float(args[0]) != t1:
+            raise ValueError('Unexpected sync reply %r.' % reply)
+        self.transport.send([format_message(REPORT, self.client_id, t1, float(args[1]), float(args[2]), t4).encode('utf-8')])
+        self.last_sync = t4
+
+    def _encode(self, batch):
+        # encode a batch of markers into the messages to send
+        if self.protocol == 'binary':
+            messages = []
+            for i in range(0, len(batch), MAX_EVENTS):
+                chunk = batch[i:i+MAX_EVENTS]
+                seq = np.arange(self.seq, self.seq + len(chunk))
+                self.seq += len(chunk)
+                timestamps = np.array([t for t, code in chunk]) if self.timestamps else None
+                messages.append(pack_events(self.client_id, seq, [code for t, code in chunk], timestamps))
+            return messages
+        if self.timestamps:
+            return [format_message(TIMESTAMPED, self.client_id, t, str(label)).encode('utf-8') for t, label in batch]
+        return [str(label).encode('utf-8') for t, label in batch]
+
+
+class UDPTransport(object):
+    """Send each message as a datagram."""
+
+    family = socket.AF_INET
+
+    def __init__(self, address):
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.bind()
+        self.sock.connect(address)
+
+    def bind(self):
+        pass
+
+    def send(self, messages):
+        for message in messages:
+            self.sock.send(message)
+
+    def request(self, message, timeout=1.):
+        """Send a control message and wait for the server's reply."""
+        self.sock.send(message)
+        prefix = message.split(b' ', 2)[:2]
+        t_end = now_ns() + timeout * NS_PER_S
+        while True:
+            self.sock.settimeout(max((t_end - now_ns()) / NS_PER_S, 1e-3))
+            try:
+                reply = self.sock.recv(BUFSIZE)
+            except socket.timeout:
+                raise OSError('No reply from the marker server.')
+            finally:
+                self.sock.settimeout(None)
+            # skip the echoes of markers
+            if reply.split(b' ', 2)[:2] == prefix:
+                return reply
+
+    def close(self):
+        self.sock.close()
+
+
+class StreamTransport(object):
+    """Send the messages terminated by END_MARKER over one persistent
+    connection."""
+
+    def __init__(self, address):
+        self.sock = self.connect(address)
+        self.terminator = END_MARKER.encode('utf-8')
+        self.buffer = b''
+
+    def send(self, messages):
+        self.check()
+        self.sock.sendall(b''.join(m + self.terminator for m in messages))
+
+    def check(self):
+        """Raise OSError if the server closed the connection.
+
+        Data the server sent meanwhile is kept for :meth:`request`.
+
+        """
+        self.sock.settimeout(0)
+        try:
+            while True:
+                data = self.sock.recv(BUFSIZE)
+                if not data:
+                    raise OSError('Connection closed by the marker server.')
+                self.buffer += data
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.sock.settimeout(None)
+
+    def request(self, message, timeout=1.):
+        self.send([message])
+        self.sock.settimeout(timeout)
+        try:
+            while self.terminator not in self.buffer:
+                data = self.sock.recv(BUFSIZE)
+                if not data:
+                    raise OSError('Connection closed by the marker server.')
+                self.buffer += data
+        except socket.timeout:
+            raise OSError('No reply from the marker server.')
+        finally:
+            self.sock.settimeout(None)
+        reply, _, self.buffer = self.buffer.partition(self.terminator)
+        return reply
+
+    def connect(self, address):
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def close(self):
+        self.sock.close()
+
+
+class OneshotTransport(object):
+    """Send each message over its own connection."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def send(self, messages):
+        for message in messages:
+            self.request(message, wait=False)
+
+    def request(self, message, timeout=1., wait=True):
+        sock = socket.create_connection(self.address, timeout)
+        try:
+            sock.sendall(message)
+            if not wait:
+                return None
+            reply = b''
+            while True:
+                data = sock.recv(BUFSIZE)
+                if not data:
+                    return reply
+                reply += data
+        except socket.timeout:
+            raise OSError('No reply from the marker server.')
+        finally:
+            sock.close()
+
+    def close(self):
+        pass
+
+
+class UnixDatagramTransport(UDPTransport):
+    """Send each message as a datagram to a Unix domain socket."""
+
+    family = getattr(socket, 'AF_UNIX', None)
+
+    def bind(self):
+        # the server can only reply to sync requests if the socket has
+        # an address, on Linux bind it to an automatically chosen one
+        # in the abstract namespace
+        if sys.platform.startswith('linux'):
+            self.sock.bind('')
+
+
+class UnixStreamTransport(StreamTransport):
+    """Send the messages terminated by END_MARKER over one persistent
+    connection to a Unix domain socket."""
+
+    def connect(self, address):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+TRANSPORTS = {
+    'udp': UDPTransport,
+    'binary': UDPTransport,
+    'tcp': OneshotTransport,
+    'stream': StreamTransport,
+    'unix': UnixDatagramTransport,
+    'unix-stream': UnixStreamTransport,
+}
+UNIX_PROTOCOLS = ('unix', 'unix-stream')
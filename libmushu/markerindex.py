@@ -0,0 +1,274 @@
+# markerindex.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides :class:`MarkerIndex`, an indexed binary store for
+the markers of a recording.
+
+The ``.marker`` text file of a recording has to be scanned completely to
+find the markers of a label or within a time range. The
+``<filename>.markeridx`` sidecar, written next to it, stores the markers
+in a form that allows for fast lookups:
+
+    * a sorted int64 column with the sample index of each marker, used
+      for binary searches over time ranges
+    * an int32 column with the id of each marker's label in an interned
+      label table
+    * an inverted index from label id to the positions of its markers
+
+The file consists of a header (see :data:`HEADER_FORMAT`) followed by
+the sample column, the label id column, the offsets and positions of the
+inverted index and the label table as JSON. The arrays are memory mapped
+when the file is loaded.
+
+"""
+
+from __future__ import division
+
+import os
+import json
+import struct
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+MAGIC = b'MUSHUMKX'
+VERSION = 1
+# magic, version, padding, number of markers, number of labels, size of
+# the label table in bytes
+HEADER_FORMAT = '<8sI4xqqq'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class MarkerIndex(object):
+    """The markers of a recording, indexed by time and label.
+
+    Use :meth:`from_markers`, :meth:`from_text` or :meth:`load` to create
+    an instance.
+
+    Parameters
+    ----------
+    samples : 1darray of int64
+        the sample index of each marker, sorted in ascending order
+    label_ids : 1darray of int32
+        the id of each marker's label
+    labels : list of strings
+        the interned label table, ``labels[label_ids[i]]`` is the label
+        of the i-th marker
+    offsets, positions : 1darray of int64, optional
+        the inverted index: ``positions[offsets[j]:offsets[j+1]]`` are
+        the positions of the markers with the label ``labels[j]``. If
+        not given, the index is built.
+
+    """
+
+    def __init__(self, samples, label_ids, labels, offsets=None, positions=None):
+        self.samples = samples
+        self.label_ids = label_ids
+        self.labels = labels
+        self.label_to_id = dict((label, i) for i, label in enumerate(labels))
+        if offsets is None or positions is None:
+            # a stable sort keeps the markers of each label in order
+            positions = np.argsort(label_ids, kind='stable').astype(np.int64)
+            counts = np.bincount(label_ids, minlength=len(labels))
+            offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+        self.offsets = offsets
+        self.positions = positions
+
+    @classmethod
+    def from_markers(cls, markers, fs):
+        """Create an index from a list of markers.
+
+        Parameters
+        ----------
+        markers : list of (float, str)
+            the markers, the timestamps are in ms relative to the start
+            of the recording
+        fs : float
+            the sampling frequency, used to convert the timestamps to
+            sample indices
+
+        Returns
+        -------
+        index : MarkerIndex
+
+        """
+        label_to_id = {}
+        ts = np.empty(len(markers), dtype=np.float64)
+        label_ids = np.empty(len(markers), dtype=np.int32)
+        for i, (t, label) in enumerate(markers):
+            ts[i] = t
+            label_ids[i] = label_to_id.setdefault(str(label), len(label_to_id))
+        samples = np.round(ts * fs / 1000).astype(np.int64)
+        order = np.argsort(samples, kind='stable')
+        labels = sorted(label_to_id, key=label_to_id.get)
+        return cls(samples[order], label_ids[order], labels)
+
+    @classmethod
+    def from_text(cls, filename, fs):
+        """Rebuild the index from a ``.marker`` text file.
+
+        Parameters
+        ----------
+        filename : str
+            the name of the ``.marker`` file
+        fs : float
+            the sampling frequency of the recording
+
+        Returns
+        -------
+        index : MarkerIndex
+
+        """
+        return cls.from_markers(read_markers(filename), fs)
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index from a ``.markeridx`` file.
+
+        The columns are memory mapped, only the label table is parsed.
+
+        Parameters
+        ----------
+        filename : str
+            the name of the ``.markeridx`` file
+
+        Returns
+        -------
+        index : MarkerIndex
+
+        """
+        with open(filename, 'rb') as fh:
+            buf = fh.read(HEADER_SIZE)
+            if not buf.startswith(MAGIC):
+                raise IOError('"%s" is not a marker index.' % filename)
+            magic, version, n, n_labels, table_size = struct.unpack(HEADER_FORMAT, buf)
+            offset = HEADER_SIZE
+            columns = []
+            for dtype, length in ((np.int64, n), (np.int32, n),
+                                  (np.int64, n_labels + 1), (np.int64, n)):
+                if length > 0:
+                    columns.append(np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(length,)))
+                else:
+                    columns.append(np.empty(0, dtype=dtype))
+                offset += _padded(np.dtype(dtype).itemsize * length)
+            fh.seek(offset)
+            labels = json.loads(fh.read(table_size).decode('utf-8'))
+        samples, label_ids, offsets, positions = columns
+        return cls(samples, label_ids, labels, offsets, positions)
+
+    def save(self, filename):
+        """Save the index to a ``.markeridx`` file.
+
+        Parameters
+        ----------
+        filename : str
+            the name of the file
+
+        """
+        table = json.dumps(self.labels).encode('utf-8')
+        with open(filename, 'wb') as fh:
+            fh.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(self),
+                                 len(self.labels), len(table)))
+            fh.write(np.ascontiguousarray(self.samples, dtype=np.int64))
+            fh.write(np.ascontiguousarray(self.label_ids, dtype=np.int32))
+            # keep the following int64 columns 8 byte aligned
+            fh.write(b'\0' * (_padded(4 * len(self)) - 4 * len(self)))
+            fh.write(np.ascontiguousarray(self.offsets, dtype=np.int64))
+            fh.write(np.ascontiguousarray(self.positions, dtype=np.int64))
+            fh.write(table)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def between(self, s0=None, s1=None):
+        """Get the markers in the sample range ``[s0, s1)``.
+
+        The range is found via binary search.
+
+        Parameters
+        ----------
+        s0, s1 : int, optional
+            the first and the (excluded) last sample index, None means
+            unbounded
+
+        Returns
+        -------
+        samples : 1darray
+            the sample indices of the markers
+        labels : list of strings
+            the corresponding labels
+
+        """
+        i0 = 0 if s0 is None else np.searchsorted(self.samples, s0, 'left')
+        i1 = len(self) if s1 is None else np.searchsorted(self.samples, s1, 'left')
+        return self.samples[i0:i1], [self.labels[j] for j in self.label_ids[i0:i1]]
+
+    def find(self, label):
+        """Get the sample indices of all markers with a given label.
+
+        Parameters
+        ----------
+        label : str
+
+        Returns
+        -------
+        samples : 1darray
+            the sample indices of the markers in ascending order, empty
+            if there is no such label
+
+        """
+        j = self.label_to_id.get(label)
+        if j is None:
+            return self.samples[:0]
+        return self.samples[self.positions[self.offsets[j]:self.offsets[j+1]]]
+
+
+def _padded(size):
+    # round up to a multiple of 8 bytes
+    return (size + 7) // 8 * 8
+
+
+def read_markers(filename):
+    """Read a ``.marker`` text file.
+
+    Parameters
+    ----------
+    filename : str
+        the name of the marker file
+
+    Returns
+    -------
+    markers : list of (float, str)
+        the markers, the timestamps are in ms relative to the start of
+        the recording. An empty list if the file does not exist.
+
+    """
+    markers = []
+    if os.path.exists(filename):
+        with open(filename) as fh:
+            for line in fh:
+                t, _, label = line.rstrip('\n').partition(' ')
+                markers.append([float(t), label])
+    return markers
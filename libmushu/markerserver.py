@@ -0,0 +1,888 @@
+# markerserver.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides the network marker server of the
+:class:`libmushu.ampdecorator.AmpDecorator`.
+
+The :class:`MarkerServer` listens for markers on a UDP and a TCP
+endpoint and optionally on Unix domain sockets for clients on the same
+host, timestamps them on arrival and puts them into a
+:class:`libmushu.ringbuffer.MarkerRing`. Clients can also timestamp
+markers with their own clock and synchronize it with the server, see
+:mod:`libmushu.clocksync`. It runs an asyncio event loop,
+either in a separate process (:class:`MarkerServerProcess`), in a
+background thread of the acquiring process (:class:`MarkerServerThread`)
+or on the application's own running loop (:class:`MarkerServerLoop`).
+
+"""
+
+from __future__ import division
+
+import os
+import sys
+import stat
+import socket
+import struct
+import signal
+import logging
+import asyncio
+import threading
+import collections
+import multiprocessing
+
+import numpy as np
+
+from libmushu.clock import now_ns, realtime_to_ns, NS_PER_S
+from libmushu.clocksync import ClockSync, CONTROL, SYNC, REPORT, TIMESTAMPED, format_message, parse_message
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+END_MARKER = '\n'
+BUFSIZE = 2**16
+PORT = 32344
+# how often a blocked TCP connection checks for room in the marker ring,
+# in seconds
+BLOCK_INTERVAL = .001
+
+# the Unix domain sockets of a marker server are bound to its unix_path
+# with these suffixes
+UNIX_STREAM_SUFFIX = '.stream'
+UNIX_DGRAM_SUFFIX = '.dgram'
+
+# Linux' SO_TIMESTAMPNS, which Python's socket module does not export.
+# The control message type SCM_TIMESTAMPNS has the same value.
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35 if sys.platform.startswith('linux') else None)
+# struct timespec
+TIMESPEC = struct.Struct('@ll')
+
+# Binary marker datagrams start with this byte, followed by the rest of
+# BINARY_HEADER: flags, the number of events and the client id (padded
+# with NUL bytes). The events follow as BINARY_EVENT records or, if
+# FLAG_TIMESTAMPS is set, as BINARY_EVENT_TIMESTAMPED records.
+BINARY = b'\x02'
+BINARY_HEADER = struct.Struct('<cBH8s')
+FLAG_TIMESTAMPS = 1
+BINARY_EVENT = np.dtype([('seq', '<u4'), ('code', '<i4')])
+BINARY_EVENT_TIMESTAMPED = np.dtype([('seq', '<u4'), ('code', '<i4'), ('time', '<f8')])
+# the number of missing sequence numbers remembered per binary client,
+# an event older than that arriving late is counted as a duplicate
+MAX_MISSING = 10000
+
+
+def unix_paths(unix_path):
+    """Return the paths of the Unix domain sockets of a marker server.
+
+    Parameters
+    ----------
+    unix_path : str
+        the ``unix_path`` of the :class:`MarkerServer`
+
+    Returns
+    -------
+    stream_path, dgram_path : str
+        the paths of the stream and the datagram socket
+
+    """
+    return unix_path + UNIX_STREAM_SUFFIX, unix_path + UNIX_DGRAM_SUFFIX
+
+
+def pack_events(client_id, seq, code, timestamps=None):
+    """Pack events into a binary marker datagram.
+
+    Parameters
+    ----------
+    client_id : str
+        the id of the client, at most 8 bytes. It identifies the
+        sequence and, for timestamped events, the clock of the client.
+    seq : 1darray of ints
+        the sequence numbers of the events, incremented by one for each
+        event sent by the client
+    code : 1darray of ints
+        the event codes
+    timestamps : 1darray of floats, optional
+        the client times of the events, see :mod:`libmushu.clocksync`
+
+    Returns
+    -------
+    data : bytes
+
+    """
+    dtype = BINARY_EVENT if timestamps is None else BINARY_EVENT_TIMESTAMPED
+    events = np.empty(len(seq), dtype=dtype)
+    events['seq'] = seq
+    events['code'] = code
+    if timestamps is not None:
+        events['time'] = timestamps
+    flags = 0 if timestamps is None else FLAG_TIMESTAMPS
+    return BINARY_HEADER.pack(BINARY, flags, len(events), client_id.encode('utf-8')) + events.tobytes()
+
+
+def unpack_events(data):
+    """Unpack a binary marker datagram.
+
+    Parameters
+    ----------
+    data : bytes
+
+    Returns
+    -------
+    client_id : str
+    events : structured 1darray
+        with the fields ``seq``, ``code`` and, if the events are
+        timestamped, ``time``
+
+    Raises
+    ------
+    ValueError :
+        if the datagram is malformed
+
+    """
+    if len(data) < BINARY_HEADER.size:
+        raise ValueError('Datagram too short.')
+    _, flags, n, client_id = BINARY_HEADER.unpack_from(data)
+    dtype = BINARY_EVENT_TIMESTAMPED if flags & FLAG_TIMESTAMPS else BINARY_EVENT
+    if len(data) != BINARY_HEADER.size + n * dtype.itemsize:
+        raise ValueError('Datagram size does not match the number of events.')
+    events = np.frombuffer(data, dtype=dtype, count=n, offset=BINARY_HEADER.size)
+    return client_id.rstrip(b'\0').decode('utf-8'), events
+
+
+class MarkerHandler(object):
+    """Handle the messages received by the endpoints of a marker server.
+
+    Plain messages are markers, they are timestamped on arrival and put
+    into the marker ring. Messages starting with
+    :data:`libmushu.clocksync.CONTROL` implement the clock
+    synchronization with the clients, see :mod:`libmushu.clocksync`:
+    sync requests are answered, reports update the client's
+    :class:`libmushu.clocksync.ClockSync` and timestamped markers are
+    mapped onto the server's clock. Timestamped markers of clients that
+    are not synced yet are timestamped on arrival. Messages starting
+    with :data:`BINARY` are binary marker datagrams, see
+    :meth:`handle_binary`.
+
+    Parameters
+    ----------
+    ring : MarkerRing
+        the ring the received markers are put into
+
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.clocks = {}
+        # the next expected sequence number of each binary client and
+        # the numbers it skipped, oldest first
+        self.sequences = {}
+        self.missing = {}
+
+    @property
+    def blocked(self):
+        """True if connections should stop reading markers.
+
+        This is the case if the ring is full and its overflow policy is
+        'block'.
+
+        """
+        return self.ring.overflow == 'block' and self.ring.full
+
+    def handle(self, data, timestamp=None, reply=None):
+        """Handle a received message.
+
+        Parameters
+        ----------
+        data : bytes
+            the message
+        timestamp : int, optional
+            the arrival time in ns (see :func:`libmushu.clock.now_ns`),
+            now if not given
+        reply : callable, optional
+            called with the reply to a sync request
+
+        Returns
+        -------
+        plain : bool
+            True if the message was a plain marker, False if it was a
+            control message. Only plain markers are echoed.
+
+        """
+        if timestamp is None:
+            timestamp = now_ns()
+        if data[:1] == BINARY:
+            self.handle_binary(data, timestamp)
+            return False
+        message = data.decode('utf-8', 'replace')
+        if not message.startswith(CONTROL):
+            self.ring.put(timestamp, message)
+            return True
+        try:
+            command, client_id, args = parse_message(message)
+            if command == SYNC:
+                if reply is not None:
+                    reply(format_message(SYNC, client_id, args[0], timestamp / NS_PER_S, now_ns() / NS_PER_S).encode('utf-8'))
+            elif command == REPORT:
+                t1, t2, t3, t4 = [float(a) for a in args[:4]]
+                self.clocks.setdefault(client_id, ClockSync()).add(t1, t2, t3, t4)
+            elif command == TIMESTAMPED:
+                t, label = args
+                clock = self.clocks.get(client_id)
+                server_time = clock.to_server(float(t)) if clock is not None else None
+                self.ring.put(timestamp if server_time is None else int(round(server_time * NS_PER_S)), label)
+            else:
+                logger.warning('Unknown control message %r.' % message)
+        except (ValueError, IndexError):
+            logger.warning('Malformed control message %r.' % message)
+        return False
+
+    def handle_binary(self, data, timestamp):
+        """Handle a binary marker datagram, see :func:`pack_events`.
+
+        The events are put into the marker ring in bulk, labeled with
+        their code. Gaps in the sequence numbers of a client are counted
+        as lost events, missing events arriving late as reordered (and
+        not as lost anymore) and any other event arriving after a later
+        one as duplicate. Duplicates, e.g. of a retransmitted datagram,
+        are not put into the ring.
+
+        """
+        try:
+            client_id, events = unpack_events(data)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.warning('Malformed binary marker datagram: %s' % e)
+            return
+        if len(events) == 0:
+            return
+        keep = self.count_sequence(client_id, events['seq'].tolist())
+        if not all(keep):
+            events = events[np.array(keep, dtype=bool)]
+            if len(events) == 0:
+                return
+        timestamps = np.full(len(events), timestamp, dtype=np.int64)
+        clock = self.clocks.get(client_id)
+        if 'time' in events.dtype.names and clock is not None and clock.synced:
+            timestamps = np.round(clock.to_server(events['time']) * NS_PER_S).astype(np.int64)
+        self.ring.put_many(timestamps, [str(c) for c in events['code'].tolist()])
+
+    def count_sequence(self, client_id, seqs):
+        # count the lost, reordered and duplicate events of a client,
+        # return for each event whether it is not a duplicate
+        expected = self.sequences.get(client_id)
+        missing = self.missing.setdefault(client_id, collections.OrderedDict())
+        lost = reordered = duplicates = 0
+        keep = [True] * len(seqs)
+        for i, seq in enumerate(seqs):
+            if expected is None or seq == expected:
+                expected = seq + 1
+            elif seq > expected:
+                lost += seq - expected
+                for s in range(max(expected, seq - MAX_MISSING), seq):
+                    missing[s] = None
+                expected = seq + 1
+            elif seq in missing:
+                del missing[seq]
+                reordered += 1
+                lost -= 1
+            else:
+                duplicates += 1
+                keep[i] = False
+        while len(missing) > MAX_MISSING:
+            missing.popitem(last=False)
+        self.sequences[client_id] = expected
+        if lost:
+            self.ring.count('lost', lost)
+        if reordered:
+            self.ring.count('reordered', reordered)
+        if duplicates:
+            self.ring.count('duplicates', duplicates)
+        return keep
+
+
+class EchoServerProtocol(asyncio.DatagramProtocol):
+    """Receive one marker per datagram and echo it back."""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr, timestamp=None):
+        logger.debug('Received %r from %s' % (data, addr))
+        if not addr:
+            # an unbound Unix domain socket, there is no way to reply
+            self.handler.handle(data, timestamp)
+        elif self.handler.handle(data, timestamp, lambda reply: self.transport.sendto(reply, addr)):
+            self.transport.sendto(data, addr)
+
+
+class EchoServerClientProtocol(asyncio.Protocol):
+    """Receive one marker per connection, echo it back and close the
+    connection."""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def connection_made(self, transport):
+        logger.debug('Connection from {}'.format(transport.get_extra_info('peername')))
+        self.transport = transport
+
+    def data_received(self, data, timestamp=None):
+        logger.debug('Received %r' % data)
+        if timestamp is None:
+            timestamp = now_ns()
+        if self.handler.blocked:
+            self.transport.pause_reading()
+            asyncio.get_event_loop().call_later(BLOCK_INTERVAL, self.data_received, data, timestamp)
+            return
+        if self.handler.handle(data, timestamp, self.transport.write):
+            self.transport.write(data)
+        self.transport.close()
+
+
+class StreamServerProtocol(asyncio.Protocol):
+    """Receive a stream of markers terminated by :data:`END_MARKER` on a
+    persistent connection.
+
+    Each read may contain several markers and a partial one, which is
+    buffered until the rest arrives. Every marker is timestamped when
+    its terminator arrives. Nothing is sent back, except for replies to
+    sync requests, so a client can keep one connection open for the
+    whole session. A partial marker left when the client closes the
+    connection is used as well.
+
+    If the handler is blocked, the markers wait and the connection stops
+    reading until there is room again, so the TCP window fills up and
+    the client blocks.
+
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.buffer = b''
+        self.terminator = END_MARKER.encode('utf-8')
+        # received markers waiting for room in the ring
+        self.pending = collections.deque()
+        self.paused = False
+        self.retry = None
+
+    def connection_made(self, transport):
+        logger.debug('Connection from {}'.format(transport.get_extra_info('peername')))
+        self.transport = transport
+
+    def data_received(self, data):
+        timestamp = now_ns()
+        lines = (self.buffer + data).split(self.terminator)
+        self.buffer = lines.pop()
+        self.pending.extend((timestamp, line) for line in lines)
+        self.flush()
+        if len(self.buffer) > BUFSIZE:
+            logger.error('Marker exceeds %d bytes without %r, closing the connection.' % (BUFSIZE, END_MARKER))
+            self.buffer = b''
+            self.transport.close()
+
+    def flush(self):
+        """Handle the pending markers, until the handler is blocked."""
+        self.retry = None
+        while self.pending:
+            if self.handler.blocked:
+                if not self.paused and not self.transport.is_closing():
+                    logger.warning('Marker ring is full, blocking the connection.')
+                    self.transport.pause_reading()
+                    self.paused = True
+                self.retry = asyncio.get_event_loop().call_later(BLOCK_INTERVAL, self.flush)
+                return
+            self.put(*self.pending.popleft())
+        if self.paused and not self.transport.is_closing():
+            self.transport.resume_reading()
+            self.paused = False
+
+    def connection_lost(self, exc):
+        if self.buffer:
+            self.pending.append((now_ns(), self.buffer))
+            self.buffer = b''
+        if self.retry is not None:
+            self.retry.cancel()
+        # the client is gone, markers that still do not fit are dropped
+        while self.pending:
+            self.put(*self.pending.popleft())
+
+    def put(self, timestamp, line):
+        line = line.rstrip(b'\r')
+        if line:
+            self.handler.handle(line, timestamp, self.reply)
+
+    def reply(self, data):
+        self.transport.write(data + self.terminator)
+
+
+class KernelTimestampEndpoint(object):
+    """A UDP or Unix datagram endpoint that timestamps datagrams in the
+    kernel.
+
+    asyncio's datagram endpoints do not give access to ancillary data,
+    so this endpoint reads its socket with ``recvmsg`` whenever the
+    event loop reports it readable. The kernel timestamps each datagram
+    on arrival (``SO_TIMESTAMPNS``), so the delay until the event loop
+    dispatches the datagram does not end up in the marker time. The
+    kernel uses the wall clock, the timestamps are converted to
+    :func:`libmushu.clock.now_ns`. The timestamp is passed to the protocol's
+    ``datagram_received`` as third argument.
+
+    Use :meth:`create` to open an endpoint.
+
+    """
+
+    def __init__(self, loop, sock, protocol):
+        self.loop = loop
+        self.sock = sock
+        self.protocol = protocol
+        self.ancbufsize = socket.CMSG_SPACE(TIMESPEC.size)
+        protocol.connection_made(self)
+        loop.add_reader(sock.fileno(), self.read)
+
+    @classmethod
+    def create(cls, loop, protocol_factory, local_addr, family=socket.AF_INET):
+        """Open an endpoint bound to ``local_addr``.
+
+        Parameters
+        ----------
+        loop : asyncio event loop
+        protocol_factory : callable
+            returns the :class:`asyncio.DatagramProtocol` of the endpoint
+        local_addr : tuple or str
+            the address to bind to, a path for ``AF_UNIX``
+        family : int, optional
+            ``AF_INET`` or ``AF_UNIX``
+
+        Returns
+        -------
+        endpoint : KernelTimestampEndpoint or None
+            None if kernel timestamps are not supported on this platform
+            or by the event loop
+
+        """
+        sock = cls.bind(local_addr, family)
+        if sock is None:
+            return None
+        try:
+            return cls(loop, sock, protocol_factory())
+        except NotImplementedError:
+            # e.g. the proactor event loop on Windows has no add_reader
+            sock.close()
+            return None
+        except Exception:
+            sock.close()
+            raise
+
+    @staticmethod
+    def bind(local_addr, family=socket.AF_INET):
+        """Create a non-blocking datagram socket with kernel timestamps,
+        bound to ``local_addr``.
+
+        Returns
+        -------
+        sock : socket or None
+            None if kernel timestamps are not supported on this platform
+
+        """
+        if SO_TIMESTAMPNS is None or not hasattr(socket.socket, 'recvmsg'):
+            return None
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            sock.setblocking(False)
+            sock.bind(local_addr)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def read(self):
+        while True:
+            try:
+                data, ancdata, flags, addr = self.sock.recvmsg(BUFSIZE, self.ancbufsize)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.protocol.error_received(e)
+                return
+            timestamp = None
+            for level, type_, cmsg in ancdata:
+                if level == socket.SOL_SOCKET and type_ == SO_TIMESTAMPNS and len(cmsg) >= TIMESPEC.size:
+                    sec, nsec = TIMESPEC.unpack_from(cmsg)
+                    timestamp = realtime_to_ns(sec * NS_PER_S + nsec)
+            self.protocol.datagram_received(data, addr, timestamp)
+
+    def sendto(self, data, addr):
+        try:
+            self.sock.sendto(data, addr)
+        except OSError as e:
+            logger.debug('Could not send to %s: %s' % (addr, e))
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        self.protocol.connection_lost(None)
+
+
+TCP_PROTOCOLS = {
+    'oneshot': EchoServerClientProtocol,
+    'stream': StreamServerProtocol,
+}
+
+
+def remove_socket(path):
+    """Remove a Unix domain socket file, e.g. left by a crashed server.
+
+    Files that are not sockets are left alone.
+
+    """
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class MarkerServer(object):
+    """The UDP and TCP marker endpoints on an asyncio event loop.
+
+    Parameters
+    ----------
+    ring : MarkerRing
+        the ring the received markers are put into
+    host : str, optional
+    port : int, optional
+        the address of both endpoints
+    tcp_mode : str, optional
+        'oneshot' expects one marker per TCP connection, echoes it and
+        closes the connection. 'stream' keeps the connection open and
+        expects markers terminated by :data:`END_MARKER`, see
+        :class:`StreamServerProtocol`.
+    kernel_timestamps : bool, optional
+        timestamp UDP markers in the kernel on arrival, see
+        :class:`KernelTimestampEndpoint`. Falls back to timestamps taken
+        in the event loop if this is not supported.
+    unix_path : str, optional
+        if given, the server also listens on a Unix domain stream and
+        datagram socket, bound to this path with the suffixes
+        :data:`UNIX_STREAM_SUFFIX` and :data:`UNIX_DGRAM_SUFFIX` (see
+        :func:`unix_paths`). Markers from clients on the same host skip
+        the IP stack. The stream socket expects the protocol of
+        ``tcp_mode``, the datagram socket the one of the UDP endpoint.
+        Use a different path for every concurrently running server.
+        Stale sockets are replaced, the sockets are removed when the
+        server stops. Only supported on Unix.
+    loop : asyncio event loop, optional
+        the event loop to serve on, a new one if None
+
+    Use :meth:`run` to serve on a new event loop until :meth:`stop` is
+    called, or :meth:`open` and :meth:`close` to serve on a loop that
+    is already running.
+
+    """
+
+    def __init__(self, ring, host='127.0.0.1', port=PORT, tcp_mode='oneshot', kernel_timestamps=True,
+                 unix_path=None, loop=None):
+        if tcp_mode not in TCP_PROTOCOLS:
+            raise ValueError('Unknown TCP mode: %r' % tcp_mode)
+        if unix_path is not None and not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('Unix domain sockets are not supported on this platform.')
+        self.ring = ring
+        self.host = host
+        self.port = port
+        self.tcp_protocol = TCP_PROTOCOLS[tcp_mode]
+        self.kernel_timestamps = kernel_timestamps
+        self.unix_path = unix_path
+        self.handler = MarkerHandler(ring)
+        self.loop = loop if loop is not None else asyncio.new_event_loop()
+        self.sockets, self.endpoints, self.servers, self.paths = [], [], [], []
+
+    def bind(self):
+        """Create and bind the sockets of the endpoints.
+
+        :meth:`open` binds them if this was not done before. Binding
+        them in advance reports errors like an address already in use
+        right away, the sockets queue the incoming markers until they
+        are opened.
+
+        """
+        if self.sockets:
+            return
+        sockets = []
+        try:
+            sockets.append(self._datagram_socket((self.host, self.port), socket.AF_INET))
+            sock = socket.create_server((self.host, self.port), backlog=100)
+            sockets.append(('stream', sock))
+            if self.unix_path is not None:
+                stream_path, dgram_path = self.paths = unix_paths(self.unix_path)
+                for path in self.paths:
+                    remove_socket(path)
+                sockets.append(self._datagram_socket(dgram_path, socket.AF_UNIX))
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sockets.append(('stream', sock))
+                sock.bind(stream_path)
+                sock.listen(100)
+        except Exception:
+            for kind, sock in sockets:
+                sock.close()
+            raise
+        self.sockets = sockets
+
+    def _datagram_socket(self, local_addr, family):
+        # bind a datagram socket, with kernel timestamps if possible
+        if self.kernel_timestamps:
+            sock = KernelTimestampEndpoint.bind(local_addr, family)
+            if sock is not None:
+                return 'kernel', sock
+            logger.warning('Kernel timestamps are not supported, using userspace timestamps.')
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.bind(local_addr)
+        except Exception:
+            sock.close()
+            raise
+        return 'datagram', sock
+
+    async def open(self):
+        """Open the endpoints on the event loop of the server."""
+        self.bind()
+        loop = self.loop
+        while self.sockets:
+            kind, sock = self.sockets[0]
+            if kind == 'stream':
+                self.servers.append(await loop.create_server(
+                    lambda: self.tcp_protocol(self.handler), sock=sock))
+            elif kind == 'kernel':
+                self.endpoints.append(KernelTimestampEndpoint(loop, sock, EchoServerProtocol(self.handler)))
+            else:
+                endpoint, _ = await loop.create_datagram_endpoint(
+                    lambda: EchoServerProtocol(self.handler), sock=sock)
+                self.endpoints.append(endpoint)
+            self.sockets.pop(0)
+
+    def close(self):
+        """Close the endpoints and remove the Unix domain sockets."""
+        for endpoint in self.endpoints:
+            endpoint.close()
+        for server in self.servers:
+            server.close()
+        for kind, sock in self.sockets:
+            sock.close()
+        for path in self.paths:
+            remove_socket(path)
+        self.sockets, self.endpoints, self.servers, self.paths = [], [], [], []
+
+    def log_clocks(self):
+        """Log the clock offsets and drifts of the synchronized clients."""
+        for client_id, clock in self.handler.clocks.items():
+            logger.info('Client %s: clock offset %.6fs, drift %.3g.' % (client_id, clock.offset, clock.drift))
+
+    def run(self, ready=None):
+        """Open the endpoints and serve until :meth:`stop` is called.
+
+        Parameters
+        ----------
+        ready : Event, optional
+            set as soon as the endpoints are open
+
+        """
+        loop = self.loop
+        try:
+            loop.run_until_complete(self.open())
+            if ready is not None:
+                ready.set()
+            loop.run_forever()
+            self.log_clocks()
+        finally:
+            servers = self.servers
+            self.close()
+            for server in servers:
+                loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+    def stop(self):
+        """Stop the event loop, can be called from any thread."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class MarkerServerThread(threading.Thread):
+    """Run a :class:`MarkerServer` in a background thread.
+
+    :meth:`start` returns as soon as the server is ready, :meth:`stop`
+    stops the event loop via ``call_soon_threadsafe`` and joins the
+    thread.
+
+    Parameters
+    ----------
+    ring : MarkerRing
+    kwargs :
+        are passed to :class:`MarkerServer`
+
+    """
+
+    def __init__(self, ring, **kwargs):
+        super(MarkerServerThread, self).__init__(name='MarkerServer')
+        self.daemon = True
+        self.server = MarkerServer(ring, **kwargs)
+        self.ready = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            self.server.run(self.ready)
+        except Exception as e:
+            self.error = e
+            logger.error('Marker server failed.', exc_info=True)
+        finally:
+            self.ready.set()
+
+    def start(self):
+        super(MarkerServerThread, self).start()
+        self.ready.wait()
+        if self.error is not None:
+            raise IOError('Could not start the marker server: %s' % self.error)
+
+    def stop(self):
+        if self.is_alive():
+            self.server.stop()
+        self.join()
+
+
+class MarkerServerProcess(multiprocessing.Process):
+    """Run a :class:`MarkerServer` in a separate process.
+
+    The process is stopped by sending it a ``SIGINT``, which it handles
+    by stopping the event loop. This is only supported on Unix.
+
+    Parameters
+    ----------
+    ring : MarkerRing
+    kwargs :
+        are passed to :class:`MarkerServer`
+
+    """
+
+    def __init__(self, ring, **kwargs):
+        super(MarkerServerProcess, self).__init__(name='MarkerServer')
+        self.ring = ring
+        self.kwargs = kwargs
+        self.ready = multiprocessing.Event()
+
+    def run(self):
+        try:
+            server = MarkerServer(self.ring, **self.kwargs)
+            signal.signal(signal.SIGINT, lambda signum, frame: server.stop())
+            server.run(self.ready)
+        finally:
+            self.ready.set()
+
+    def start(self):
+        super(MarkerServerProcess, self).start()
+        self.ready.wait()
+        if not self.is_alive():
+            raise IOError('Could not start the marker server.')
+
+    def stop(self):
+        if self.is_alive():
+            os.kill(self.pid, signal.SIGINT)
+        self.join()
+
+
+class MarkerServerLoop(object):
+    """Run a :class:`MarkerServer` on the running asyncio event loop of
+    the calling thread.
+
+    Create, start and stop it from a coroutine or a callback of the
+    loop, so the markers are served by the same loop as the rest of the
+    application, e.g. :meth:`libmushu.ampdecorator.AmpDecorator.aget_data`.
+    :meth:`start` binds the sockets right away and opens the endpoints
+    as soon as the caller yields to the loop, until then the sockets
+    queue the incoming markers.
+
+    Parameters
+    ----------
+    ring : MarkerRing
+    kwargs :
+        are passed to :class:`MarkerServer`
+
+    Raises
+    ------
+    RuntimeError :
+        if there is no running event loop
+
+    """
+
+    def __init__(self, ring, **kwargs):
+        self.server = MarkerServer(ring, loop=asyncio.get_running_loop(), **kwargs)
+        self.task = None
+
+    def start(self):
+        self.server.bind()
+        self.task = self.server.loop.create_task(self.server.open())
+        self.task.add_done_callback(self._opened)
+
+    def _opened(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Could not open the marker server: %s' % task.exception())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.server.close()
+        self.server.log_clocks()
+
+
+MARKER_SERVERS = {
+    'process': MarkerServerProcess,
+    'thread': MarkerServerThread,
+    'loop': MarkerServerLoop,
+}
+
+
+def get_marker_server(mode, ring, **kwargs):
+    """Create a marker server.
+
+    Parameters
+    ----------
+    mode : str
+        'process' runs the server in a separate process, 'thread' in a
+        background thread of the calling process and 'loop' on the
+        running asyncio event loop of the calling thread
+    ring : MarkerRing
+        the ring the received markers are put into
+    kwargs :
+        are passed to :class:`MarkerServer`
+
+    Returns
+    -------
+    server : MarkerServerProcess, MarkerServerThread or MarkerServerLoop
+        call ``start`` and ``stop`` to run the server
+
+    """
+    if mode not in MARKER_SERVERS:
+        raise ValueError('Unknown marker server mode: %r' % mode)
+    return MARKER_SERVERS[mode](ring, **kwargs)
@@ -0,0 +1,364 @@
+# multiamp.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides :class:`MultiAmp`, an amplifier that combines
+several low level amplifiers into one.
+
+Use it to record e.g. an EEG amplifier and a physiological amplifier
+streamed via lsl side by side, with one :class:`AmpDecorator`, one file
+and one marker timeline::
+
+    from libmushu.ampdecorator import AmpDecorator
+    from libmushu.multiamp import MultiAmp
+    from libmushu.driver.randomamp import RandomAmp
+    from libmushu.driver.labstreaminglayer import LSLAmp
+
+    amp = AmpDecorator(lambda: MultiAmp([RandomAmp(), LSLAmp()]))
+    amp.configure(configs=[{'fs': 1000, 'channels': 32}, {}])
+    amp.start()
+    data, markers = amp.get_data()
+
+"""
+
+from __future__ import division
+
+import logging
+import threading
+
+import numpy as np
+
+from libmushu.amplifier import Amplifier
+from libmushu.clock import now_ns, NS_PER_S
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+# the drift of an amplifier's clock is estimated once it delivered this
+# many seconds of samples, until then the nominal sampling frequency is
+# used
+DRIFT_SPAN = 10.
+# larger relative deviations from the nominal sample period are taken
+# for errors of the estimate
+MAX_DRIFT = 1e-3
+# the number of recent blocks whose arrival times give the host time of
+# the first sample
+ENVELOPE = 100
+
+
+class MultiAmp(Amplifier):
+    """Drive several amplifiers concurrently and merge their data.
+
+    Each amplifier is polled in its own thread, so a slow driver does
+    not throttle the others. All samples are placed on the host clock:
+    for each amplifier the host time of its first sample and its sample
+    period are estimated from the arrival times of its blocks (see
+    :meth:`AmpThread.arrived`), so the clocks of the amplifiers may
+    drift against the host clock and each other. The first amplifier is
+    the reference, its samples and sampling frequency are returned as
+    they are; the samples of the other amplifiers are linearly
+    interpolated at the host times of the reference samples, which also
+    resamples them if their sampling frequency differs.
+
+    Reference samples are held back until all other amplifiers delivered
+    data up to their time, but at most ``max_delay`` seconds. Channels
+    of an amplifier without data for a sample are NaN.
+
+    The markers of all amplifiers are placed on the host clock as well
+    and returned relative to the onset of the merged block.
+
+    Parameters
+    ----------
+    amps : list of Amplifier
+        the low level amplifiers, the first one is the reference
+    max_delay : float, optional
+        the maximum time in seconds to wait for late amplifiers
+
+    """
+
+    def __init__(self, amps, max_delay=0.5):
+        self.amps = amps
+        self.max_delay = max_delay
+        self.presets = []
+        self.condition = threading.Condition()
+        self.threads = []
+        self.markers = []
+
+    def configure(self, configs=None):
+        """Configure the amplifiers.
+
+        Parameters
+        ----------
+        configs : list of dicts, optional
+            the configuration of each amplifier, in the same order as
+            the amplifiers
+
+        """
+        if configs is None:
+            return
+        for amp, config in zip(self.amps, configs):
+            amp.configure(**config)
+
+    def start(self):
+        self.markers = []
+        self.threads = []
+        for amp in self.amps:
+            amp.start()
+            self.threads.append(AmpThread(amp, self.condition))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for thread in self.threads:
+            thread.running = False
+        for thread in self.threads:
+            thread.join(1)
+            if thread.is_alive():
+                logger.warning('%s did not stop in time.' % thread.name)
+        for amp in self.amps:
+            amp.stop()
+
+    def get_data(self):
+        """Get the merged data of all amplifiers.
+
+        Blocks until the reference amplifier has new data.
+
+        Returns
+        -------
+        data : 2darray
+            a numpy array (time, channels) of the channels of all
+            amplifiers, in the order of the amplifiers
+        markers : list of (float, str)
+            the markers of all amplifiers in ms relative to the onset
+            of the block
+
+        """
+        ref = self.threads[0]
+        with self.condition:
+            while True:
+                for thread in self.threads:
+                    self.markers.extend(thread.collect())
+                n = self._ready()
+                if n > 0 or not ref.is_alive():
+                    break
+                self.condition.wait(0.01)
+        t = ref.times(0, n)
+        data = [ref.pending[:n]]
+        for thread in self.threads[1:]:
+            data.append(thread.interpolate(t))
+        ref.consume(n)
+        data = np.hstack(data) if n > 0 else np.empty((0, len(self.get_channels())))
+        if n == 0:
+            return data, []
+        onset = t[0]
+        end = t[-1] + ref.period
+        markers = sorted([[(ts - onset) * 1000, m] for ts, m in self.markers if ts < end])
+        self.markers = [m for m in self.markers if m[0] >= end]
+        return data, markers
+
+    def _ready(self):
+        # the number of reference samples that can be returned
+        ref = self.threads[0]
+        if len(ref.pending) == 0:
+            return 0
+        t = ref.times(0, len(ref.pending))
+        until = now_ns() / NS_PER_S - self.max_delay
+        latest = [th.latest() for th in self.threads[1:]]
+        if latest and None not in latest:
+            until = max(until, min(latest))
+        elif not latest:
+            until = np.inf
+        return int(np.searchsorted(t, until, 'right'))
+
+    def get_channels(self):
+        channels = [c for amp in self.amps for c in amp.get_channels()]
+        if len(set(channels)) != len(channels):
+            channels = ['%d:%s' % (i, c) for i, amp in enumerate(self.amps) for c in amp.get_channels()]
+        return channels
+
+    def get_sampling_frequency(self):
+        return self.amps[0].get_sampling_frequency()
+
+    @staticmethod
+    def is_available():
+        return True
+
+
+class AmpThread(threading.Thread):
+    """Poll an amplifier in a background thread.
+
+    The received blocks and markers are collected under the shared
+    ``condition`` until :meth:`collect` moves them into :attr:`pending`.
+
+    Parameters
+    ----------
+    amp : Amplifier
+        the low level amplifier
+    condition : threading.Condition
+        notified whenever a new block arrived
+
+    """
+
+    def __init__(self, amp, condition):
+        super(AmpThread, self).__init__(name='AmpThread-%s' % type(amp).__name__)
+        self.daemon = True
+        self.amp = amp
+        self.fs = amp.get_sampling_frequency()
+        self.condition = condition
+        self.running = True
+        self.blocks = []
+        self.markers = []
+        # total number of samples received
+        self.samples = 0
+        # host time of the first sample and sample period in host time
+        self.t0 = None
+        self.period = 1 / self.fs
+        # running least squares fit of the arrival times against the
+        # number of samples: number of blocks, the sample number of the
+        # first one, means and co-moments
+        self.n_fit = 0
+        self.first_fit = 0
+        self.mean_x = self.mean_t = self.cxx = self.cxt = 0.
+        # the number of samples and arrival times of the recent blocks
+        self.arrivals = np.empty((ENVELOPE, 2))
+        self.n_arrivals = 0
+        # samples not consumed yet, starting with sample number
+        # ``first``. The data type is the amp's one once data arrived
+        self.pending = np.empty((0, len(amp.get_channels())))
+        self.first = 0
+
+    def run(self):
+        try:
+            while self.running:
+                data, markers = self.amp.get_data()
+                t = now_ns() / NS_PER_S
+                with self.condition:
+                    onset = self.samples
+                    self.samples += len(data)
+                    if len(data) > 0:
+                        self.arrived(self.samples, t)
+                    t_onset = t if self.t0 is None else self.t0 + onset * self.period
+                    self.markers.extend([t_onset + m[0] / 1000, m[1]] for m in markers)
+                    if len(data) > 0:
+                        self.blocks.append(data)
+                    self.condition.notify_all()
+        except Exception:
+            logger.error('%s failed.' % self.name, exc_info=True)
+            with self.condition:
+                self.condition.notify_all()
+
+    def arrived(self, samples, t):
+        """Update the clock estimate with a block.
+
+        The sample period is the slope of a running least squares fit
+        of the arrival times against the number of samples, once the
+        amp delivered :data:`DRIFT_SPAN` seconds of samples. The host
+        time of the first sample is the lower envelope of the arrivals
+        of the last :data:`ENVELOPE` blocks, i.e. of the blocks that
+        arrived with the least delay.
+
+        Must be called with the condition acquired.
+
+        Parameters
+        ----------
+        samples : int
+            the number of samples received including the block
+        t : float
+            the host time in seconds the block arrived
+
+        """
+        if self.n_fit == 0:
+            self.first_fit = samples
+        self.n_fit += 1
+        dx = samples - self.mean_x
+        self.mean_x += dx / self.n_fit
+        self.mean_t += (t - self.mean_t) / self.n_fit
+        self.cxx += dx * (samples - self.mean_x)
+        self.cxt += dx * (t - self.mean_t)
+        if samples - self.first_fit >= DRIFT_SPAN * self.fs:
+            period = self.cxt / self.cxx
+            if abs(period * self.fs - 1) <= MAX_DRIFT:
+                self.period = period
+        self.arrivals[self.n_arrivals % ENVELOPE] = samples, t
+        self.n_arrivals += 1
+        recent = self.arrivals[:min(self.n_arrivals, ENVELOPE)]
+        self.t0 = float(np.min(recent[:, 1] - recent[:, 0] * self.period))
+
+    def collect(self):
+        """Move the received blocks into :attr:`pending`.
+
+        Must be called with the condition acquired.
+
+        Returns
+        -------
+        markers : list of (float, str)
+            the markers received since the last call, with host
+            timestamps
+
+        """
+        if self.blocks:
+            pending = self.pending.astype(self.blocks[0].dtype, copy=False)
+            self.pending = np.concatenate([pending] + self.blocks)
+            self.blocks = []
+        markers, self.markers = self.markers, []
+        return markers
+
+    def times(self, start, stop):
+        """Host times of the pending samples ``start:stop``."""
+        return self.t0 + (self.first + np.arange(start, stop)) * self.period
+
+    def latest(self):
+        """Host time of the last received sample or None."""
+        if self.t0 is None or self.first + len(self.pending) == 0:
+            return None
+        return self.t0 + (self.first + len(self.pending) - 1) * self.period
+
+    def consume(self, n):
+        """Drop the first n pending samples."""
+        self.pending = self.pending[n:]
+        self.first += n
+
+    def interpolate(self, t):
+        """Interpolate the pending samples at the host times ``t``.
+
+        Samples before ``t[-1]`` are dropped afterwards, except the one
+        needed to interpolate the next block.
+
+        Returns
+        -------
+        data : 2darray
+            (len(t), channels), NaN where no data is available
+
+        """
+        out = np.full((len(t), self.pending.shape[1]), np.nan)
+        if len(self.pending) == 0 or len(t) == 0:
+            return out
+        tau = self.times(0, len(self.pending))
+        i = np.searchsorted(tau, t, 'right')
+        valid = (i > 0) & ((i < len(tau)) | (t == tau[-1]))
+        i = np.clip(i, 1, len(tau) - 1) if len(tau) > 1 else np.ones_like(i)
+        if len(tau) > 1:
+            w = ((t - tau[i-1]) / (tau[i] - tau[i-1]))[:, np.newaxis]
+            values = self.pending[i-1] * (1 - w) + self.pending[i] * w
+        else:
+            values = np.repeat(self.pending[:1], len(t), axis=0).astype(np.float64)
+        out[valid] = values[valid]
+        self.consume(max(0, int(np.searchsorted(tau, t[-1], 'right')) - 1))
+        return out
@@ -0,0 +1,925 @@
+# ringbuffer.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides ring buffers to pass data between processes and
+threads.
+
+:class:`SampleRing` passes the samples and markers acquired by the
+background acquisition thread of the
+:class:`libmushu.ampdecorator.AmpDecorator` to the caller of
+``get_data``.
+
+:class:`BroadcastRing` publishes the samples and markers of one
+acquisition to any number of subscribers (:class:`Subscriber`) in other processes,
+each reading at its own pace without copying the samples.
+
+:class:`MarkerRing` passes the markers received by the marker server to
+the :class:`libmushu.ampdecorator.AmpDecorator`. It lives in a
+:class:`multiprocessing.shared_memory.SharedMemory` block, which is
+laid out as follows:
+
+    * a header of int64 counters (see :data:`HEADER_FIELDS`). ``head``
+      and the statistics are only written by the producer, ``tail``
+      and ``overwritten`` only by the consumer.
+    * the ring of fixed size marker records (:data:`MARKER_DTYPE`): the
+      timestamp in ns (see :mod:`libmushu.clock`) and the id of the
+      marker's label
+    * the interned label table: the offsets of the labels and a heap
+      with their UTF-8 encoded bytes. Labels are appended by the
+      producer, the consumer decodes new labels lazily.
+
+Since there is exactly one producer and one consumer, each index is
+written by one side only and no locks are needed. The producer writes a
+record before publishing it by incrementing ``head``; the consumer
+reads the records before releasing them by moving ``tail``.
+
+What happens when the ring is full depends on its overflow policy (see
+:data:`OVERFLOW_POLICIES`). With 'drop-oldest' the producer overwrites
+the oldest records without looking at ``tail``. The consumer notices
+from ``head`` that records were overwritten, also while it was copying
+them, and skips and counts those.
+
+"""
+
+from __future__ import division
+
+import sys
+import time
+import logging
+import threading
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from libmushu.clock import now_ns, samples_to_ns, NS_PER_S, NS_PER_MS
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+MARKER_DTYPE = np.dtype([('timestamp', '<i8'), ('label', '<i4'), ('pad', '<i4')])
+HEADER_FIELDS = ('head', 'tail', 'dropped', 'labels', 'lost', 'reordered', 'received', 'overwritten',
+                 'duplicates')
+# the counters reported by MarkerRing.counters
+COUNTERS = ('received', 'dropped', 'lost', 'reordered', 'duplicates')
+# 'drop-newest' drops new markers if the ring is full, 'drop-oldest'
+# overwrites the oldest ones. 'block' drops new markers as well, but
+# tells the marker server to stop reading from TCP connections until
+# there is room again, so the senders block.
+OVERFLOW_POLICIES = ('drop-newest', 'drop-oldest', 'block')
+# the header occupies full cache lines, so the records do not share
+# one with the indices
+HEADER_SIZE = 128
+
+# the counters of a BroadcastRing, all written by the producer only
+BROADCAST_FIELDS = ('written', 'writing', 'markers', 'labels', 'closed')
+# the parameters of a BroadcastRing, stored after its counters so
+# unrelated processes can attach to it by name
+BROADCAST_META = np.dtype([('capacity', '<i8'), ('channels', '<i8'), ('marker_capacity', '<i8'),
+                           ('max_labels', '<i8'), ('heap_size', '<i8'), ('fs', '<f8'), ('dtype', 'S8')])
+# how often a waiting Subscriber polls the ring, in seconds
+POLL_INTERVAL = .001
+
+
+def ring_slices(start, end, capacity):
+    """Return the slices of the items ``start`` to ``end`` of a ring.
+
+    Returns
+    -------
+    slices : tuple of (int, int, int)
+        (ring offset, offset, length) of the two parts of the items,
+        split where the ring wraps around. The second part may be
+        empty.
+
+    """
+    i0 = start % capacity
+    n0 = min(end - start, capacity - i0)
+    return (i0, 0, n0), (0, n0, end - start - n0)
+
+
+class LabelTable(object):
+    """An append only table of interned labels in shared memory.
+
+    The producer interns the labels and gets an integer id for each,
+    the consumers decode new ids lazily. The number of labels is
+    published after their bytes are written, so any number of consumers
+    can read the table while the producer appends to it.
+
+    Parameters
+    ----------
+    count : 1darray of int64
+        a view of one counter in the shared memory, the number of labels
+    buf : memoryview
+        the shared memory
+    offset : int
+        the offset of the table in ``buf``, it occupies
+        :meth:`nbytes` bytes
+    max_labels : int
+        the maximum number of labels
+    heap_size : int
+        the number of bytes available for the UTF-8 encoded labels
+
+    """
+
+    def __init__(self, count, buf, offset, max_labels, heap_size):
+        self.count = count
+        self.max_labels = max_labels
+        self.heap_size = heap_size
+        self.offsets = np.ndarray(max_labels + 1, dtype=np.int64, buffer=buf, offset=offset)
+        self.heap = np.ndarray(heap_size, dtype=np.uint8, buffer=buf, offset=offset + (max_labels + 1) * 8)
+        # label -> id on the producer side, id -> label on the consumer
+        # side
+        self.ids = {}
+        self.labels = []
+
+    @staticmethod
+    def nbytes(max_labels, heap_size):
+        """The size of a table in bytes."""
+        return (max_labels + 1) * 8 + heap_size
+
+    def intern(self, label):
+        """Return the id of a label, adding it if necessary, called by
+        the producer.
+
+        Returns
+        -------
+        id : int or None
+            None if the table is full
+
+        """
+        i = self.ids.get(label)
+        if i is not None:
+            return i
+        n = int(self.count[0])
+        data = label.encode('utf-8')
+        start = int(self.offsets[n])
+        if n >= self.max_labels or start + len(data) > self.heap_size:
+            logger.error('Label table is full, dropping marker %r.' % label)
+            return None
+        self.heap[start:start+len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self.offsets[n+1] = start + len(data)
+        self.count[0] = n + 1
+        self.ids[label] = n
+        return n
+
+    def decode(self, ids):
+        """Return the labels of ids, called by the consumers.
+
+        Parameters
+        ----------
+        ids : 1darray of ints
+
+        Returns
+        -------
+        labels : list of str
+
+        """
+        if len(ids) == 0:
+            return []
+        if ids.max() >= len(self.labels):
+            offsets = self.offsets
+            for n in range(len(self.labels), int(self.count[0])):
+                self.labels.append(self.heap[offsets[n]:offsets[n+1]].tobytes().decode('utf-8'))
+        labels = self.labels
+        return [labels[i] for i in ids.tolist()]
+
+
+class MarkerRing(object):
+    """A single producer, single consumer ring of markers in shared memory.
+
+    Create the ring in the consumer process and pass it to the producer
+    process, e.g. as an argument of :class:`multiprocessing.Process`.
+
+    Parameters
+    ----------
+    capacity : int, optional
+        the maximum number of markers in the ring
+    overflow : str, optional
+        what happens to markers that do not fit into the ring, one of
+        :data:`OVERFLOW_POLICIES`. Dropped markers are counted in
+        :attr:`dropped`. With 'drop-oldest' the ring keeps at most
+        ``capacity - 1`` markers.
+    max_labels : int, optional
+        the maximum number of distinct labels
+    heap_size : int, optional
+        the number of bytes available for the label table
+
+    """
+
+    def __init__(self, capacity=4096, overflow='drop-newest', max_labels=4096, heap_size=2**18):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: %r' % overflow)
+        self.capacity = capacity
+        self.overflow = overflow
+        self.max_labels = max_labels
+        self.heap_size = heap_size
+        size = self._layout()[-1]
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.owner = True
+        self._attach()
+        self.header[:] = 0
+
+    def _layout(self):
+        # offsets of the records, the label table and the end
+        records = HEADER_SIZE
+        offsets = records + self.capacity * MARKER_DTYPE.itemsize
+        return records, offsets, offsets + LabelTable.nbytes(self.max_labels, self.heap_size)
+
+    def _attach(self):
+        records, offsets, end = self._layout()
+        buf = self.shm.buf
+        self.header = np.ndarray(len(HEADER_FIELDS), dtype=np.int64, buffer=buf)
+        self.records = np.ndarray(self.capacity, dtype=MARKER_DTYPE, buffer=buf, offset=records)
+        self.label_table = LabelTable(self.header[3:4], buf, offsets, self.max_labels, self.heap_size)
+
+    def __getstate__(self):
+        return {'shm': self.shm, 'capacity': self.capacity, 'overflow': self.overflow,
+                'max_labels': self.max_labels, 'heap_size': self.heap_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = False
+        self._attach()
+
+    def put(self, timestamp, label):
+        """Append a marker, called by the producer.
+
+        Parameters
+        ----------
+        timestamp : int
+            the time in ns
+        label : str
+
+        Returns
+        -------
+        success : bool
+            False if the marker was dropped
+
+        """
+        self.header[6] += 1
+        i = self.label_table.ids.get(label)
+        if i is None:
+            i = self.label_table.intern(label)
+        head = int(self.header[0])
+        if i is None or (self.overflow != 'drop-oldest' and head - int(self.header[1]) >= self.capacity):
+            self.header[2] += 1
+            return False
+        record = self.records[head % self.capacity]
+        record['timestamp'] = timestamp
+        record['label'] = i
+        self.header[0] = head + 1
+        return True
+
+    def put_many(self, timestamps, labels):
+        """Append several markers at once, called by the producer.
+
+        Markers that do not fit into the ring are dropped according to
+        the overflow policy.
+
+        Parameters
+        ----------
+        timestamps : 1darray of ints
+            the times in ns
+        labels : list of str
+
+        Returns
+        -------
+        n : int
+            the number of markers put into the ring
+
+        """
+        ids = []
+        table = self.label_table
+        for label in labels:
+            i = table.ids.get(label)
+            if i is None:
+                i = table.intern(label)
+                if i is None:
+                    i = -1
+            ids.append(i)
+        self.header[6] += len(labels)
+        ids = np.array(ids, dtype=np.int32)
+        valid = ids >= 0
+        ids, timestamps = ids[valid], np.asarray(timestamps)[valid]
+        head = int(self.header[0])
+        if self.overflow == 'drop-oldest':
+            # only the newest markers survive a batch larger than the
+            # ring
+            ids, timestamps = ids[-self.capacity:], timestamps[-self.capacity:]
+            n = len(ids)
+        else:
+            n = min(len(ids), self.capacity - (head - int(self.header[1])))
+        self.header[2] += len(labels) - n
+        # the free slots, split where the ring wraps around
+        i0 = head % self.capacity
+        n0 = min(n, self.capacity - i0)
+        for j, k, m in (i0, 0, n0), (0, n0, n - n0):
+            self.records['timestamp'][j:j+m] = timestamps[k:k+m]
+            self.records['label'][j:j+m] = ids[k:k+m]
+        self.header[0] = head + n
+        return n
+
+    def count(self, counter, n=1):
+        """Increase one of the statistics counters, called by the
+        producer.
+
+        Parameters
+        ----------
+        counter : str
+            one of :data:`COUNTERS`
+        n : int, optional
+
+        """
+        self.header[HEADER_FIELDS.index(counter)] += n
+
+    def counters(self):
+        """Return the statistics counters.
+
+        Returns
+        -------
+        counters : dict
+            ``received`` the number of markers put into the ring,
+            including the dropped ones, ``dropped`` the number of
+            markers dropped because the ring was full, ``lost`` the
+            number of markers known to be lost in transmission,
+            ``reordered`` the number of lost markers that arrived late
+            and ``duplicates`` the number of markers that arrived again
+
+        """
+        counters = dict((c, int(self.header[HEADER_FIELDS.index(c)])) for c in COUNTERS)
+        counters['dropped'] = self.dropped
+        return counters
+
+    def drain(self):
+        """Remove all markers from the ring, called by the consumer.
+
+        Returns
+        -------
+        markers : list of (int, str)
+            the timestamps in ns and labels of the markers in the order
+            they were put into the ring
+
+        """
+        head = int(self.header[0])
+        tail = int(self.header[1])
+        if head == tail:
+            return []
+        # with 'drop-oldest' the slot after head may be being
+        # overwritten, so at most capacity - 1 records are valid
+        valid = self.capacity - 1 if self.overflow == 'drop-oldest' else self.capacity
+        if head - tail > valid:
+            self.header[7] += head - valid - tail
+            tail = head - valid
+        i0, i1 = tail % self.capacity, head % self.capacity
+        if i0 < i1:
+            records = self.records[i0:i1].copy()
+        else:
+            records = np.concatenate([self.records[i0:], self.records[:i1]])
+        self.header[1] = head
+        if self.overflow == 'drop-oldest':
+            # records overwritten while they were copied
+            k = min(int(self.header[0]) - valid - tail, len(records))
+            if k > 0:
+                self.header[7] += k
+                records = records[k:]
+                if len(records) == 0:
+                    return []
+        labels = self.label_table.decode(records['label'])
+        return [[t, label] for t, label in zip(records['timestamp'].tolist(), labels)]
+
+    def __len__(self):
+        return min(int(self.header[0] - self.header[1]), self.capacity)
+
+    @property
+    def full(self):
+        """True if the ring is full."""
+        return len(self) >= self.capacity
+
+    @property
+    def dropped(self):
+        """The number of markers dropped because the ring was full."""
+        return int(self.header[2] + self.header[7])
+
+    def close(self):
+        """Release the shared memory.
+
+        The process that created the ring also destroys the shared
+        memory block.
+
+        """
+        self.header = self.records = self.label_table = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SampleRing(object):
+    """A single producer, single consumer ring of samples and markers
+    for threads.
+
+    The ring is allocated on the first :meth:`write`, when the data type
+    of the samples is known. If the consumer falls behind by more than
+    ``capacity`` samples, the oldest samples are overwritten and counted
+    in :attr:`overruns`.
+
+    Besides blocking in :meth:`read`, a consumer can register a
+    listener that is called after every write, e.g. to wake up an
+    event loop, and then read with a timeout of 0.
+
+    Parameters
+    ----------
+    capacity : int
+        the number of samples in the ring
+    channels : int
+        the number of channels
+
+    """
+
+    def __init__(self, capacity, channels):
+        self.capacity = capacity
+        self.channels = channels
+        self.data = None
+        self.markers = []
+        # the number of samples written and read so far
+        self.written = 0
+        self.position = 0
+        self.overruns = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.listeners = []
+
+    def write(self, data, markers):
+        """Append samples and markers, called by the producer.
+
+        Parameters
+        ----------
+        data : 2darray
+            the samples (time, channels)
+        markers : list
+            the markers, passed on to the consumer as they are
+
+        """
+        n = len(data)
+        with self.condition:
+            if self.data is None:
+                self.data = np.empty((self.capacity, self.channels), dtype=data.dtype)
+            # only the newest samples survive a block larger than the
+            # ring
+            keep = min(n, self.capacity)
+            data = data[n-keep:]
+            for j, k, m in self._slices(self.written + n - keep, self.written + n):
+                self.data[j:j+m] = data[k:k+m]
+            self.written += n
+            self.markers.extend(markers)
+            self._notify()
+
+    def add_listener(self, callback):
+        """Call ``callback()`` after every write and on :meth:`close`.
+
+        The callback is called by the producer while it holds the lock
+        of the ring, it must return quickly and must not access the
+        ring, e.g. ``loop.call_soon_threadsafe``.
+
+        """
+        with self.condition:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Remove a listener added with :meth:`add_listener`."""
+        with self.condition:
+            self.listeners.remove(callback)
+
+    def ready(self):
+        """Return True if :meth:`read` would return without waiting."""
+        with self.condition:
+            return self._ready()
+
+    def _ready(self):
+        return self.written > self.position or bool(self.markers) or self.closed
+
+    def _notify(self):
+        self.condition.notify_all()
+        for callback in self.listeners:
+            callback()
+
+    def read(self, timeout=None, out=None):
+        """Remove all samples and markers written since the last call,
+        called by the consumer.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            the maximum time in seconds to wait for samples, forever if
+            None
+        out : 2darray, optional
+            if given, the samples are copied into its first rows instead
+            of a new array. Samples that do not fit stay in the ring for
+            the next call.
+
+        Returns
+        -------
+        data : 2darray
+            the samples, empty if there were none before the timeout.
+            A view of ``out`` if given.
+        markers : list
+        start : int
+            the number of the first returned sample, counted from the
+            first sample ever written
+        overrun : int
+            the number of samples lost since the last call, because the
+            consumer fell behind
+
+        """
+        with self.condition:
+            self.condition.wait_for(self._ready, timeout)
+            start = max(self.position, self.written - self.capacity)
+            overrun = start - self.position
+            self.overruns += overrun
+            end = self.written if out is None else min(self.written, start + len(out))
+            if out is not None:
+                data = out[:end-start]
+            elif self.data is None:
+                data = np.empty((0, self.channels))
+            else:
+                data = np.empty((end - start, self.channels), dtype=self.data.dtype)
+            if end > start:
+                for j, k, m in self._slices(start, end):
+                    data[k:k+m] = self.data[j:j+m]
+            markers, self.markers = self.markers, []
+            self.position = end
+        return data, markers, start, overrun
+
+    def _slices(self, start, end):
+        return ring_slices(start, end, self.capacity)
+
+    def close(self):
+        """Wake up a waiting consumer, no more samples will be written."""
+        with self.condition:
+            self.closed = True
+            self._notify()
+
+
+class BroadcastRing(object):
+    """A single producer, many consumer ring of samples and markers in
+    shared memory.
+
+    The producer publishes blocks with :meth:`write`. Any number of
+    consumers follow it with their own cursor, see :meth:`subscribe`.
+    The producer never waits for them: a subscriber that falls more
+    than ``capacity`` samples behind loses the oldest samples and is
+    told so by :meth:`Subscriber.read` and :meth:`Subscriber.check`.
+
+    The shared memory block starts with the int64 counters of
+    :data:`BROADCAST_FIELDS` and the parameters of the ring
+    (:data:`BROADCAST_META`), followed by the samples, the marker
+    records (:data:`MARKER_DTYPE`) and a :class:`LabelTable`. ``written``
+    is the sequence number of the next sample, ``writing`` the end of
+    the samples being written; the producer sets ``writing`` before it
+    overwrites any samples and publishes them and their markers by
+    advancing ``written`` and ``markers``. This way a subscriber can
+    tell if the samples it read were overwritten while it used them.
+
+    Create the ring in the producer and pass it to the consumer
+    processes, e.g. as an argument of :class:`multiprocessing.Process`,
+    or attach unrelated processes by name with :meth:`attach`.
+
+    Parameters
+    ----------
+    channels : int
+        the number of channels
+    fs : float
+        the sampling frequency, the subscribers use it to make the
+        markers relative to the onset of their blocks
+    capacity : int
+        the number of samples in the ring
+    dtype : numpy dtype, optional
+        the data type of the samples, written data is converted to it
+    marker_capacity : int, optional
+        the number of markers in the ring
+    max_labels : int, optional
+        the maximum number of distinct labels
+    heap_size : int, optional
+        the number of bytes available for the label table
+    name : str, optional
+        the name of the shared memory block, a random one if None
+
+    """
+
+    def __init__(self, channels, fs, capacity, dtype=np.float64, marker_capacity=4096,
+                 max_labels=4096, heap_size=2**18, name=None):
+        dtype = np.dtype(dtype)
+        meta = np.zeros((), dtype=BROADCAST_META)
+        meta['capacity'], meta['channels'], meta['marker_capacity'] = capacity, channels, marker_capacity
+        meta['max_labels'], meta['heap_size'], meta['fs'] = max_labels, heap_size, fs
+        meta['dtype'] = dtype.str.encode('ascii')
+        self._configure(meta)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=self._layout()[-1])
+        self.owner = True
+        self._attach()
+        self.header[:] = 0
+        self.meta[()] = meta
+
+    def _configure(self, meta):
+        self.capacity = int(meta['capacity'])
+        self.channels = int(meta['channels'])
+        self.marker_capacity = int(meta['marker_capacity'])
+        self.max_labels = int(meta['max_labels'])
+        self.heap_size = int(meta['heap_size'])
+        self.fs = float(meta['fs'])
+        self.dtype = np.dtype(meta['dtype'].item().decode('ascii'))
+
+    def _layout(self):
+        # offsets of the samples, the marker records, the label table
+        # and the end
+        data = HEADER_SIZE + BROADCAST_META.itemsize
+        # align the samples with a cache line
+        data += -data % 64
+        records = data + self.capacity * self.channels * self.dtype.itemsize
+        records += -records % 8
+        labels = records + self.marker_capacity * MARKER_DTYPE.itemsize
+        return data, records, labels, labels + LabelTable.nbytes(self.max_labels, self.heap_size)
+
+    def _attach(self):
+        data, records, labels, end = self._layout()
+        buf = self.shm.buf
+        self.header = np.ndarray(len(BROADCAST_FIELDS), dtype=np.int64, buffer=buf)
+        self.meta = np.ndarray((), dtype=BROADCAST_META, buffer=buf, offset=HEADER_SIZE)
+        self.data = np.ndarray((self.capacity, self.channels), dtype=self.dtype, buffer=buf, offset=data)
+        self.records = np.ndarray(self.marker_capacity, dtype=MARKER_DTYPE, buffer=buf, offset=records)
+        self.label_table = LabelTable(self.header[3:4], buf, labels, self.max_labels, self.heap_size)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to the ring of another process by name.
+
+        Use this for processes that were not started by the producer,
+        pass the ring itself to child processes.
+
+        Parameters
+        ----------
+        name : str
+            the :attr:`name` of the ring
+
+        Returns
+        -------
+        ring : BroadcastRing
+
+        """
+        self = cls.__new__(cls)
+        if sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # otherwise the resource tracker of this process destroys
+            # the block when the process exits
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.owner = False
+        self._configure(np.ndarray((), dtype=BROADCAST_META, buffer=self.shm.buf, offset=HEADER_SIZE).copy())
+        self._attach()
+        return self
+
+    @property
+    def name(self):
+        """The name of the shared memory block."""
+        return self.shm.name
+
+    def __getstate__(self):
+        return {'shm': self.shm}
+
+    def __setstate__(self, state):
+        self.shm = state['shm']
+        self.owner = False
+        self._configure(np.ndarray((), dtype=BROADCAST_META, buffer=self.shm.buf, offset=HEADER_SIZE).copy())
+        self._attach()
+
+    def write(self, data, markers):
+        """Publish samples and markers, called by the producer.
+
+        Parameters
+        ----------
+        data : 2darray
+            the samples (time, channels)
+        markers : list of (int, str)
+            the markers, the time in ns relative to the first sample
+            ever written
+
+        """
+        header = self.header
+        written = int(header[0])
+        n = len(data)
+        # only the newest samples survive a block larger than the ring
+        keep = min(n, self.capacity)
+        data = data[n-keep:]
+        header[1] = written + n
+        for j, k, m in ring_slices(written + n - keep, written + n, self.capacity):
+            self.data[j:j+m] = data[k:k+m]
+        i = int(header[2])
+        for t, label in markers[-self.marker_capacity:]:
+            label_id = self.label_table.ids.get(label)
+            if label_id is None:
+                label_id = self.label_table.intern(label)
+                if label_id is None:
+                    continue
+            record = self.records[i % self.marker_capacity]
+            record['timestamp'] = t
+            record['label'] = label_id
+            i += 1
+        header[2] = i
+        header[0] = written + n
+
+    def subscribe(self):
+        """Return a new subscriber that starts with the next sample
+        written.
+
+        Returns
+        -------
+        subscriber : Subscriber
+
+        """
+        ring = self
+        if self.owner:
+            # subscribers in the producer's process get their own
+            # mapping, which stays valid after the producer closed the
+            # ring
+            ring = self.__class__.__new__(self.__class__)
+            ring.__setstate__({'shm': shared_memory.SharedMemory(name=self.name)})
+        return Subscriber(ring)
+
+    @property
+    def closed(self):
+        """True if the producer closed the ring."""
+        return bool(self.header[4])
+
+    def close(self):
+        """Release the shared memory.
+
+        If called by the producer, the subscribers are told that no
+        more samples will be written and the shared memory block is
+        destroyed once all processes released it. The samples returned
+        by the subscribers of this object must not be used afterwards.
+
+        """
+        if self.header is None:
+            return
+        if self.owner:
+            self.header[4] = 1
+        self.header = self.meta = self.data = self.records = self.label_table = None
+        if self.owner:
+            self.shm.unlink()
+        self.shm.close()
+
+
+class Subscriber(object):
+    """A consumer of a :class:`BroadcastRing` with its own cursor.
+
+    Use :meth:`BroadcastRing.subscribe` to create it.
+
+    Parameters
+    ----------
+    ring : BroadcastRing
+
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = int(ring.header[0])
+        self.marker_position = int(ring.header[2])
+        # the samples returned by the last read that were not
+        # overwritten yet, and the markers read but not yet returned
+        self.view = (self.position, self.position)
+        self.pending = []
+        self.overruns = 0
+        self.lost_markers = 0
+
+    def read(self, timeout=None, max_samples=None):
+        """Return the samples and markers published since the last call.
+
+        The samples are a view of the shared memory, they are valid
+        until the producer overwrites them, at the latest after another
+        ``capacity`` samples. Call :meth:`check` after using them or
+        copy them to keep them.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            the maximum time in seconds to wait for samples, forever if
+            None
+        max_samples : int, optional
+            return at most this many samples, the rest is returned by
+            the next call
+
+        Returns
+        -------
+        data : 2darray
+            the samples, empty if there were none before the timeout or
+            the ring was closed. Where the ring wraps around only the
+            samples up to the end of the ring are returned.
+        markers : list of (float, str)
+            the markers in ms relative to the onset of ``data``.
+            Markers of samples not returned yet are held back, unless
+            the ring was closed.
+        start : int
+            the number of the first returned sample, counted from the
+            first sample ever written
+        overrun : int
+            the number of samples skipped since the last call, because
+            the subscriber fell behind
+
+        """
+        ring = self.ring
+        header = ring.header
+        capacity = ring.capacity
+        t_end = None if timeout is None else now_ns() + timeout * NS_PER_S
+        while int(header[0]) <= self.position and not header[4]:
+            if t_end is not None and now_ns() >= t_end:
+                break
+            time.sleep(POLL_INTERVAL)
+        written = int(header[0])
+        first = max(self.position, written - capacity)
+        end = first + min(written - first, capacity - first % capacity)
+        if max_samples is not None:
+            end = min(end, first + max_samples)
+        # skip the samples the producer already started to overwrite
+        start = min(max(first, int(header[1]) - capacity), end)
+        overrun = start - self.position
+        data = ring.data[start % capacity:start % capacity + end - start]
+        self.position = end
+        self.view = (start, end)
+        self.overruns += overrun
+        self._read_markers()
+        return data, self._markers(start, end), start, overrun
+
+    def check(self):
+        """Check the samples returned by the last :meth:`read`.
+
+        Returns
+        -------
+        overwritten : int
+            the number of the samples the producer has started to
+            overwrite since they were returned, 0 if they are all
+            intact. These samples are added to :attr:`overruns`.
+
+        """
+        start, end = self.view
+        overwritten = max(min(int(self.ring.header[1]) - self.ring.capacity, end) - start, 0)
+        self.view = (start + overwritten, end)
+        self.overruns += overwritten
+        return overwritten
+
+    def _read_markers(self):
+        # copy the markers published since the last call
+        ring = self.ring
+        header = ring.header
+        capacity = ring.marker_capacity
+        head = int(header[2])
+        tail = max(self.marker_position, head - capacity)
+        self.lost_markers += tail - self.marker_position
+        if head == tail:
+            return
+        records = np.concatenate([ring.records[j:j+m] for j, k, m in ring_slices(tail, head, capacity)])
+        # records overwritten while they were copied
+        k = min(int(header[2]) - capacity - tail, len(records))
+        if k > 0:
+            self.lost_markers += k
+            records = records[k:]
+        self.marker_position = head
+        labels = ring.label_table.decode(records['label'])
+        self.pending.extend(zip(records['timestamp'].tolist(), labels))
+
+    def _markers(self, start, end):
+        # the pending markers up to the end of the samples, relative to
+        # their onset
+        if not self.pending:
+            return []
+        onset = samples_to_ns(start, self.ring.fs)
+        if self.closed:
+            markers, self.pending = self.pending, []
+        else:
+            end = samples_to_ns(end, self.ring.fs)
+            markers = [m for m in self.pending if m[0] < end]
+            self.pending = [m for m in self.pending if m[0] >= end]
+        markers.sort(key=lambda m: m[0])
+        return [[(t - onset) / NS_PER_MS, label] for t, label in markers]
+
+    @property
+    def closed(self):
+        """True if the producer closed the ring and all samples were
+        read."""
+        return self.ring.closed and self.position >= int(self.ring.header[0])
@@ -0,0 +1,924 @@
+# writer.py
+# Copyright (C) 2013  Bastian Venthur
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+This module provides the writers used by
+:class:`libmushu.ampdecorator.AmpDecorator` to save the data and markers
+of a recording to disk.
+
+A recording consists of four files:
+
+    ``<filename>.eeg``
+        a fixed size binary header (see :data:`HEADER_FORMAT`) followed
+        by the samples as (time, channels) rows in the native data type
+        of the amplifier
+    ``<filename>.marker``
+        one ``"<time in ms> <label>"`` line per marker
+    ``<filename>.markeridx``
+        the markers indexed by time and label, written when the writer
+        is closed (see :mod:`libmushu.markerindex`)
+    ``<filename>.meta``
+        a JSON file with the channel names, sampling frequency, data type
+        and number of samples
+
+While a recording is running, ``<filename>.checkpoint`` holds the last
+consistent state of the files (see :func:`read_checkpoint`), so a
+recording interrupted by a crash can be recovered quickly with
+:func:`libmushu.io.recover`. The file is removed when the recording is
+closed properly.
+
+Segmented recordings have ``<filename>.0000.eeg``, ``<filename>.0001.eeg``,
+... instead of ``<filename>.eeg`` and an additional JSON file
+``<filename>.manifest`` listing the segments.
+
+Alternatively, recordings can be written in the BrainVision format
+(:class:`BrainVisionWriter`).
+
+The writing can either happen inline, in the thread calling
+:meth:`RecordingWriter.write`, or in a background thread
+(:class:`ThreadedWriter`) so a slow disk does not stall the acquisition.
+Use :func:`get_writer` to create the desired writer.
+
+The header of the ``.eeg`` file contains everything needed to map the
+data into memory, so a recording can be opened without parsing the
+other files::
+
+    header = read_header('foo.eeg')
+    data = np.memmap('foo.eeg', dtype=header['dtype'], mode='r',
+                     offset=HEADER_SIZE,
+                     shape=(header['samples'], header['channels']))
+
+"""
+
+from __future__ import division
+
+import os
+import time
+import json
+import logging
+import threading
+import queue
+import struct
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from libmushu.clock import now_ns, NS_PER_S
+from libmushu.markerindex import MarkerIndex
+
+
+logger = logging.getLogger(__name__)
+logger.info('Logger started')
+
+
+MAGIC = b'MUSHUEEG'
+VERSION = 1
+# magic, version, data type (numpy dtype string, e.g. '<f4'), number of
+# channels, sampling frequency, number of samples, index of the first
+# sample (for segmented recordings)
+HEADER_FORMAT = '<8sI8sIdqq'
+# the header is padded to a full page, so the data is page aligned
+HEADER_SIZE = 4096
+# grow the .eeg file in extents of this size
+PREALLOCATE = 2**26
+
+CHECKPOINT_MAGIC = b'MUSHUCKP'
+# magic, version, index of the current segment, number of samples,
+# number of samples in the current segment, byte position in the current
+# .eeg file, bytes preallocated for the current .eeg file, byte offset in
+# the .marker file, number of markers, time
+CHECKPOINT_FORMAT = '<8sIIqqqqqqd'
+# write a checkpoint at most every this many seconds
+CHECKPOINT_INTERVAL = 1.
+
+
+def pack_header(dtype, channels, fs, samples, first_sample=0):
+    """Create the binary header of an ``.eeg`` file.
+
+    Parameters
+    ----------
+    dtype : numpy dtype or None
+        the data type of the samples, None if not known yet
+    channels : int
+        the number of channels
+    fs : float
+        the sampling frequency
+    samples : int
+        the number of samples
+    first_sample : int, optional
+        the index of the first sample within the recording, for
+        segmented recordings
+
+    Returns
+    -------
+    header : bytes
+        the header, padded to :data:`HEADER_SIZE` bytes
+
+    """
+    dtype = b'' if dtype is None else np.dtype(dtype).str.encode()
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, dtype, channels, fs, samples, first_sample)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def read_header(filename):
+    """Read the header of an ``.eeg`` file.
+
+    Parameters
+    ----------
+    filename : str
+        the name of the ``.eeg`` file
+
+    Returns
+    -------
+    header : dict or None
+        a dictionary with the keys ``version``, ``dtype``, ``channels``,
+        ``fs``, ``samples`` and ``first_sample`` or None if the file has no header (i.e.
+        it was written by an older version of mushu)
+
+    """
+    size = struct.calcsize(HEADER_FORMAT)
+    with open(filename, 'rb') as fh:
+        buf = fh.read(size)
+    if len(buf) < size or not buf.startswith(MAGIC):
+        return None
+    magic, version, dtype, channels, fs, samples, first_sample = struct.unpack(HEADER_FORMAT, buf)
+    dtype = dtype.rstrip(b'\0')
+    return {'version': version,
+            'dtype': np.dtype(dtype.decode()) if dtype else None,
+            'channels': channels,
+            'fs': fs,
+            'samples': samples,
+            'first_sample': first_sample,
+            }
+
+
+def checkpoint_locked(filename):
+    """Return True if a writer holds the lock of a ``.checkpoint``
+    file, i.e. the recording is still being written.
+
+    Returns None where ``fcntl`` is not available.
+
+    """
+    if fcntl is None:
+        return None
+    with open(filename, 'rb') as fh:
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except (BlockingIOError, PermissionError):
+            return True
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    return False
+
+
+def read_checkpoint(filename):
+    """Read a ``.checkpoint`` file.
+
+    Parameters
+    ----------
+    filename : str
+        the name of the checkpoint file
+
+    Returns
+    -------
+    checkpoint : dict or None
+        a dictionary with the keys ``segment``, ``samples``,
+        ``segment_samples``, ``eeg_position``, ``allocated``,
+        ``marker_offset``, ``markers`` and ``time`` or None if the file
+        does not exist or is invalid
+
+    """
+    size = struct.calcsize(CHECKPOINT_FORMAT)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as fh:
+        buf = fh.read(size)
+    if len(buf) < size or not buf.startswith(CHECKPOINT_MAGIC):
+        return None
+    values = struct.unpack(CHECKPOINT_FORMAT, buf)
+    keys = ('segment', 'samples', 'segment_samples', 'eeg_position',
+            'allocated', 'marker_offset', 'markers', 'time')
+    return dict(zip(keys, values[2:]))
+
+
+class RecordingWriter(object):
+    """Write the data and markers of a recording to disk.
+
+    The data blocks are written straight from the buffer of the numpy
+    array, no intermediate Python objects are created. The data type of
+    the first non-empty block is used for the whole recording and stored
+    in the header of the ``.eeg`` file and in the meta file.
+
+    The markers are kept in memory and written to the ``.markeridx``
+    sidecar when the writer is closed.
+
+    The ``.eeg`` file is grown in large extents (``posix_fallocate``,
+    where available) to avoid fragmentation; the unused rest of the last
+    extent is truncated and the final number of samples is written into
+    the header when the writer is closed.
+
+    Long recordings can be split into segments of a maximum duration or
+    size. The segments are written to ``<filename>.0000.eeg``,
+    ``<filename>.0001.eeg``, etc. instead of ``<filename>.eeg``, each
+    with its own header containing the index of its first sample. All
+    segments except the last one have exactly the same number of
+    samples. The markers and the sample counter are shared by all
+    segments and ``<filename>.manifest`` lists the segments, so the
+    segments can be read as one recording (see :mod:`libmushu.io`) or
+    processed in parallel.
+
+    Parameters
+    ----------
+    filename : str
+        the base name of the files, the extensions ``.eeg``, ``.marker``
+        and ``.meta`` are added automatically
+    channels : list of strings
+        the channel names
+    fs : float
+        the sampling frequency
+    amp : str, optional
+        a description of the amplifier
+    fsync : None, 'always', 'close' or float, optional
+        when to force the written data to disk via ``os.fsync``: never
+        (None), after every block ('always'), when closing ('close') or
+        at most every ``fsync`` seconds
+    preallocate : int, optional
+        the size of the extents in bytes, 0 disables the preallocation
+    segment_seconds : float, optional
+        start a new segment after this many seconds of data
+    segment_bytes : int, optional
+        start a new segment before a segment file exceeds this size
+    checkpoint_interval : float, optional
+        write a checkpoint at most every ``checkpoint_interval``
+        seconds, None writes checkpoints only when a new segment or
+        extent is started. Without preallocation a crashed recording
+        can be recovered up to its last complete sample, with
+        preallocation only up to the last checkpoint. While the writer
+        is open it holds a lock on the checkpoint file (where ``fcntl``
+        is available), so :func:`libmushu.io.recover` does not touch a
+        recording that is still being written.
+
+    Raises
+    ------
+    IOError :
+        if one of the files already exists
+
+    """
+
+    def __init__(self, filename, channels, fs, amp='', fsync=None, preallocate=PREALLOCATE,
+                 segment_seconds=None, segment_bytes=None, checkpoint_interval=CHECKPOINT_INTERVAL):
+        if fsync not in (None, 'always', 'close') and not isinstance(fsync, (int, float)):
+            raise ValueError('Unknown fsync policy: %s' % fsync)
+        self.filename = filename
+        self.channels = channels
+        self.fs = fs
+        self.amp = amp
+        self.fsync = fsync
+        self.dtype = None
+        self.samples = 0
+        self.bytes_written = 0
+        self.max_stall = 0
+        self.last_sync = now_ns()
+        self.preallocate = preallocate if hasattr(os, 'posix_fallocate') else 0
+        self.markers = []
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.segmented = segment_seconds is not None or segment_bytes is not None
+        # the segments written so far, the last one is the current one
+        self.segments = []
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = now_ns()
+        self.extra_meta = {}
+        filename_marker = filename + '.marker'
+        filename_meta = filename + '.meta'
+        for fname in (self.segment_filename(0), filename_marker, filename_meta,
+                      filename + '.markeridx', filename + '.manifest',
+                      filename + '.checkpoint'):
+            if os.path.exists(fname):
+                logger.error('A file "%s" already exists, aborting.' % fname)
+                raise IOError('File "%s" already exists.' % fname)
+        self.fh_marker = open(filename_marker, 'w')
+        self.fh_meta = open(filename_meta, 'w')
+        self.fh_checkpoint = open(filename + '.checkpoint', 'wb')
+        if fcntl is not None:
+            fcntl.flock(self.fh_checkpoint.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.open_segment()
+        self.write_meta()
+
+    def segment_filename(self, i):
+        """Return the name of the ``.eeg`` file of the i-th segment."""
+        if not self.segmented:
+            return self.filename + '.eeg'
+        return '%s.%04d.eeg' % (self.filename, i)
+
+    def open_segment(self):
+        """Close the current segment (if any) and start a new one."""
+        if self.segments:
+            self.close_segment()
+        fname = self.segment_filename(len(self.segments))
+        if os.path.exists(fname):
+            logger.error('A file "%s" already exists, aborting.' % fname)
+            raise IOError('File "%s" already exists.' % fname)
+        self.segments.append({'File': os.path.basename(fname),
+                              'First Sample': self.samples,
+                              'Samples': 0,
+                              })
+        self.fh_eeg = open(fname, 'wb')
+        self.allocated = 0
+        self.write_header()
+        if self.segmented:
+            self.write_manifest()
+        self.checkpoint()
+
+    def close_segment(self):
+        """Truncate, finalize and close the current segment."""
+        segment = self.segments[-1]
+        self.fh_eeg.truncate(HEADER_SIZE + segment['Samples'] * self.rowsize)
+        self.write_header()
+        if self.fsync is not None:
+            self.fh_eeg.flush()
+            os.fsync(self.fh_eeg.fileno())
+        self.fh_eeg.close()
+
+    @property
+    def rowsize(self):
+        """The size of one sample row in bytes (0 if unknown yet)."""
+        if self.dtype is None:
+            return 0
+        return self.dtype.itemsize * len(self.channels)
+
+    @property
+    def segment_capacity(self):
+        """The maximum number of samples per segment or None."""
+        limits = []
+        if self.segment_seconds is not None:
+            limits.append(int(self.segment_seconds * self.fs))
+        if self.segment_bytes is not None and self.rowsize > 0:
+            limits.append((self.segment_bytes - HEADER_SIZE) // self.rowsize)
+        if not limits:
+            return None
+        return max(1, min(limits))
+
+    def write_header(self):
+        """(Re-)write the header of the current ``.eeg`` file."""
+        segment = self.segments[-1]
+        pos = self.fh_eeg.tell()
+        self.fh_eeg.seek(0)
+        self.fh_eeg.write(pack_header(self.dtype, len(self.channels), self.fs,
+                                      segment['Samples'], segment['First Sample']))
+        if pos > 0:
+            self.fh_eeg.seek(pos)
+
+    def write_meta(self):
+        """(Re-)write the meta file.
+
+        The meta file is rewritten once the data type is known and when
+        the writer is closed, to store the final number of samples.
+
+        """
+        meta = {'Channels': self.channels,
+                'Sampling Frequency': self.fs,
+                'Amp': self.amp,
+                'Data Type': None if self.dtype is None else self.dtype.str,
+                'Samples': self.samples,
+                }
+        meta.update(self.extra_meta)
+        self.fh_meta.seek(0)
+        self.fh_meta.truncate()
+        json.dump(meta, self.fh_meta, indent=4)
+        self.fh_meta.flush()
+
+    def update_meta(self, meta):
+        """Add entries to the meta file.
+
+        The entries are written the next time the meta file is
+        rewritten, at the latest when the writer is closed.
+
+        Parameters
+        ----------
+        meta : dict
+
+        """
+        self.extra_meta.update(meta)
+
+    def write_manifest(self):
+        """(Re-)write the manifest listing the segments."""
+        manifest = {'Segments': self.segments,
+                    'Samples': self.samples,
+                    }
+        with open(self.filename + '.manifest', 'w') as fh:
+            json.dump(manifest, fh, indent=4)
+
+    def write(self, data, markers):
+        """Write a block of data and markers.
+
+        Parameters
+        ----------
+        data : 2darray
+            a numpy array (time, channels)
+        markers : list of (float, str)
+            the markers, the timestamps are in ms relative to the start
+            of the recording
+
+        """
+        t = now_ns()
+        for m in markers:
+            self.fh_marker.write("%f %s\n" % (m[0], m[1]))
+        self.markers.extend(markers)
+        if len(data) > 0:
+            if self.dtype is None:
+                self.dtype = data.dtype
+                self.write_header()
+                self.write_meta()
+            elif data.dtype != self.dtype:
+                data = data.astype(self.dtype)
+            capacity = self.segment_capacity
+            while len(data) > 0:
+                n = len(data)
+                if capacity is not None:
+                    n = min(n, capacity - self.segments[-1]['Samples'])
+                    if n == 0:
+                        self.open_segment()
+                        continue
+                self._write_data(data[:n])
+                data = data[n:]
+        if self.fsync == 'always':
+            self.sync()
+        elif self.fsync not in (None, 'close') and t - self.last_sync >= self.fsync * NS_PER_S:
+            self.sync()
+        if self.checkpoint_interval is not None and t - self.last_checkpoint >= self.checkpoint_interval * NS_PER_S:
+            self.checkpoint()
+        self.max_stall = max(self.max_stall, (now_ns() - t) / NS_PER_S)
+
+    def _write_data(self, data):
+        # writing the array directly uses the buffer protocol, only
+        # non-contiguous arrays (e.g. slices of the channels) are copied
+        data = np.ascontiguousarray(data)
+        segment = self.segments[-1]
+        self._allocate(HEADER_SIZE + segment['Samples'] * self.rowsize + data.nbytes)
+        self.fh_eeg.write(data)
+        segment['Samples'] += len(data)
+        self.samples += len(data)
+        self.bytes_written += data.nbytes
+
+    def _allocate(self, size):
+        # make sure the current .eeg file has at least ``size`` bytes
+        # allocated
+        if self.preallocate <= 0 or size <= self.allocated:
+            return
+        extent = max(self.preallocate, size - self.allocated)
+        capacity = self.segment_capacity
+        if capacity is not None:
+            # don't allocate beyond the end of the segment
+            extent = max(min(extent, HEADER_SIZE + capacity * self.rowsize - self.allocated),
+                         size - self.allocated)
+        try:
+            os.posix_fallocate(self.fh_eeg.fileno(), self.allocated, extent)
+        except OSError:
+            logger.warning('Unable to preallocate the .eeg file, disabling preallocation.', exc_info=True)
+            self.preallocate = 0
+            return
+        self.allocated += extent
+        # recover needs to know where the preallocated space starts, it
+        # can not tell unused space from data
+        self.checkpoint()
+
+    def sync(self):
+        """Flush the data and marker files and force them to disk."""
+        for fh in self.fh_eeg, self.fh_marker:
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.last_sync = now_ns()
+
+    def checkpoint(self):
+        """Write a checkpoint.
+
+        The data and marker files are flushed (and synced, unless the
+        fsync policy is None) before the checkpoint record is written,
+        so the record never points beyond the data on disk.
+
+        """
+        for fh in self.fh_eeg, self.fh_marker:
+            fh.flush()
+            if self.fsync is not None:
+                os.fsync(fh.fileno())
+        segment = self.segments[-1]
+        # the time of the record is the wall clock time, recover compares
+        # it from another process
+        record = struct.pack(CHECKPOINT_FORMAT, CHECKPOINT_MAGIC, VERSION,
+                             len(self.segments) - 1, self.samples,
+                             segment['Samples'], self.fh_eeg.tell(),
+                             self.allocated, self.fh_marker.tell(), len(self.markers),
+                             time.time())
+        self.fh_checkpoint.seek(0)
+        self.fh_checkpoint.write(record)
+        self.fh_checkpoint.flush()
+        if self.fsync is not None:
+            os.fsync(self.fh_checkpoint.fileno())
+        self.last_checkpoint = now_ns()
+
+    def stats(self):
+        """Return statistics about the writer.
+
+        Returns
+        -------
+        stats : dict
+            ``queue_depth`` is always 0 for the inline writer,
+            ``bytes_written`` the number of bytes of EEG data written so
+            far and ``max_stall`` the longest time in seconds a call to
+            :meth:`write` blocked the caller.
+
+        """
+        return {'queue_depth': 0,
+                'bytes_written': self.bytes_written,
+                'max_stall': self.max_stall,
+                }
+
+    def close(self):
+        """Flush and close all files."""
+        if self.fsync is not None:
+            self.sync()
+        self.close_segment()
+        if self.segmented:
+            self.write_manifest()
+        self.write_meta()
+        for fh in self.fh_marker, self.fh_meta:
+            fh.close()
+        MarkerIndex.from_markers(self.markers, self.fs).save(self.filename + '.markeridx')
+        # the recording is complete, the checkpoint is not needed anymore
+        self.fh_checkpoint.close()
+        os.remove(self.filename + '.checkpoint')
+
+
+class ThreadedWriter(object):
+    """Hand the blocks of a recording to a background writer thread.
+
+    :meth:`write` only puts the block into a bounded queue, the actual
+    writing is done by the wrapped writer in a dedicated thread. Blocks
+    that piled up in the queue are merged into one large sequential
+    write. If the queue is full, :meth:`write` blocks until the writer
+    thread catches up, the longest such stall is reported in
+    :meth:`stats`.
+
+    Note that the data arrays are written asynchronously, so the caller
+    must not modify them after passing them to :meth:`write`.
+
+    Parameters
+    ----------
+    writer : RecordingWriter or BrainVisionWriter
+        the writer doing the actual I/O
+    maxsize : int, optional
+        the maximum number of blocks in the queue
+    coalesce_bytes : int, optional
+        queued blocks are merged into one write until this size is
+        reached
+
+    """
+
+    def __init__(self, writer, maxsize=1024, coalesce_bytes=2**20):
+        self.writer = writer
+        self.coalesce_bytes = coalesce_bytes
+        self.queue = queue.Queue(maxsize)
+        self.max_stall = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='RecordingWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, data, markers):
+        """Queue a block of data and markers for writing.
+
+        See :meth:`RecordingWriter.write` for the parameters.
+
+        Raises
+        ------
+        IOError :
+            if the writer thread failed to write a previous block
+
+        """
+        if self.error is not None:
+            raise IOError('Writer thread failed: %s' % self.error)
+        t = now_ns()
+        self.queue.put((data, markers))
+        self.max_stall = max(self.max_stall, (now_ns() - t) / NS_PER_S)
+
+    def _run(self):
+        running = True
+        while running:
+            blocks = [self.queue.get()]
+            if blocks[0] is None:
+                break
+            size = blocks[0][0].nbytes
+            while size < self.coalesce_bytes:
+                try:
+                    block = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if block is None:
+                    running = False
+                    break
+                blocks.append(block)
+                size += block[0].nbytes
+            data = [b[0] for b in blocks if len(b[0]) > 0]
+            if len(data) == 0:
+                data = blocks[0][0]
+            elif len(data) == 1:
+                data = data[0]
+            else:
+                data = np.concatenate(data)
+            markers = [m for b in blocks for m in b[1]]
+            if self.error is not None:
+                continue
+            try:
+                self.writer.write(data, markers)
+            except Exception as e:
+                logger.error('Writer thread failed, discarding the remaining data.', exc_info=True)
+                self.error = e
+
+    def stats(self):
+        """Return statistics about the writer.
+
+        Returns
+        -------
+        stats : dict
+            ``queue_depth`` the number of blocks waiting to be written,
+            ``bytes_written`` the number of bytes of EEG data written so
+            far, ``max_stall`` the longest time in seconds a call to
+            :meth:`write` blocked the caller because the queue was full
+            and ``max_write`` the longest time the writer thread spent
+            writing a (merged) block.
+
+        """
+        return {'queue_depth': self.queue.qsize(),
+                'bytes_written': self.writer.bytes_written,
+                'max_stall': self.max_stall,
+                'max_write': self.writer.max_stall,
+                }
+
+    def update_meta(self, meta):
+        """Add entries to the meta data of the wrapped writer."""
+        self.writer.update_meta(meta)
+
+    def close(self):
+        """Write the remaining blocks and close the wrapped writer."""
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+
+
+class BrainVisionWriter(object):
+    """Write a recording in the BrainVision format.
+
+    The data is written as multiplexed binary data to ``<filename>.eeg``
+    while recording, the markers are appended to ``<filename>.vmrk`` and
+    ``<filename>.vhdr`` describes the recording, so no conversion step
+    is needed after the session.
+
+    int16 and int32 data is written as is (INT_16, INT_32), float32 as
+    IEEE_FLOAT_32, all other data types are converted to float32.
+
+    Parameters
+    ----------
+    filename : str
+        the base name of the files, the extensions ``.eeg``, ``.vhdr``
+        and ``.vmrk`` are added automatically
+    channels : list of strings
+        the channel names
+    fs : float
+        the sampling frequency
+    amp : str, optional
+        a description of the amplifier
+    fsync : None, 'always', 'close' or float, optional
+        the fsync policy, see :class:`RecordingWriter`
+    resolutions : float or list of floats, optional
+        the resolution of each channel in µV, i.e. the value a sample
+        of 1 corresponds to
+    unit : str, optional
+        the unit of the resolutions
+
+    Raises
+    ------
+    IOError :
+        if one of the files already exists
+
+    """
+
+    BINARY_FORMATS = {'<i2': 'INT_16', '<i4': 'INT_32', '<f4': 'IEEE_FLOAT_32'}
+
+    def __init__(self, filename, channels, fs, amp='', fsync=None, resolutions=1.0, unit='\u00b5V'):
+        if fsync not in (None, 'always', 'close') and not isinstance(fsync, (int, float)):
+            raise ValueError('Unknown fsync policy: %s' % fsync)
+        if isinstance(resolutions, (int, float)):
+            resolutions = [resolutions for c in channels]
+        if len(resolutions) != len(channels):
+            raise ValueError('Number of resolutions does not match the number of channels.')
+        self.filename = filename
+        self.channels = channels
+        self.fs = fs
+        self.amp = amp
+        self.fsync = fsync
+        self.resolutions = resolutions
+        self.unit = unit
+        self.dtype = None
+        self.samples = 0
+        self.n_markers = 0
+        self.extra_meta = {}
+        self.bytes_written = 0
+        self.max_stall = 0
+        self.last_sync = now_ns()
+        for ext in '.eeg', '.vhdr', '.vmrk':
+            if os.path.exists(filename + ext):
+                logger.error('A file "%s" already exists, aborting.' % (filename + ext))
+                raise IOError('File "%s" already exists.' % (filename + ext))
+        self.fh_eeg = open(filename + '.eeg', 'wb')
+        self.fh_marker = open(filename + '.vmrk', 'w', encoding='utf-8')
+        self.fh_marker.write('Brain Vision Data Exchange Marker File, Version 1.0\n\n'
+                             '[Common Infos]\n'
+                             'Codepage=UTF-8\n'
+                             'DataFile=%s.eeg\n\n'
+                             '[Marker Infos]\n'
+                             '; Each entry: Mk<Marker number>=<Type>,<Description>,<Position in data points>,\n'
+                             '; <Size in data points>, <Channel number (0 = marker is related to all channels)>\n'
+                             % os.path.basename(filename))
+        self.write_vmrk('New Segment', '', 1, time.strftime('%Y%m%d%H%M%S000000'))
+        self.write_vhdr()
+
+    def write_vhdr(self):
+        """(Re-)write the header file.
+
+        The header is rewritten once the data type is known.
+
+        """
+        name = os.path.basename(self.filename)
+        binary_format = self.BINARY_FORMATS.get(self.dtype.str if self.dtype is not None else '<f4')
+        lines = ['Brain Vision Data Exchange Header File Version 1.0',
+                 '; Data written by mushu, amplifier: %s' % self.amp,
+                 '',
+                 '[Common Infos]',
+                 'Codepage=UTF-8',
+                 'DataFile=%s.eeg' % name,
+                 'MarkerFile=%s.vmrk' % name,
+                 'DataFormat=BINARY',
+                 '; Data orientation: MULTIPLEXED=ch1,pt1, ch2,pt1 ...',
+                 'DataOrientation=MULTIPLEXED',
+                 'NumberOfChannels=%d' % len(self.channels),
+                 '; Sampling interval in microseconds',
+                 'SamplingInterval=%s' % repr(1e6 / self.fs),
+                 '',
+                 '[Binary Infos]',
+                 'BinaryFormat=%s' % binary_format,
+                 '',
+                 '[Channel Infos]',
+                 '; Each entry: Ch<Channel number>=<Name>,<Reference channel name>,',
+                 '; <Resolution in "Unit">,<Unit>',
+                 ]
+        for i, (name, res) in enumerate(zip(self.channels, self.resolutions)):
+            lines.append('Ch%d=%s,,%s,%s' % (i + 1, _escape(name), repr(res), self.unit))
+        if self.extra_meta:
+            lines += ['', '[Comment]']
+            lines += ['%s: %s' % (key, json.dumps(value)) for key, value in sorted(self.extra_meta.items())]
+        with open(self.filename + '.vhdr', 'w', encoding='utf-8') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+    def write_vmrk(self, mtype, description, position, date=None):
+        """Append a marker to the marker file.
+
+        Parameters
+        ----------
+        mtype : str
+            the marker type, e.g. 'Stimulus'
+        description : str
+            the description, i.e. the marker label
+        position : int
+            the 1-based sample index of the marker
+        date : str, optional
+            the date, only used for 'New Segment' markers
+
+        """
+        self.n_markers += 1
+        line = 'Mk%d=%s,%s,%d,1,0' % (self.n_markers, mtype, _escape(description), position)
+        if date is not None:
+            line += ',' + date
+        self.fh_marker.write(line + '\n')
+
+    def write(self, data, markers):
+        """Write a block of data and markers.
+
+        See :meth:`RecordingWriter.write` for the parameters.
+
+        """
+        t = now_ns()
+        for m in markers:
+            position = max(1, int(round(m[0] * self.fs / 1000)) + 1)
+            self.write_vmrk('Stimulus', str(m[1]), position)
+        if len(data) > 0:
+            if self.dtype is None:
+                self.dtype = data.dtype if data.dtype.str in self.BINARY_FORMATS else np.dtype('<f4')
+                self.write_vhdr()
+            data = np.ascontiguousarray(data, dtype=self.dtype)
+            self.fh_eeg.write(data)
+            self.samples += len(data)
+            self.bytes_written += data.nbytes
+        if self.fsync == 'always':
+            self.sync()
+        elif self.fsync not in (None, 'close') and t - self.last_sync >= self.fsync * NS_PER_S:
+            self.sync()
+        self.max_stall = max(self.max_stall, (now_ns() - t) / NS_PER_S)
+
+    def sync(self):
+        """Flush the data and marker files and force them to disk."""
+        for fh in self.fh_eeg, self.fh_marker:
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.last_sync = now_ns()
+
+    def stats(self):
+        """Return statistics about the writer, see
+        :meth:`RecordingWriter.stats`.
+
+        """
+        return {'queue_depth': 0,
+                'bytes_written': self.bytes_written,
+                'max_stall': self.max_stall,
+                }
+
+    def update_meta(self, meta):
+        """Add entries to the ``[Comment]`` section of the header file,
+        see :meth:`RecordingWriter.update_meta`.
+
+        """
+        self.extra_meta.update(meta)
+
+    def close(self):
+        """Flush and close all files."""
+        if self.fsync is not None:
+            self.sync()
+        self.fh_eeg.close()
+        self.fh_marker.close()
+        if self.extra_meta:
+            self.write_vhdr()
+
+
+FILEFORMATS = {'mushu': RecordingWriter,
+               'brainvision': BrainVisionWriter,
+               }
+
+
+def get_writer(writer, filename, channels, fs, amp='', fileformat='mushu', **kwargs):
+    """Create a writer for a recording.
+
+    Parameters
+    ----------
+    writer : str
+        'inline' to write in the calling thread or 'thread' to write in
+        a background thread
+    filename, channels, fs, amp :
+        see :class:`RecordingWriter`
+    fileformat : str, optional
+        'mushu' for the native format (:class:`RecordingWriter`) or
+        'brainvision' (:class:`BrainVisionWriter`)
+    kwargs :
+        further options for the writers, ``maxsize`` and
+        ``coalesce_bytes`` are passed to the :class:`ThreadedWriter`,
+        the rest to the writer of the file format
+
+    Returns
+    -------
+    writer : RecordingWriter, BrainVisionWriter or ThreadedWriter
+
+    """
+    if fileformat not in FILEFORMATS:
+        raise ValueError('Unknown file format: %s' % fileformat)
+    cls = FILEFORMATS[fileformat]
+    if writer == 'inline':
+        return cls(filename, channels, fs, amp, **kwargs)
+    elif writer == 'thread':
+        options = {}
+        for key in 'maxsize', 'coalesce_bytes':
+            if key in kwargs:
+                options[key] = kwargs.pop(key)
+        return ThreadedWriter(cls(filename, channels, fs, amp, **kwargs), **options)
+    raise ValueError('Unknown writer: %s' % writer)
+
+
+def _escape(s):
+    # commas separate the fields in BrainVision files
+    return s.replace(',', '\\1')
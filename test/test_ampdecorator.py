@@ -0,0 +1,315 @@
+from __future__ import division
+
+import os
+import json
+import time
+import asyncio
+import shutil
+import socket
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from libmushu.ampdecorator import AmpDecorator
+from libmushu.driver.randomamp import RandomAmp
+from libmushu.driver.replayamp import ReplayAmp
+from libmushu.markerserver import PORT
+from libmushu.io import Recording
+
+
+class TestMarkerBuffer(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.amp = AmpDecorator(RandomAmp)
+        self.amp.configure(fs=100, channels=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def send(self, labels):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for label in labels:
+            s.sendto(label.encode(), ('127.0.0.1', PORT))
+        s.close()
+        time.sleep(.05)
+
+    def test_overflow(self):
+        """Markers that do not fit into the buffer are dropped and
+        counted."""
+        filename = os.path.join(self.tmpdir, 'rec')
+        self.amp.start(filename, marker_server='thread',
+                       marker_buffer_options={'capacity': 4, 'overflow': 'drop-oldest'})
+        try:
+            self.send([str(i) for i in range(10)])
+            data, markers = self.amp.get_data()
+            stats = self.amp.marker_stats()
+        finally:
+            self.amp.stop()
+        self.assertEqual([m[1] for m in markers], ['7', '8', '9'])
+        self.assertEqual((stats['received'], stats['dropped']), (10, 7))
+        with open(filename + '.meta') as fh:
+            meta = json.load(fh)
+        self.assertEqual(meta['Marker Statistics'], stats)
+
+    def test_late(self):
+        """Markers arriving after their block was returned are late."""
+        self.amp.start(marker_server='thread')
+        try:
+            self.amp.get_data()
+            self.send(['early'])
+            # skip the next 100ms of samples, so the next block starts
+            # after the marker was received
+            self.amp.amp.samples_sent += 10
+            self.amp.get_data()
+            stats = self.amp.marker_stats()
+        finally:
+            self.amp.stop()
+        self.assertEqual(stats['late'], 1)
+
+
+class TestBackground(TestCase):
+
+    def setUp(self):
+        self.amp = AmpDecorator(RandomAmp)
+        self.amp.configure(fs=1000, channels=2)
+
+    def test_slow_consumer(self):
+        """A slow caller gets all samples acquired since its last
+        call."""
+        self.amp.start(marker_server='thread', background=True)
+        try:
+            self.amp.get_data()
+            time.sleep(.1)
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.sendto(b'foo', ('127.0.0.1', PORT))
+            s.close()
+            time.sleep(.1)
+            data, markers = self.amp.get_data()
+        finally:
+            self.amp.stop()
+        self.assertGreater(len(data), 150)
+        # the marker is in the middle of the returned data
+        self.assertEqual([m[1] for m in markers], ['foo'])
+        self.assertLess(abs(markers[0][0] - len(data) / 2), 20)
+
+    def test_overrun(self):
+        self.amp.start(marker_server='thread', background=True, buffer_seconds=.05)
+        try:
+            time.sleep(.2)
+            data, markers = self.amp.get_data()
+        finally:
+            self.amp.stop()
+        self.assertEqual(len(data), 50)
+        self.assertGreater(self.amp.sample_ring.overruns, 0)
+
+    def test_get_data_into(self):
+        self.amp.start(marker_server='thread', background=True)
+        out = np.zeros((1000, 2))
+        try:
+            time.sleep(.05)
+            n, markers = self.amp.get_data_into(out)
+        finally:
+            self.amp.stop()
+        self.assertGreater(n, 40)
+        self.assertTrue(out[:n].any())
+
+    def test_timeout(self):
+        self.amp.configure(fs=1, channels=2)
+        self.amp.start(marker_server='thread', background=True)
+        try:
+            data, markers = self.amp.get_data(timeout=.01)
+        finally:
+            self.amp.stop()
+        self.assertEqual(len(data), 0)
+
+
+class TestAsync(TestCase):
+
+    def test_shared_loop(self):
+        """Several amps and the marker server share one event loop."""
+        amps = [AmpDecorator(RandomAmp) for i in range(3)]
+        for amp in amps:
+            amp.configure(fs=1000, channels=2)
+
+        async def consume(amp, blocks):
+            # the stream ends after the amp is stopped
+            stopped = False
+            async for data, markers in amp.astream():
+                blocks.append((data, markers))
+                if not stopped and sum(len(b[0]) for b in blocks) >= 200:
+                    amp.stop()
+                    stopped = True
+
+        async def main():
+            for i, amp in enumerate(amps):
+                amp.start(marker_server='loop', marker_options={'port': PORT + i}, background=True)
+            await asyncio.sleep(.01)
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.sendto(b'foo', ('127.0.0.1', PORT))
+            s.close()
+            blocks = [[] for amp in amps]
+            await asyncio.gather(*[consume(amp, b) for amp, b in zip(amps, blocks)])
+            return blocks
+
+        blocks = asyncio.run(main())
+        for b in blocks:
+            self.assertGreaterEqual(sum(len(data) for data, markers in b), 200)
+        self.assertEqual([m[1] for data, markers in blocks[0] for m in markers], ['foo'])
+
+    def test_aget_data(self):
+        amp = AmpDecorator(RandomAmp)
+        amp.configure(fs=1000, channels=2)
+
+        async def main():
+            amp.start(marker_server='loop', background=True)
+            try:
+                return await asyncio.wait_for(amp.aget_data(), 1)
+            finally:
+                amp.stop()
+
+        data, markers = asyncio.run(main())
+        self.assertGreater(len(data), 0)
+
+    def test_foreground(self):
+        """The asyncio interface needs the background acquisition."""
+        amp = AmpDecorator(RandomAmp)
+        amp.configure(fs=1000, channels=2)
+        amp.start(marker_server='thread')
+        try:
+            with self.assertRaises(RuntimeError):
+                asyncio.run(amp.aget_data())
+        finally:
+            amp.stop()
+
+
+class TestPublish(TestCase):
+
+    def test_publish(self):
+        """Subscribers get the same samples and markers as get_data."""
+        amp = AmpDecorator(RandomAmp)
+        amp.configure(fs=1000, channels=2)
+        amp.start(marker_server='thread', background=True, publish=True)
+        subscribers = [amp.broadcast.subscribe() for i in range(2)]
+        try:
+            time.sleep(.02)
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.sendto(b'foo', ('127.0.0.1', PORT))
+            s.close()
+            time.sleep(.05)
+            data, markers = amp.get_data()
+            data = data.copy()
+        finally:
+            amp.stop()
+        for subscriber in subscribers:
+            # the subscribers start with the next block published after
+            # subscribe, the acquisition may have published some before
+            first = subscriber.position
+            blocks, published = [], []
+            while not subscriber.closed:
+                block, m, start, overrun = subscriber.read()
+                published.extend([start + ms, label] for ms, label in m)
+                blocks.append(block.copy())
+            self.assertEqual(np.concatenate(blocks)[:len(data)-first].tolist(), data[first:].tolist())
+            self.assertEqual([m[1] for m in published], ['foo'])
+            self.assertAlmostEqual(published[0][0], markers[0][0])
+
+
+class TestStream(TestCase):
+
+    def setUp(self):
+        self.data = np.arange(400).reshape(200, 2)
+        self.amp = AmpDecorator(ReplayAmp)
+        # blocks of 7 samples, markers at samples 5 and 50
+        self.amp.configure(data=self.data, marker=[[5., 'a'], [50., 'b']], channels=['x', 'y'],
+                           fs=1000, realtime=False, blocksize_samples=7)
+        self.amp.start(marker_server='thread')
+
+    def tearDown(self):
+        self.amp.stop()
+
+    def collect(self, n, **kwargs):
+        windows = []
+        for data, markers in self.amp.stream(**kwargs):
+            windows.append((data.copy(), markers))
+            if len(windows) == n:
+                return windows
+
+    def test_fixed_blocks(self):
+        """The blocks of the amp are re-chunked into windows."""
+        windows = self.collect(8, block_samples=20)
+        for i, (data, markers) in enumerate(windows):
+            self.assertEqual(data.tolist(), self.data[20*i:20*i+20].tolist())
+        self.assertEqual([w[1] for w in windows[:4]], [[[5., 'a']], [], [[10., 'b']], []])
+
+    def test_overlap(self):
+        """Overlapping windows share the markers."""
+        windows = self.collect(6, block_samples=20, hop=10)
+        for i, (data, markers) in enumerate(windows):
+            self.assertEqual(data.tolist(), self.data[10*i:10*i+20].tolist())
+        self.assertEqual([w[1] for w in windows], [[[5., 'a']], [], [], [], [[10., 'b']], [[0., 'b']]])
+
+    def test_skip(self):
+        """Markers skipped by the hop are part of the next window."""
+        windows = self.collect(3, block_samples=5, hop=30)
+        self.assertEqual([w[0][0, 0] for w in windows], [0, 60, 120])
+        self.assertEqual([w[1] for w in windows], [[], [[-25., 'a']], [[-10., 'b']]])
+
+    def test_view(self):
+        """The windows are views of the internal buffer."""
+        stream = self.amp.stream(10)
+        data, markers = next(stream)
+        self.assertIsNotNone(data.base)
+        self.assertEqual(next(stream)[0].base.base, data.base.base)
+
+    def test_slow_consumer(self):
+        """A consumer stalling longer than the slack loses no data."""
+        self.amp.stop()
+        data = np.arange(2000).reshape(1000, 2)
+        self.amp.configure(data=data, marker=[], channels=['x', 'y'], fs=100, realtime=True,
+                           blocksize_samples=10)
+        self.amp.start(marker_server='thread')
+        stream = self.amp.stream(10)
+        windows = [next(stream)[0].copy()]
+        time.sleep(2.5)
+        for i in range(30):
+            windows.append(next(stream)[0].copy())
+        self.assertEqual(np.concatenate(windows).tolist(), data[:310].tolist())
+
+    def test_late_start(self):
+        """Streaming starts long after the amp without losing data."""
+        self.amp.stop()
+        data = np.arange(2000).reshape(1000, 2)
+        self.amp.configure(data=data, marker=[], channels=['x', 'y'], fs=100, realtime=True,
+                           blocksize_samples=10)
+        self.amp.start(marker_server='thread')
+        time.sleep(2.5)
+        stream = self.amp.stream(10)
+        windows = [next(stream)[0].copy() for i in range(30)]
+        self.assertEqual(np.concatenate(windows).tolist(), data[:300].tolist())
+
+
+class TestThreadedWriter(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_data_into(self):
+        """Blocks read into a reused buffer are recorded unchanged."""
+        data = np.arange(400, dtype=np.float64).reshape(200, 2)
+        amp = AmpDecorator(ReplayAmp)
+        amp.configure(data=data, marker=[], channels=['x', 'y'], fs=1000, realtime=False, blocksize_samples=7)
+        filename = os.path.join(self.tmpdir, 'rec')
+        amp.start(filename, writer='thread', marker_server='thread')
+        out = np.empty((10, 2))
+        try:
+            for i in range(20):
+                amp.get_data_into(out)
+        finally:
+            amp.stop()
+        rec = Recording(filename)
+        np.testing.assert_array_equal(rec.data, data[:140])
@@ -0,0 +1,118 @@
+from __future__ import division
+
+import time
+import tracemalloc
+from unittest import TestCase
+
+import numpy as np
+
+from libmushu.amplifier import Amplifier
+from libmushu.ampdecorator import AmpDecorator
+from libmushu.driver.randomamp import RandomAmp
+from libmushu.driver.sinusamp import SinusAmp
+from libmushu.driver.replayamp import ReplayAmp
+
+
+class BlockAmp(Amplifier):
+    """An amp that only implements get_data."""
+
+    def get_data(self):
+        return np.arange(6).reshape(3, 2), [[1., 'foo']]
+
+
+def allocated(f, n=20, wait=.01):
+    """Return the peak of memory allocated by calling f n times, after
+    warming up."""
+    for i in range(5):
+        f()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        for i in range(n):
+            time.sleep(wait)
+            f()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+class TestGetDataInto(TestCase):
+
+    def test_generic(self):
+        """The generic implementation copies the result of get_data."""
+        out = np.zeros((10, 2))
+        n, markers = BlockAmp().get_data_into(out)
+        self.assertEqual(n, 3)
+        self.assertEqual(out[:n].tolist(), np.arange(6).reshape(3, 2).tolist())
+        self.assertEqual(markers, [[1., 'foo']])
+        with self.assertRaises(ValueError):
+            BlockAmp().get_data_into(np.zeros((2, 2)))
+
+    def test_sinusamp(self):
+        """The native implementation returns the same data."""
+        amp = SinusAmp()
+        amp.configure(f=3, fs=100, channels=4)
+        amp.start()
+        out = np.zeros((100, 4))
+        n = 0
+        while n < 20:
+            k, markers = amp.get_data_into(out[n:])
+            n += k
+        amp.start()
+        data = []
+        while sum(len(d) for d in data) < n:
+            data.append(amp.get_data()[0])
+        np.testing.assert_allclose(out[:n], np.concatenate(data)[:n], atol=1e-9)
+
+    def test_randomamp(self):
+        amp = RandomAmp()
+        amp.configure(fs=1000, channels=4)
+        amp.start()
+        out = np.zeros((1000, 4), dtype=np.int64)
+        time.sleep(.01)
+        n, markers = amp.get_data_into(out)
+        self.assertGreater(n, 5)
+        self.assertTrue(((out[:n] >= 0) & (out[:n] < 1024)).all())
+        self.assertEqual(amp.samples_sent, n)
+
+    def test_replayamp(self):
+        data = np.arange(200).reshape(100, 2)
+        amp = ReplayAmp()
+        amp.configure(data=data, marker=[[25., 'b'], [5., 'a']], channels=['a', 'b'], fs=1000,
+                      realtime=False, blocksize_samples=10)
+        amp.start()
+        out = np.zeros((10, 2), dtype=data.dtype)
+        result = []
+        for i in range(3):
+            n, markers = amp.get_data_into(out)
+            result.append((out[:n].copy(), markers))
+        self.assertEqual(np.concatenate([r[0] for r in result]).tolist(), data[:30].tolist())
+        self.assertEqual([r[1] for r in result], [[[5., 'a']], [], [[5., 'b']]])
+
+    def check_no_allocation(self, amp, channels):
+        out = np.zeros((1000, channels))
+        f = lambda: amp.get_data_into(out)
+        # a block has about 10 samples
+        block = out[:5].nbytes
+        # the allocating path is detected
+        self.assertGreater(allocated(amp.get_data), block)
+        self.assertLess(allocated(f), block / 4)
+
+    def test_no_allocation(self):
+        """Steady state acquisition does not allocate the data."""
+        for cls in RandomAmp, SinusAmp:
+            amp = cls()
+            amp.configure(**dict(amp.presets[1][1], fs=1000, channels=256))
+            amp.start()
+            self.check_no_allocation(amp, 256)
+            amp.stop()
+
+    def test_decorator_no_allocation(self):
+        for background in False, True:
+            amp = AmpDecorator(RandomAmp)
+            amp.configure(fs=1000, channels=256)
+            amp.start(marker_server='thread', background=background)
+            try:
+                self.check_no_allocation(amp, 256)
+            finally:
+                amp.stop()
@@ -0,0 +1,47 @@
+from __future__ import division
+
+import time
+from fractions import Fraction
+from unittest import TestCase
+
+from libmushu.clock import now_ns, wall_clock_mapping, realtime_to_ns, samples_to_ns, ns_to_samples, NS_PER_S
+
+
+class TestClock(TestCase):
+
+    def test_now_ns(self):
+        """The clock returns increasing integers."""
+        t0 = now_ns()
+        t1 = now_ns()
+        self.assertIsInstance(t0, int)
+        self.assertLessEqual(t0, t1)
+
+    def test_samples_to_ns(self):
+        self.assertEqual(samples_to_ns(1000, 1000), NS_PER_S)
+        self.assertEqual(samples_to_ns(1, 3), 333333333)
+        self.assertEqual(samples_to_ns(2, 3), 666666667)
+        self.assertEqual(samples_to_ns(3, 3), NS_PER_S)
+        self.assertEqual(samples_to_ns(10, 2.5), 4 * NS_PER_S)
+
+    def test_no_accumulated_error(self):
+        """Long sessions are converted exactly."""
+        fs = 512
+        samples = fs * 3600 * 24
+        self.assertEqual(samples_to_ns(samples, fs), 3600 * 24 * NS_PER_S)
+        self.assertEqual(ns_to_samples(3600 * 24 * NS_PER_S, fs), samples)
+        self.assertEqual(ns_to_samples(samples_to_ns(samples, Fraction(1000, 3)), Fraction(1000, 3)), samples)
+
+    def test_ns_to_samples(self):
+        """Only complete samples are counted."""
+        self.assertEqual(ns_to_samples(NS_PER_S - 1, 1000), 999)
+        self.assertEqual(ns_to_samples(NS_PER_S, 1000), 1000)
+        self.assertEqual(ns_to_samples(0, 1000), 0)
+
+    def test_wall_clock_mapping(self):
+        monotonic, wall = wall_clock_mapping()
+        self.assertLess(abs(monotonic - now_ns()), NS_PER_S)
+        self.assertLess(abs(wall - time.time_ns()), NS_PER_S)
+
+    def test_realtime_to_ns(self):
+        t = now_ns()
+        self.assertLess(abs(realtime_to_ns(time.time_ns()) - t), NS_PER_S // 100)
@@ -0,0 +1,62 @@
+from __future__ import division
+
+from unittest import TestCase
+
+import numpy as np
+
+from libmushu.clocksync import ClockSync, format_message, parse_message, SYNC, TIMESTAMPED
+
+
+class TestClockSync(TestCase):
+
+    def exchange(self, sync, t, offset, drift, d1, d2):
+        # the client time t corresponds to the server time
+        # t + offset + drift * t
+        server = lambda t: t + offset + drift * t
+        t1 = t
+        t2 = server(t1 + d1)
+        t3 = t2 + .0001
+        t4 = t1 + d1 + .0001 / (1 + drift) + d2
+        sync.add(t1, t2, t3, t4)
+
+    def test_not_synced(self):
+        sync = ClockSync()
+        self.assertFalse(sync.synced)
+        self.assertIsNone(sync.to_server(1.))
+
+    def test_offset(self):
+        """A constant offset is estimated from symmetric exchanges."""
+        sync = ClockSync()
+        self.exchange(sync, 10, 1000, 0, .001, .001)
+        self.assertTrue(sync.synced)
+        self.assertAlmostEqual(sync.to_server(20), 1020, places=6)
+
+    def test_drift(self):
+        """Offset and drift are estimated, slow exchanges are ignored."""
+        sync = ClockSync()
+        rng = np.random.RandomState(0)
+        for t in range(0, 60):
+            d1, d2 = .001, .001
+            if t % 3 == 0:
+                # an asymmetric exchange with a large delay
+                d1 = .05
+            self.exchange(sync, t, 5, 1e-4, d1 + rng.uniform(0, 1e-5), d2)
+        self.assertAlmostEqual(sync.drift, 1e-4, places=6)
+        self.assertAlmostEqual(sync.to_server(100), 100 + 5 + 1e-2, places=4)
+
+    def test_negative_delay(self):
+        """Impossible exchanges are ignored."""
+        sync = ClockSync()
+        sync.add(0, 10, 10, -1)
+        self.assertFalse(sync.synced)
+
+
+class TestMessages(TestCase):
+
+    def test_roundtrip(self):
+        message = format_message(SYNC, 'client', 1.25, 2.5)
+        self.assertEqual(parse_message(message), (SYNC, 'client', ['1.25', '2.5']))
+
+    def test_label_with_spaces(self):
+        message = format_message(TIMESTAMPED, 'client', 1.5, 'foo bar')
+        self.assertEqual(parse_message(message), (TIMESTAMPED, 'client', ['1.5', 'foo bar']))
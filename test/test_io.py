@@ -0,0 +1,230 @@
+from __future__ import division
+
+import os
+import json
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+from multiprocessing import Process
+
+import numpy as np
+
+from libmushu.writer import RecordingWriter
+from libmushu.io import Recording, rebuild_marker_index, recover
+
+
+class TestRecording(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+        self.data = np.arange(3000, dtype=np.float32).reshape(-1, 3)
+        writer = RecordingWriter(self.filename, ['a', 'b', 'c'], 100)
+        writer.write(self.data[:500], [[-5, 'early'], [10, 'foo'], [4990, 'bar']])
+        writer.write(self.data[500:], [[5000, 'baz'], [9995, 'late label']])
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_open(self):
+        rec = Recording(self.filename)
+        self.assertEqual(len(rec), 1000)
+        self.assertEqual(rec.fs, 100)
+        self.assertEqual(rec.channels, ['a', 'b', 'c'])
+        self.assertIsInstance(rec.data, np.memmap)
+        np.testing.assert_array_equal(rec.data, self.data)
+
+    def test_window(self):
+        """window returns the data and markers relative to its onset."""
+        rec = Recording(self.filename)
+        data, markers = rec.window(4985, 5010)
+        np.testing.assert_array_equal(data, self.data[499:501])
+        self.assertEqual(markers, [[0.0, 'bar'], [10.0, 'baz']])
+
+    def test_chunks(self):
+        """chunks cover the whole recording and all markers."""
+        rec = Recording(self.filename)
+        chunks = list(rec.chunks(300))
+        self.assertEqual([len(d) for d, m in chunks], [300, 300, 300, 100])
+        np.testing.assert_array_equal(np.concatenate([d for d, m in chunks]), self.data)
+        markers = [m for d, ms in chunks for m in ms]
+        self.assertEqual([m[1] for m in markers], ['early', 'foo', 'bar', 'baz', 'late label'])
+        self.assertEqual(chunks[1][1], [[1990.0, 'bar'], [2000.0, 'baz']])
+
+    def test_legacy_recording(self):
+        """headerless float32 recordings can be read."""
+        filename = os.path.join(self.tmpdir, 'old')
+        self.data.tofile(filename + '.eeg')
+        with open(filename + '.meta', 'w') as fh:
+            json.dump({'Channels': ['a', 'b', 'c'], 'Sampling Frequency': 100, 'Amp': ''}, fh)
+        rec = Recording(filename)
+        np.testing.assert_array_equal(rec.data, self.data)
+
+    def test_find_markers(self):
+        rec = Recording(self.filename)
+        np.testing.assert_array_equal(rec.find_markers('baz'), [5000])
+
+    def test_rebuild_marker_index(self):
+        """Recordings without a sidecar use the .marker text file."""
+        os.remove(self.filename + '.markeridx')
+        rec = Recording(self.filename)
+        self.assertEqual(rec.get_markers(1, 5001), [[10.0, 'foo'], [4990.0, 'bar'], [5000.0, 'baz']])
+        rebuild_marker_index(self.filename)
+        self.assertTrue(os.path.exists(self.filename + '.markeridx'))
+
+
+class TestSegmentedRecording(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+        self.data = np.arange(3000, dtype=np.float32).reshape(-1, 3)
+        writer = RecordingWriter(self.filename, ['a', 'b', 'c'], 100, segment_seconds=3)
+        for i in range(0, len(self.data), 40):
+            writer.write(self.data[i:i+40], [[i * 10, 'm%d' % i]])
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_one_logical_recording(self):
+        rec = Recording(self.filename)
+        self.assertEqual(len(rec.segments), 4)
+        self.assertEqual(len(rec), 1000)
+        np.testing.assert_array_equal(rec.data[290:310], self.data[290:310])
+        np.testing.assert_array_equal(rec.data[310], self.data[310])
+        np.testing.assert_array_equal(rec.data[:, 1], self.data[:, 1])
+        data, markers = rec.window(2900, 3300)
+        np.testing.assert_array_equal(data, self.data[290:330])
+        self.assertEqual(markers, [[300.0, 'm320']])
+
+    def test_segment(self):
+        """Segments can be processed independently."""
+        rec = Recording(self.filename)
+        data, markers = rec.segment(1)
+        np.testing.assert_array_equal(data, self.data[300:600])
+        self.assertEqual(markers[0], [200.0, 'm320'])
+
+
+def die(writer):
+    # release the files of a writer like a crashed process would
+    for fh in writer.fh_eeg, writer.fh_marker, writer.fh_meta, writer.fh_checkpoint:
+        fh.close()
+
+
+def record_and_crash(filename, data):
+    writer = RecordingWriter(filename, ['a', 'b', 'c'], 100)
+    for i in range(10):
+        writer.write(data[i*100:(i+1)*100], [[i * 1000, str(i)]])
+        time.sleep(.15)
+    os._exit(1)
+
+
+class TestRecover(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+        self.data = np.arange(3000, dtype=np.float32).reshape(-1, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def crash(self, **kwargs):
+        # write a recording with a checkpoint after 400 samples, some
+        # more data and an incomplete row and marker, then "crash"
+        # without closing the writer
+        kwargs.setdefault('preallocate', 0)
+        writer = RecordingWriter(self.filename, ['a', 'b', 'c'], 100, checkpoint_interval=None, **kwargs)
+        writer.write(self.data[:400], [[10, 'foo']])
+        writer.checkpoint()
+        writer.write(self.data[400:], [[5000, 'bar']])
+        writer.fh_eeg.write(b'\1\2\3')
+        writer.fh_marker.write('6000 ba')
+        die(writer)
+
+    def test_recover(self):
+        """A crashed recording keeps the complete rows and markers
+        written after its last checkpoint."""
+        self.crash()
+        rec = Recording(self.filename, autorecover=True)
+        self.assertFalse(os.path.exists(self.filename + '.checkpoint'))
+        np.testing.assert_array_equal(rec.data, self.data)
+        self.assertEqual(rec.get_markers(0, 10000), [[10.0, 'foo'], [5000.0, 'bar']])
+        with open(self.filename + '.meta') as fh:
+            self.assertEqual(json.load(fh)['Samples'], 1000)
+
+    def test_recover_segmented(self):
+        """The last segment keeps its complete rows, segments started
+        after the last checkpoint are removed."""
+        self.crash(segment_seconds=3)
+        open(self.filename + '.0004.eeg', 'wb').close()
+        self.assertEqual(recover(self.filename), 1000)
+        rec = Recording(self.filename)
+        self.assertEqual([len(seg) for seg in rec.segments], [300, 300, 300, 100])
+        self.assertFalse(os.path.exists(self.filename + '.0004.eeg'))
+        np.testing.assert_array_equal(rec.data[:], self.data)
+
+    def test_preallocated(self):
+        """Preallocated recordings are recovered up to the last
+        checkpoint, the preallocated space is removed."""
+        self.crash(preallocate=2**16)
+        self.assertGreater(os.path.getsize(self.filename + '.eeg'), 4096 + self.data.nbytes)
+        self.assertEqual(recover(self.filename), 400)
+        np.testing.assert_array_equal(Recording(self.filename).data, self.data[:400])
+
+    def test_zeros(self):
+        """Samples of zeros are data, not preallocated space."""
+        data = np.zeros((10, 3), dtype=np.int16)
+        data[:5, :2] = 1
+        for preallocate in 0, 2**16:
+            writer = RecordingWriter(self.filename, ['a', 'b', 'c'], 100, checkpoint_interval=None,
+                                     preallocate=preallocate)
+            writer.write(data, [])
+            if preallocate:
+                writer.checkpoint()
+            die(writer)
+            self.assertEqual(recover(self.filename), 10)
+            np.testing.assert_array_equal(Recording(self.filename).data, data)
+            for ext in '.eeg', '.marker', '.meta', '.markeridx':
+                os.remove(self.filename + ext)
+
+    def test_crash_defaults(self):
+        """A recording written with the default settings survives a
+        crash of the recording process."""
+        p = Process(target=record_and_crash, args=(self.filename, self.data))
+        p.start()
+        p.join()
+        self.assertEqual(p.exitcode, 1)
+        samples = recover(self.filename)
+        rec = Recording(self.filename)
+        # everything up to the last checkpoint is there, the rest
+        # depends on what was flushed before the crash
+        self.assertGreaterEqual(samples, 600)
+        np.testing.assert_array_equal(rec.data, self.data[:samples])
+        markers = rec.get_markers(-1000, 100000)
+        self.assertGreaterEqual(len(markers), 6)
+        self.assertEqual(markers, [[i * 1000., str(i)] for i in range(len(markers))])
+
+    def test_still_written(self):
+        """Recordings that are still being written are not recovered."""
+        writer = RecordingWriter(self.filename, ['a', 'b', 'c'], 100)
+        writer.write(self.data, [[10, 'foo']])
+        with self.assertRaises(IOError):
+            recover(self.filename)
+        with self.assertRaises(IOError):
+            Recording(self.filename, autorecover=True)
+        Recording(self.filename)
+        writer.close()
+        np.testing.assert_array_equal(Recording(self.filename).data, self.data)
+
+    def test_closed_recording(self):
+        """Properly closed recordings have no checkpoint."""
+        writer = RecordingWriter(self.filename, ['a', 'b', 'c'], 100, checkpoint_interval=0)
+        writer.write(self.data, [])
+        writer.close()
+        self.assertFalse(os.path.exists(self.filename + '.checkpoint'))
+        with self.assertRaises(IOError):
+            recover(self.filename)
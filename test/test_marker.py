@@ -0,0 +1,190 @@
+from __future__ import division
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+from unittest import TestCase, skipUnless
+
+from libmushu.clock import now_ns, NS_PER_S
+from libmushu.marker import MarkerClient
+from libmushu.ringbuffer import MarkerRing
+from libmushu.markerserver import get_marker_server
+
+
+def receive(ring, n, timeout=2):
+    markers = []
+    t_end = time.time() + timeout
+    while len(markers) < n and time.time() < t_end:
+        markers.extend(ring.drain())
+        time.sleep(.001)
+    return markers
+
+
+class TestMarkerClient(TestCase):
+
+    def setUp(self):
+        self.ring = MarkerRing()
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop()
+        self.ring.close()
+
+    def start_server(self, **kwargs):
+        self.server = get_marker_server('thread', self.ring, **kwargs)
+        self.server.start()
+
+    def check_protocol(self, protocol, labels, server_options=None, **kwargs):
+        tcp_mode = 'stream' if protocol in ('stream', 'unix-stream') else 'oneshot'
+        self.start_server(tcp_mode=tcp_mode, **(server_options or {}))
+        client = MarkerClient(protocol=protocol, **kwargs)
+        for label in labels:
+            self.assertTrue(client.send(label))
+        client.close()
+        self.assertEqual(client.stats()['sent'], len(labels))
+        return receive(self.ring, len(labels))
+
+    def test_udp(self):
+        markers = self.check_protocol('udp', ['foo', 'bar'])
+        self.assertEqual([m[1] for m in markers], ['foo', 'bar'])
+
+    def test_tcp(self):
+        markers = self.check_protocol('tcp', ['foo', 'bar'])
+        self.assertEqual(sorted(m[1] for m in markers), ['bar', 'foo'])
+
+    def test_stream(self):
+        labels = [str(i) for i in range(100)]
+        markers = self.check_protocol('stream', labels)
+        self.assertEqual([m[1] for m in markers], labels)
+
+    @skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix domain sockets are not supported.')
+    def test_unix(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'markers')
+            for protocol in 'unix', 'unix-stream':
+                markers = self.check_protocol(protocol, ['foo', 'bar'], {'unix_path': path}, unix_path=path)
+                self.assertEqual([m[1] for m in markers], ['foo', 'bar'])
+                self.server.stop()
+        finally:
+            self.server = None
+            shutil.rmtree(tmpdir)
+
+    @skipUnless(sys.platform.startswith('linux'), 'Replies over Unix datagram sockets need autobind.')
+    def test_unix_timestamps(self):
+        """Clients on Unix datagram sockets synchronize their clocks."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'markers')
+            self.start_server(unix_path=path)
+            client = MarkerClient(protocol='unix', unix_path=path, timestamps=True)
+            time.sleep(.1)
+            t = now_ns()
+            client.send('foo')
+            client.close()
+            markers = receive(self.ring, 1)
+            self.assertEqual(client.stats()['reconnects'], 0)
+            self.assertLess(abs(markers[0][0] - t), .005 * NS_PER_S)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_unix_needs_path(self):
+        with self.assertRaises(ValueError):
+            MarkerClient(protocol='unix')
+
+    def test_binary(self):
+        markers = self.check_protocol('binary', list(range(100)), batch_interval=.01)
+        self.assertEqual([m[1] for m in markers], [str(i) for i in range(100)])
+        self.assertEqual(self.ring.counters()['lost'], 0)
+
+    def test_binary_needs_codes(self):
+        client = MarkerClient(protocol='binary')
+        with self.assertRaises(ValueError):
+            client.send('foo')
+        client.close()
+
+    def test_timestamps(self):
+        """Timestamped markers are placed at the time of send."""
+        self.start_server(tcp_mode='stream')
+        client = MarkerClient(protocol='stream', timestamps=True)
+        time.sleep(.1)
+        t = now_ns()
+        client.send('foo')
+        client.close()
+        markers = receive(self.ring, 1)
+        self.assertEqual(markers[0][1], 'foo')
+        self.assertLess(abs(markers[0][0] - t), .005 * NS_PER_S)
+
+    def test_reconnect(self):
+        """Markers sent while the server is down are sent after a
+        reconnect."""
+        client = MarkerClient(protocol='stream', reconnect_interval=.05)
+        client.send('early')
+        time.sleep(.1)
+        self.start_server(tcp_mode='stream')
+        client.send('late')
+        markers = receive(self.ring, 2)
+        client.close()
+        self.assertEqual([m[1] for m in markers], ['early', 'late'])
+        self.assertGreater(client.stats()['reconnects'], 0)
+
+    def test_defaults(self):
+        """The default client works with the default server."""
+        self.start_server()
+        client = MarkerClient()
+        labels = [str(i) for i in range(20)]
+        for label in labels:
+            client.send(label)
+        client.close()
+        markers = receive(self.ring, len(labels))
+        self.assertEqual(sorted(m[1] for m in markers), sorted(labels))
+        self.assertEqual(client.stats()['sent'], len(labels))
+
+    def test_stream_closed_by_server(self):
+        """Markers are not counted as sent on a connection the server
+        closed."""
+        self.start_server(tcp_mode='oneshot')
+        client = MarkerClient(protocol='stream', reconnect_interval=.05)
+        client.send('foo')
+        receive(self.ring, 1)
+        time.sleep(.1)
+        client.send('bar')
+        markers = receive(self.ring, 1)
+        client.close()
+        self.assertEqual([m[1].strip() for m in markers], ['bar'])
+        self.assertGreater(client.stats()['reconnects'], 0)
+
+    def test_binary_retry(self):
+        """A batch sent again after a failure keeps its sequence
+        numbers."""
+        client = MarkerClient(protocol='binary', reconnect_interval=.05)
+
+        class Failing(object):
+            def __init__(self, transport):
+                self.transport = transport
+                self.failed = False
+
+            def send(self, messages):
+                if not self.failed:
+                    self.failed = True
+                    raise OSError('Injected failure.')
+                self.transport.send(messages)
+
+            def close(self):
+                self.transport.close()
+
+        self.start_server()
+        client.send(0)
+        receive(self.ring, 1)
+        client.transport = Failing(client.transport)
+        for code in range(1, 10):
+            client.send(code)
+        markers = receive(self.ring, 9)
+        client.close()
+        self.assertEqual([m[1] for m in markers], [str(i) for i in range(1, 10)])
+        self.assertEqual(self.ring.counters()['lost'], 0)
+        self.assertGreater(client.stats()['reconnects'], 0)
@@ -0,0 +1,66 @@
+from __future__ import division
+
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from libmushu.markerindex import MarkerIndex
+
+
+class TestMarkerIndex(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+        self.markers = [[20, 'b'], [0, 'a'], [10, 'b'], [35, 'c d'], [30, 'a']]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookups(self):
+        index = MarkerIndex.from_markers(self.markers, 100)
+        np.testing.assert_array_equal(index.samples, [0, 1, 2, 3, 4])
+        samples, labels = index.between(1, 4)
+        np.testing.assert_array_equal(samples, [1, 2, 3])
+        self.assertEqual(labels, ['b', 'b', 'a'])
+        np.testing.assert_array_equal(index.find('a'), [0, 3])
+        np.testing.assert_array_equal(index.find('b'), [1, 2])
+        self.assertEqual(len(index.find('foo')), 0)
+
+    def test_save_load(self):
+        """A saved index is loaded memory mapped and identical."""
+        MarkerIndex.from_markers(self.markers, 100).save(self.filename)
+        index = MarkerIndex.load(self.filename)
+        self.assertIsInstance(index.samples, np.memmap)
+        self.assertEqual(index.between()[1], ['a', 'b', 'b', 'a', 'c d'])
+        np.testing.assert_array_equal(index.find('c d'), [4])
+
+    def test_from_text(self):
+        """The index can be rebuilt from a .marker text file."""
+        with open(self.filename + '.marker', 'w') as fh:
+            for t, label in self.markers:
+                fh.write('%f %s\n' % (t, label))
+        index = MarkerIndex.from_text(self.filename + '.marker', 100)
+        self.assertEqual(index.between()[1], ['a', 'b', 'b', 'a', 'c d'])
+
+    def test_empty(self):
+        MarkerIndex.from_markers([], 100).save(self.filename)
+        index = MarkerIndex.load(self.filename)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.between(0, 10)[1], [])
+
+    def test_lookup_speed(self):
+        """Lookups in 100k markers take milliseconds."""
+        labels = ['S%d' % i for i in range(20)]
+        markers = [[i * 7.5, labels[i % 20]] for i in range(100000)]
+        MarkerIndex.from_markers(markers, 1000).save(self.filename)
+        index = MarkerIndex.load(self.filename)
+        t = time.time()
+        samples = index.find('S3')
+        index.between(500000, 510000)
+        self.assertLess(time.time() - t, 0.01)
+        self.assertEqual(len(samples), 5000)
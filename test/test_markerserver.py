@@ -0,0 +1,376 @@
+from __future__ import division
+
+import os
+import time
+import asyncio
+import shutil
+import socket
+import tempfile
+from unittest import TestCase, skipUnless
+
+from libmushu.clock import now_ns, NS_PER_S
+from libmushu.ringbuffer import MarkerRing
+from libmushu.markerserver import get_marker_server, unix_paths, PORT
+
+
+def receive(ring, n, timeout=2):
+    markers = []
+    t_end = time.time() + timeout
+    while len(markers) < n and time.time() < t_end:
+        markers.extend(ring.drain())
+        time.sleep(.001)
+    return markers
+
+
+class TestMarkerServer(TestCase):
+
+    def setUp(self):
+        self.ring = MarkerRing()
+
+    def tearDown(self):
+        self.ring.close()
+
+    def check_server(self, mode):
+        server = get_marker_server(mode, self.ring)
+        server.start()
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.sendto(b'udp', ('127.0.0.1', PORT))
+            s.close()
+            s = socket.create_connection(('127.0.0.1', PORT))
+            s.sendall(b'tcp')
+            s.close()
+            markers = receive(self.ring, 2)
+        finally:
+            server.stop()
+        self.assertEqual(sorted(m[1] for m in markers), ['tcp', 'udp'])
+        t = now_ns()
+        for m in markers:
+            self.assertIsInstance(m[0], int)
+            self.assertLess(abs(m[0] - t), 2 * NS_PER_S)
+
+    def test_process(self):
+        """The marker server receives markers in process mode."""
+        self.check_server('process')
+
+    def test_thread(self):
+        """The marker server receives markers in thread mode."""
+        self.check_server('thread')
+
+    def test_loop(self):
+        """The marker server receives markers on a running event loop."""
+        async def main():
+            server = get_marker_server('loop', self.ring)
+            server.start()
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                s.sendto(b'udp', ('127.0.0.1', PORT))
+                s.close()
+                s = socket.create_connection(('127.0.0.1', PORT))
+                s.sendall(b'tcp')
+                s.close()
+                markers = []
+                t_end = time.time() + 2
+                while len(markers) < 2 and time.time() < t_end:
+                    markers.extend(self.ring.drain())
+                    await asyncio.sleep(.001)
+            finally:
+                server.stop()
+            return markers
+        markers = asyncio.run(main())
+        self.assertEqual(sorted(m[1] for m in markers), ['tcp', 'udp'])
+
+    def test_loop_not_running(self):
+        """The loop mode needs a running event loop."""
+        with self.assertRaises(RuntimeError):
+            get_marker_server('loop', self.ring)
+
+    def test_restart(self):
+        """The thread mode server can be started and stopped repeatedly."""
+        for i in range(5):
+            server = get_marker_server('thread', self.ring)
+            server.start()
+            server.stop()
+            self.assertFalse(server.is_alive())
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            get_marker_server('foo', self.ring)
+
+
+class TestStreamMode(TestCase):
+
+    def setUp(self):
+        self.ring = MarkerRing()
+        self.server = get_marker_server('thread', self.ring, tcp_mode='stream')
+        self.server.start()
+        self.sock = socket.create_connection(('127.0.0.1', PORT))
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.stop()
+        self.ring.close()
+
+    def test_coalesced(self):
+        """Markers arriving in one read are split."""
+        self.sock.sendall(b'foo\nbar\nbaz\n')
+        self.assertEqual([m[1] for m in receive(self.ring, 3)], ['foo', 'bar', 'baz'])
+
+    def test_partial(self):
+        """Partial markers are buffered until they are complete."""
+        self.sock.sendall(b'fo')
+        time.sleep(.05)
+        self.assertEqual(self.ring.drain(), [])
+        self.sock.sendall(b'o\r\nb')
+        self.assertEqual([m[1] for m in receive(self.ring, 1)], ['foo'])
+        self.sock.sendall(b'ar\n')
+        self.assertEqual([m[1] for m in receive(self.ring, 1)], ['bar'])
+
+    def test_persistent(self):
+        """The connection stays open and nothing is echoed."""
+        for i in range(10):
+            self.sock.sendall(('%d\n' % i).encode())
+            time.sleep(.001)
+        self.assertEqual([m[1] for m in receive(self.ring, 10)], [str(i) for i in range(10)])
+        self.sock.settimeout(.05)
+        with self.assertRaises(socket.timeout):
+            self.sock.recv(1)
+
+    def test_close_flushes(self):
+        """A partial marker is used when the client closes."""
+        self.sock.sendall(b'foo\nbar')
+        self.sock.close()
+        self.assertEqual([m[1] for m in receive(self.ring, 2)], ['foo', 'bar'])
+
+
+@skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix domain sockets are not supported.')
+class TestUnixSockets(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'markers')
+        self.stream_path, self.dgram_path = unix_paths(self.path)
+        self.ring = MarkerRing()
+
+    def tearDown(self):
+        self.ring.close()
+        shutil.rmtree(self.tmpdir)
+
+    def check_server(self, mode, tcp_mode):
+        server = get_marker_server(mode, self.ring, tcp_mode=tcp_mode, unix_path=self.path)
+        server.start()
+        try:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            s.sendto(b'dgram', self.dgram_path)
+            s.close()
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.connect(self.stream_path)
+            s.sendall(b'stream')
+            s.close()
+            markers = receive(self.ring, 2)
+        finally:
+            server.stop()
+        self.assertEqual(sorted(m[1] for m in markers), ['dgram', 'stream'])
+        # the sockets are removed
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_thread(self):
+        """The server receives markers on the Unix domain sockets."""
+        self.check_server('thread', 'stream')
+
+    def test_process(self):
+        self.check_server('process', 'oneshot')
+
+    def test_stale_socket(self):
+        """A socket left by a crashed server is replaced."""
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        s.bind(self.dgram_path)
+        s.close()
+        self.check_server('thread', 'stream')
+
+    def test_concurrent(self):
+        """Servers with different paths run concurrently."""
+        other = MarkerRing()
+        servers = [get_marker_server('thread', self.ring, unix_path=self.path),
+                   get_marker_server('thread', other, port=PORT + 1, unix_path=self.path + '2')]
+        for server in servers:
+            server.start()
+        try:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            s.sendto(b'one', self.dgram_path)
+            s.sendto(b'two', unix_paths(self.path + '2')[1])
+            s.close()
+            self.assertEqual([m[1] for m in receive(self.ring, 1)], ['one'])
+            self.assertEqual([m[1] for m in receive(other, 1)], ['two'])
+        finally:
+            for server in servers:
+                server.stop()
+            other.close()
+
+
+class TestKernelTimestamps(TestCase):
+
+    def test_timestamp_on_arrival(self):
+        """Datagrams are timestamped on arrival, not when they are read."""
+        import asyncio
+        from libmushu.markerserver import KernelTimestampEndpoint
+
+        class Protocol(asyncio.DatagramProtocol):
+            received = []
+
+            def datagram_received(self, data, addr, timestamp=None):
+                self.received.append((data, timestamp))
+
+        loop = asyncio.new_event_loop()
+        try:
+            endpoint = KernelTimestampEndpoint.create(loop, Protocol, ('127.0.0.1', 0))
+            if endpoint is None:
+                self.skipTest('Kernel timestamps are not supported.')
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            t = now_ns()
+            s.sendto(b'foo', endpoint.sock.getsockname())
+            s.close()
+            # the event loop is not running, the datagram waits in the
+            # socket
+            time.sleep(.1)
+            loop.run_until_complete(asyncio.sleep(.01))
+            endpoint.close()
+        finally:
+            loop.close()
+        self.assertEqual(len(Protocol.received), 1)
+        data, timestamp = Protocol.received[0]
+        self.assertEqual(data, b'foo')
+        self.assertLess(abs(timestamp - t), .05 * NS_PER_S)
+
+
+class TestClockSync(TestCase):
+
+    def test_sync(self):
+        """Client timestamps are mapped onto the server's clock."""
+        from libmushu.clocksync import format_message, parse_message, SYNC, REPORT, TIMESTAMPED
+        ring = MarkerRing()
+        server = get_marker_server('thread', ring)
+        server.start()
+        # the client's clock is 1000s behind
+        client_time = lambda: now_ns() / NS_PER_S - 1000
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.settimeout(1)
+        try:
+            # a timestamped marker before syncing is timestamped on
+            # arrival
+            s.sendto(format_message(TIMESTAMPED, 'c', client_time() - 5, 'early').encode(), ('127.0.0.1', PORT))
+            for i in range(5):
+                s.sendto(format_message(SYNC, 'c', client_time()).encode(), ('127.0.0.1', PORT))
+                reply = s.recv(1024).decode()
+                t4 = client_time()
+                command, client_id, args = parse_message(reply)
+                self.assertEqual((command, client_id), (SYNC, 'c'))
+                s.sendto(format_message(REPORT, 'c', *(args + [t4])).encode(), ('127.0.0.1', PORT))
+            t = client_time() - 5
+            s.sendto(format_message(TIMESTAMPED, 'c', t, 'my marker').encode(), ('127.0.0.1', PORT))
+            markers = receive(ring, 2)
+        finally:
+            s.close()
+            server.stop()
+            ring.close()
+        self.assertEqual([m[1] for m in markers], ['early', 'my marker'])
+        self.assertLess(abs(markers[0][0] - now_ns()), NS_PER_S)
+        self.assertLess(abs(markers[1][0] - (t + 1000) * NS_PER_S), .01 * NS_PER_S)
+
+
+class TestBinaryMarkers(TestCase):
+
+    def setUp(self):
+        self.ring = MarkerRing()
+        self.server = get_marker_server('thread', self.ring)
+        self.server.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.stop()
+        self.ring.close()
+
+    def send(self, seq, code, timestamps=None):
+        from libmushu.markerserver import pack_events
+        self.sock.sendto(pack_events('client', seq, code, timestamps), ('127.0.0.1', PORT))
+
+    def test_bulk(self):
+        """One datagram carries many events."""
+        self.send(range(100), range(100, 200))
+        markers = receive(self.ring, 100)
+        self.assertEqual([m[1] for m in markers], [str(i) for i in range(100, 200)])
+        self.assertEqual(self.ring.counters()['lost'], 0)
+
+    def test_lost_and_reordered(self):
+        """Gaps and late arrivals in the sequence are counted."""
+        self.send([0, 1], [1, 1])
+        self.send([4, 5], [1, 1])
+        self.send([3], [1])
+        receive(self.ring, 5)
+        self.assertEqual(self.ring.counters(), {'received': 5, 'dropped': 0, 'lost': 1, 'reordered': 1,
+                                                'duplicates': 0})
+
+    def test_duplicates(self):
+        """Late events that were not missing are counted as duplicates
+        and dropped."""
+        self.send([0, 1, 2, 3], [0, 1, 2, 3])
+        self.send([1], [1])
+        self.send([5], [5])
+        self.send([3], [3])
+        self.send([4], [4])
+        markers = receive(self.ring, 6)
+        self.assertEqual([m[1] for m in markers], ['0', '1', '2', '3', '5', '4'])
+        self.assertEqual(self.ring.counters(), {'received': 6, 'dropped': 0, 'lost': 0, 'reordered': 1,
+                                                'duplicates': 2})
+
+    def test_retransmission(self):
+        """A datagram received twice yields its markers once."""
+        self.send([0, 1], [7, 8])
+        self.send([0, 1], [7, 8])
+        self.send([2], [9])
+        markers = receive(self.ring, 3)
+        time.sleep(.05)
+        markers += self.ring.drain()
+        self.assertEqual([m[1] for m in markers], ['7', '8', '9'])
+        self.assertEqual(self.ring.counters()['duplicates'], 2)
+
+    def test_unsynced_timestamps(self):
+        """Timestamped events of unsynced clients use the arrival time."""
+        self.send([0], [7], [123.])
+        markers = receive(self.ring, 1)
+        self.assertEqual(markers[0][1], '7')
+        self.assertLess(abs(markers[0][0] - now_ns()), NS_PER_S)
+
+    def test_unpack(self):
+        from libmushu.markerserver import pack_events, unpack_events
+        client_id, events = unpack_events(pack_events('c', [1, 2], [-5, 6], [.5, 1.5]))
+        self.assertEqual(client_id, 'c')
+        self.assertEqual(events['code'].tolist(), [-5, 6])
+        self.assertEqual(events['time'].tolist(), [.5, 1.5])
+        with self.assertRaises(ValueError):
+            unpack_events(pack_events('c', [1], [1])[:-1])
+
+
+class TestBlock(TestCase):
+
+    def test_backpressure(self):
+        """A full ring blocks stream connections instead of dropping
+        markers."""
+        ring = MarkerRing(capacity=8, overflow='block')
+        server = get_marker_server('thread', ring, tcp_mode='stream')
+        server.start()
+        sock = socket.create_connection(('127.0.0.1', PORT))
+        try:
+            sock.sendall(b''.join(b'%d\n' % i for i in range(20)))
+            time.sleep(.05)
+            self.assertTrue(ring.full)
+            markers = ring.drain()
+            markers += receive(ring, 20 - len(markers))
+        finally:
+            sock.close()
+            server.stop()
+            counters = ring.counters()
+            ring.close()
+        self.assertEqual([m[1] for m in markers], [str(i) for i in range(20)])
+        self.assertEqual(counters['dropped'], 0)
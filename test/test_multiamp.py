@@ -0,0 +1,107 @@
+from __future__ import division
+
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from libmushu.amplifier import Amplifier
+from libmushu.multiamp import MultiAmp, AmpThread
+
+
+class RampAmp(Amplifier):
+    """Deliver the time of each sample in s, in blocks of 10 ms."""
+
+    def __init__(self, fs, marker=None):
+        self.fs = fs
+        self.marker = marker
+
+    def start(self):
+        self.samples = 0
+        self.t_start = time.time()
+
+    def get_data(self):
+        n = int(self.fs / 100)
+        time.sleep(max(0, self.t_start + (self.samples + n) / self.fs - time.time()))
+        data = (self.samples + np.arange(n, dtype=np.float64)[:, np.newaxis]) / self.fs
+        markers = []
+        if self.marker is not None and self.samples == 0:
+            markers = [[0, self.marker]]
+        self.samples += n
+        return data, markers
+
+    def get_channels(self):
+        return ['ramp']
+
+    def get_sampling_frequency(self):
+        return self.fs
+
+
+class TestMultiAmp(TestCase):
+
+    def setUp(self):
+        self.amp = MultiAmp([RampAmp(100), RampAmp(250, marker='second')])
+
+    def get_data(self, duration):
+        self.amp.start()
+        data, markers = [], []
+        samples = 0
+        t_end = time.time() + duration
+        while time.time() < t_end:
+            d, m = self.amp.get_data()
+            markers.extend([samples * 10 + t, label] for t, label in m)
+            samples += len(d)
+            data.append(d)
+        self.amp.stop()
+        return np.concatenate(data), markers
+
+    def test_channels(self):
+        """The channels of all amps are merged, duplicates are prefixed."""
+        self.assertEqual(self.amp.get_channels(), ['0:ramp', '1:ramp'])
+        self.assertEqual(self.amp.get_sampling_frequency(), 100)
+
+    def test_alignment(self):
+        """The second amp is resampled onto the samples of the first."""
+        data, markers = self.get_data(1)
+        self.assertGreater(len(data), 50)
+        self.assertEqual(data.shape[1], 2)
+        # both amps started at the same time, so after the first block
+        # both ramps must agree up to the jitter of the block arrival
+        valid = ~np.isnan(data[:, 1])
+        self.assertGreater(valid[10:].mean(), .9)
+        diff = data[valid, 1] - data[valid, 0]
+        self.assertLess(np.abs(diff - np.median(diff)).max(), .02)
+        # the first reference sample is returned as it is
+        np.testing.assert_allclose(data[:, 0], np.arange(len(data)) / 100)
+
+    def test_markers(self):
+        """The markers of all amps end up on the merged timeline."""
+        data, markers = self.get_data(.5)
+        self.assertEqual([m[1] for m in markers], ['second'])
+        self.assertLess(abs(markers[0][0]), 50)
+
+    def test_native_dtype(self):
+        """The pending samples keep the data type of the amp."""
+        thread = AmpThread(RampAmp(100), self.amp.condition)
+        thread.blocks.append(np.arange(10, dtype=np.int16)[:, np.newaxis])
+        thread.collect()
+        self.assertEqual(thread.pending.dtype, np.int16)
+
+
+class TestDrift(TestCase):
+
+    def test_slow_clock(self):
+        """The clock of an amp running 50ppm slow is followed."""
+        fs = 1000
+        period = (1 + 50e-6) / fs
+        thread = AmpThread(RampAmp(fs), None)
+        rng = np.random.default_rng(0)
+        # ten minutes of blocks of 10 samples, arriving up to 2ms late
+        samples = np.arange(10, 600 * fs + 1, 10)
+        arrivals = 5. + samples * period + rng.uniform(0, .002, len(samples))
+        for n, t in zip(samples.tolist(), arrivals.tolist()):
+            thread.arrived(n, t)
+        self.assertAlmostEqual(thread.period * fs, 1 + 50e-6, delta=1e-6)
+        # the host time of the last sample is off by less than 1ms
+        thread.first = samples[-1] - 1
+        self.assertLess(abs(thread.times(0, 1)[0] - (5. + (samples[-1] - 1) * period)), .001)
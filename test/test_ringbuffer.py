@@ -0,0 +1,330 @@
+from __future__ import division
+
+import os
+import sys
+import json
+import threading
+import subprocess
+from multiprocessing import Process, Queue
+from unittest import TestCase
+
+import numpy as np
+
+import libmushu
+from libmushu.ringbuffer import MarkerRing, SampleRing, BroadcastRing
+
+
+def produce(ring, n):
+    for i in range(n):
+        ring.put(i, 'label %d' % (i % 3))
+
+
+def produce_consecutive(ring, n):
+    for i in range(n):
+        ring.put(i, str(i % 7))
+
+
+def subscribe(ring, ready, results):
+    subscriber = ring.subscribe()
+    ready.put(True)
+    total, blocks = 0, []
+    while not subscriber.closed:
+        data, markers, start, overrun = subscriber.read(timeout=2)
+        total += data[:, 0].sum()
+        blocks.append((start, len(data), overrun, markers))
+    results.put((total, blocks))
+
+
+ATTACH = """
+import sys, json
+from libmushu.ringbuffer import BroadcastRing
+ring = BroadcastRing.attach(sys.argv[1])
+print(json.dumps([ring.capacity, ring.channels, ring.fs, ring.dtype.str, ring.data[:3].tolist()]))
+ring.close()
+"""
+
+
+class TestMarkerRing(TestCase):
+
+    def setUp(self):
+        self.ring = MarkerRing(capacity=8)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_put_drain(self):
+        """Markers come out in the order they were put in, the timestamps
+        exactly."""
+        self.assertEqual(self.ring.drain(), [])
+        self.ring.put(1500000000000000001, 'foo')
+        self.ring.put(2500000000000000001, 'bär')
+        self.ring.put(3500000000000000001, 'foo')
+        self.assertEqual(len(self.ring), 3)
+        self.assertEqual(self.ring.drain(), [[1500000000000000001, 'foo'], [2500000000000000001, 'bär'], [3500000000000000001, 'foo']])
+        self.assertEqual(self.ring.drain(), [])
+
+    def test_wrap_around(self):
+        """The ring wraps around."""
+        for i in range(5):
+            for j in range(5):
+                self.ring.put(j, str(j))
+            self.assertEqual(self.ring.drain(), [[j, str(j)] for j in range(5)])
+
+    def test_full(self):
+        """Markers are dropped if the ring is full."""
+        for i in range(10):
+            self.ring.put(i, 'x')
+        self.assertEqual(self.ring.dropped, 2)
+        self.assertEqual([m[0] for m in self.ring.drain()], list(range(8)))
+
+    def test_process(self):
+        """Markers are passed between processes."""
+        p = Process(target=produce, args=(self.ring, 6))
+        p.start()
+        p.join()
+        self.assertEqual(self.ring.drain(), [[i, 'label %d' % (i % 3)] for i in range(6)])
+
+    def test_put_many(self):
+        """Several markers are put at once, wrapping around."""
+        self.ring.put(0, 'x')
+        self.ring.drain()
+        self.assertEqual(self.ring.put_many([1, 2, 3], ['a', 'b', 'a']), 3)
+        self.assertEqual(self.ring.drain(), [[1, 'a'], [2, 'b'], [3, 'a']])
+        self.assertEqual(self.ring.put_many(range(10), [str(i) for i in range(10)]), 8)
+        self.assertEqual(self.ring.dropped, 2)
+        self.assertEqual(self.ring.drain(), [[i, str(i)] for i in range(8)])
+
+    def test_counters(self):
+        self.ring.count('lost', 3)
+        self.ring.count('reordered')
+        for i in range(10):
+            self.ring.put(i, 'x')
+        self.assertEqual(self.ring.counters(), {'received': 10, 'dropped': 2, 'lost': 3, 'reordered': 1,
+                                                'duplicates': 0})
+
+
+class TestOverflow(TestCase):
+
+    def test_drop_oldest(self):
+        """The oldest markers are overwritten."""
+        ring = MarkerRing(capacity=8, overflow='drop-oldest')
+        for i in range(20):
+            ring.put(i, 'x')
+        self.assertTrue(ring.full)
+        self.assertEqual([m[0] for m in ring.drain()], list(range(13, 20)))
+        self.assertEqual(ring.counters()['dropped'], 13)
+        self.assertFalse(ring.full)
+        ring.put(20, 'x')
+        self.assertEqual(ring.drain(), [[20, 'x']])
+        ring.close()
+
+    def test_drop_oldest_put_many(self):
+        ring = MarkerRing(capacity=8, overflow='drop-oldest')
+        ring.put_many(range(5), ['x'] * 5)
+        ring.put_many(range(5, 25), ['y'] * 20)
+        self.assertEqual([m[0] for m in ring.drain()], list(range(18, 25)))
+        self.assertEqual(ring.counters(), {'received': 25, 'dropped': 18, 'lost': 0, 'reordered': 0,
+                                           'duplicates': 0})
+        ring.close()
+
+    def test_drop_oldest_process(self):
+        """The markers read while the producer overwrites them are
+        consistent."""
+        ring = MarkerRing(capacity=64, overflow='drop-oldest')
+        p = Process(target=produce_consecutive, args=(ring, 100000))
+        p.start()
+        markers = []
+        while p.is_alive():
+            markers.extend(ring.drain())
+        p.join()
+        markers.extend(ring.drain())
+        t = [m[0] for m in markers]
+        self.assertEqual(t, sorted(set(t)))
+        self.assertTrue(all(m[1] == str(m[0] % 7) for m in markers))
+        self.assertEqual(t[-1], 99999)
+        self.assertEqual(len(markers) + ring.counters()['dropped'], 100000)
+        ring.close()
+
+    def test_block(self):
+        """The ring itself drops new markers in block mode."""
+        ring = MarkerRing(capacity=8, overflow='block')
+        for i in range(10):
+            ring.put(i, 'x')
+        self.assertTrue(ring.full)
+        self.assertEqual([m[0] for m in ring.drain()], list(range(8)))
+        ring.close()
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            MarkerRing(overflow='foo')
+
+
+class TestSampleRing(TestCase):
+
+    def setUp(self):
+        self.ring = SampleRing(10, 2)
+
+    def test_write_read(self):
+        """Everything written since the last read is returned."""
+        self.ring.write(np.ones((3, 2)), ['a'])
+        self.ring.write(2 * np.ones((4, 2)), ['b'])
+        data, markers, start, overrun = self.ring.read()
+        self.assertEqual(data[:, 0].tolist(), [1] * 3 + [2] * 4)
+        self.assertEqual((markers, start, overrun), (['a', 'b'], 0, 0))
+        self.ring.write(np.arange(12).reshape(6, 2), [])
+        data, markers, start, overrun = self.ring.read()
+        self.assertEqual(data.tolist(), np.arange(12).reshape(6, 2).tolist())
+        self.assertEqual((start, overrun), (7, 0))
+
+    def test_overrun(self):
+        """The oldest samples are overwritten if the reader falls
+        behind."""
+        for i in range(5):
+            self.ring.write(np.full((4, 2), i), [])
+        data, markers, start, overrun = self.ring.read()
+        self.assertEqual(data[:, 0].tolist(), [2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+        self.assertEqual((start, overrun), (10, 10))
+        self.ring.write(np.arange(30).reshape(15, 2), [])
+        data, markers, start, overrun = self.ring.read()
+        self.assertEqual(data[:, 0].tolist(), list(range(10, 30, 2)))
+        self.assertEqual((start, overrun, self.ring.overruns), (25, 5, 15))
+
+    def test_listener(self):
+        """Listeners are called on every write and on close."""
+        calls = []
+        callback = lambda: calls.append(self.ring.written)
+        self.ring.add_listener(callback)
+        self.assertFalse(self.ring.ready())
+        self.ring.write(np.ones((3, 2)), [])
+        self.assertTrue(self.ring.ready())
+        self.ring.read()
+        self.assertFalse(self.ring.ready())
+        self.ring.close()
+        self.assertTrue(self.ring.ready())
+        self.ring.remove_listener(callback)
+        self.ring.write(np.ones((3, 2)), [])
+        self.assertEqual(calls, [3, 3])
+
+    def test_timeout(self):
+        data, markers, start, overrun = self.ring.read(.01)
+        self.assertEqual(data.shape, (0, 2))
+
+    def test_thread(self):
+        """A waiting reader is woken up by the writer."""
+        t = threading.Timer(.05, self.ring.write, (np.ones((1, 2)), []))
+        t.start()
+        data, markers, start, overrun = self.ring.read(1)
+        t.join()
+        self.assertEqual(len(data), 1)
+
+    def test_read_into(self):
+        """Samples that do not fit into out stay in the ring."""
+        self.ring.write(np.arange(14).reshape(7, 2), ['a'])
+        out = np.zeros((4, 2))
+        data, markers, start, overrun = self.ring.read(out=out)
+        self.assertIs(data.base, out)
+        self.assertEqual(data[:, 0].tolist(), [0, 2, 4, 6])
+        self.assertEqual(markers, ['a'])
+        data, markers, start, overrun = self.ring.read(out=out)
+        self.assertEqual(data[:, 0].tolist(), [8, 10, 12])
+        self.assertEqual((markers, start), ([], 4))
+
+
+class TestBroadcastRing(TestCase):
+
+    def setUp(self):
+        self.ring = BroadcastRing(2, 1000, capacity=10, dtype=np.int32, marker_capacity=4)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_subscribers(self):
+        """Every subscriber reads all samples with its own cursor,
+        without copying them."""
+        a, b = self.ring.subscribe(), self.ring.subscribe()
+        self.ring.write(np.arange(8).reshape(4, 2), [])
+        data, markers, start, overrun = a.read()
+        self.assertEqual(data.tolist(), np.arange(8).reshape(4, 2).tolist())
+        self.assertEqual((start, overrun), (0, 0))
+        self.assertTrue(np.shares_memory(data, a.ring.data))
+        self.ring.write(np.arange(8, 12).reshape(2, 2), [])
+        self.assertEqual(a.read()[0][:, 0].tolist(), [8, 10])
+        data, markers, start, overrun = b.read()
+        self.assertEqual(data[:, 0].tolist(), [0, 2, 4, 6, 8, 10])
+        # a late subscriber starts with the next sample
+        c = self.ring.subscribe()
+        self.ring.write(np.arange(12, 16).reshape(2, 2), [])
+        self.assertEqual(c.read()[2], 6)
+
+    def test_wrap(self):
+        """The samples are returned up to the end of the ring."""
+        s = self.ring.subscribe()
+        self.ring.write(np.zeros((7, 2)), [])
+        s.read()
+        self.ring.write(np.arange(10).reshape(5, 2), [])
+        self.assertEqual(s.read()[0][:, 0].tolist(), [0, 2, 4])
+        self.assertEqual(s.read(timeout=0)[0][:, 0].tolist(), [6, 8])
+        self.ring.write(np.ones((3, 2)), [])
+        self.assertEqual(len(s.read(max_samples=2)[0]), 2)
+        self.assertEqual(len(s.read()[0]), 1)
+
+    def test_overrun(self):
+        """A slow subscriber loses samples, the producer is never
+        blocked."""
+        s = self.ring.subscribe()
+        self.ring.write(np.arange(8).reshape(4, 2), [])
+        data, markers, start, overrun = s.read()
+        self.assertEqual(s.check(), 0)
+        # the producer overwrites the returned samples
+        self.ring.write(np.zeros((8, 2)), [])
+        self.assertEqual(s.check(), 2)
+        self.ring.write(np.zeros((10, 2)), [])
+        data, markers, start, overrun = s.read()
+        self.assertEqual((start, overrun), (12, 8))
+        self.assertEqual(s.overruns, 10)
+
+    def test_markers(self):
+        """The markers are relative to the onset of the returned samples
+        and held back until their samples are returned."""
+        s = self.ring.subscribe()
+        self.ring.write(np.zeros((4, 2)), [[1000000, 'a'], [5000000, 'b']])
+        self.assertEqual(s.read()[1], [[1., 'a']])
+        self.ring.write(np.zeros((4, 2)), [[3000000, 'a']])
+        self.assertEqual(s.read()[1], [[-1., 'a'], [1., 'b']])
+        # markers that were overwritten before they were read are lost
+        for i in range(5):
+            self.ring.write(np.zeros((1, 2)), [[(8 + i) * 1000000, 'c']])
+        # the ring wraps around after the first two samples
+        self.assertEqual(s.read()[1], [[1., 'c']])
+        self.assertEqual(s.read()[1], [[0., 'c'], [1., 'c'], [2., 'c']])
+        self.assertEqual(s.lost_markers, 1)
+
+    def test_processes(self):
+        """Subscribers in other processes follow the producer."""
+        ready, results = Queue(), Queue()
+        ring = BroadcastRing(2, 1000, capacity=1000)
+        processes = [Process(target=subscribe, args=(ring, ready, results)) for i in range(3)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            ready.get()
+        for i in range(100):
+            ring.write(np.full((10, 2), i), [[i * 10000000, str(i)]])
+        ring.close()
+        for p in processes:
+            total, blocks = results.get()
+            self.assertEqual(total, 10 * sum(range(100)))
+            self.assertEqual(sum(b[2] for b in blocks), 0)
+            markers = []
+            for start, n, overrun, m in blocks:
+                markers.extend([start + int(t), label] for t, label in m)
+            self.assertEqual(markers, [[i * 10, str(i)] for i in range(100)])
+        for p in processes:
+            p.join()
+
+    def test_attach(self):
+        """Unrelated processes attach by name."""
+        self.ring.write(np.arange(6).reshape(3, 2), [])
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(libmushu.__file__))))
+        output = subprocess.check_output([sys.executable, '-c', ATTACH, self.ring.name], env=env)
+        self.assertEqual(json.loads(output), [10, 2, 1000., '<i4', [[0, 1], [2, 3], [4, 5]]])
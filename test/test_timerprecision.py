@@ -17,9 +17,10 @@
 
 
 from __future__ import division
-import time
 import unittest
 
+from libmushu.clock import now_ns, NS_PER_S
+
 
 class TestTimerPrecision(unittest.TestCase):
 
@@ -28,13 +29,13 @@ class TestTimerPrecision(unittest.TestCase):
         # collect as many timestamps as possible in 1 second, remove the
         # duplicates and count the number of elements
         times = []
-        t_start = time.time()
-        while time.time() < t_start + 1:
-            times.append(time.time())
+        t_start = now_ns()
+        while now_ns() < t_start + NS_PER_S:
+            times.append(now_ns())
         # remove duplicates
         times = list(set(times))
         resolution = (max(times) - min(times)) / len(times)
-        self.assertLessEqual(resolution, 10*1e-6)
+        self.assertLessEqual(resolution, 10*1e3)
 
 
 if __name__ == '__main__':
@@ -20,22 +20,20 @@
 
 from __future__ import division
 
-import pdb
-import ipdb
-import sys
 import unittest
-import json
 import socket
 import time
-import math
+
+from multiprocessing import Process
 
 import libmushu
-from libmushu.driver.randomamp import RandomAmp
+from libmushu.clock import now_ns, ns_to_samples, samples_to_ns, NS_PER_S, NS_PER_MS
+from libmushu.ringbuffer import MarkerRing
+from libmushu.markerserver import get_marker_server, PORT
 from libmushu.amplifier import Amplifier
 import logging
 
 import numpy as np
-from matplotlib import pyplot as plt
 
 
 logging.basicConfig(format='%(relativeCreated)10.0f %(processName)-11s %(threadName)-10s %(name)-10s %(levelname)8s %(message)s', level=logging.NOTSET)
@@ -55,38 +53,40 @@ class TriggerTestAmp(Amplifier):
     def __init__(self):
         self.channels = 100
         self.fs = 100
-        self.last_sample = time.time()
+        self.last_sample = now_ns()
 
     def start(self):
         self._marker_count = 0
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.s.connect(('localhost', 12344))
+        self.s = socket.create_connection(('127.0.0.1', PORT))
+        self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def stop(self):
+        self.s.close()
 
     @property
     def sample_len(self):
-        return 1. / self.fs
+        return NS_PER_S // self.fs
 
     @property
     def elapsed(self):
-        return time.time() - self.last_sample
+        return now_ns() - self.last_sample
+
+    def send_marker(self):
+        self.s.sendall(('%d\n' % now_ns()).encode())
 
     def get_data(self):
-        # incredibly terse documentation here..
-        self.s.sendall("%f\n" % time.time())
+        self.send_marker()
         # simulate blocking until we have enough data
         elapsed = self.elapsed
         if elapsed < self.sample_len:
-            time.sleep(self.sample_len - elapsed)
+            time.sleep((self.sample_len - elapsed) / NS_PER_S)
         self._marker_count += 1
-        self.s.sendall("%f\n" % time.time())
-        dt = self.elapsed
-        samples = int(math.floor(self.fs * dt))
+        self.send_marker()
+        samples = ns_to_samples(self.elapsed, self.fs)
         data = np.random.randint(0, 1024, (samples, self.channels))
-        self.last_sample = time.time()
+        self.last_sample += samples_to_ns(samples, self.fs)
         logger.debug('samples = {s}'.format(s=samples))
-
-        return data, [[self.elapsed-1, self._marker_count]]
-        #return data, [[samples-1, self._marker_count]]
+        return data, [[0, self._marker_count]]
 
     def configure(self, fs):
         self.fs = fs
@@ -94,31 +94,31 @@ class TriggerTestAmp(Amplifier):
     def get_sampling_frequency(self):
         return self.fs
 
+
 class TestTriggerDelay(unittest.TestCase):
     """Test the trigger delay."""
 
     def test_triggerdelay(self):
         """Mean and max delay must be reasonably small."""
-        #ipdb.set_trace()
-        #print('hallo')
-        sys.stdout.write('hallo')
         for i in 10, 100, 1000, 10000:
             logger.debug('Setting FS to {fs}kHz'.format(fs=(i / 1000)))
             amp = libmushu.AmpDecorator(TriggerTestAmp)
-            #pdb.set_trace()
-            amp._debug_tcp_marker_timestamps = True
             amp.configure(fs=i)
-            amp.start()
+            amp.start(marker_options={'tcp_mode': 'stream'})
             delays = []
-            t_start = time.time()
-            while time.time() < t_start + 1:
+            t_start = now_ns()
+            while now_ns() < t_start + NS_PER_S:
                 data, marker = amp.get_data()
-                # print(data)
-                # pdb.set_trace()
+                # the markers are relative to the onset of the block,
+                # which ends about now
+                t0 = now_ns() - samples_to_ns(len(data), i)
                 for timestamp, m in marker:
-                     delta_t = (timestamp - float(m)) * 1000
-                     logger.debug('timestamp = {t}, m = {m}'.format(t=timestamp,m=m))
-                     delays.append(delta_t)
+                    # skip the markers of the amp itself
+                    if not isinstance(m, str):
+                        continue
+                    delta_t = (t0 - int(m)) / NS_PER_MS + timestamp
+                    logger.debug('timestamp = {t}, m = {m}'.format(t=timestamp,m=m))
+                    delays.append(delta_t)
             amp.stop()
 
             delays = np.array(delays)
@@ -127,6 +127,56 @@ class TestTriggerDelay(unittest.TestCase):
             self.assertLessEqual(delays.max(), 10)
 
 
+def send_udp_markers(duration, rate):
+    """Send UDP markers with the current time as payload."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    t_end = time.time() + duration
+    while time.time() < t_end:
+        s.sendto(('%d' % now_ns()).encode(), ('127.0.0.1', PORT))
+        time.sleep(1 / rate)
+    s.close()
+
+
+class TestKernelTimestamps(unittest.TestCase):
+    """Compare the UDP trigger delay with userspace and kernel timestamps."""
+
+    def measure(self, kernel_timestamps):
+        ring = MarkerRing(capacity=2**14)
+        server = get_marker_server('thread', ring, kernel_timestamps=kernel_timestamps)
+        server.start()
+        sender = Process(target=send_udp_markers, args=(1, 1000))
+        sender.start()
+        # keep the acquiring process busy, so the event loop competes
+        # for the GIL like during a real acquisition
+        t_end = time.time() + 1.2
+        while time.time() < t_end:
+            sum(range(1000))
+        sender.join()
+        time.sleep(.05)
+        server.stop()
+        delays = np.array([(t - int(m)) / NS_PER_MS for t, m in ring.drain()])
+        ring.close()
+        return delays
+
+    def test_kernel_timestamps(self):
+        """Report the delay distribution with and without kernel
+        timestamps.
+
+        Which one is tighter depends on the load of the machine, only
+        sanity bounds are checked.
+
+        """
+        stats = {}
+        for kernel_timestamps in False, True:
+            delays = self.measure(kernel_timestamps)
+            self.assertGreater(len(delays), 0)
+            p50, p95, p99 = np.percentile(delays, [50, 95, 99])
+            stats[kernel_timestamps] = p99
+            logger.info('kernel timestamps=%s: n: %d, p50: %.3fms, p95: %.3fms, p99: %.3fms, max: %.3fms, std: %.3fms' % (kernel_timestamps, len(delays), p50, p95, p99, delays.max(), delays.std()))
+            self.assertGreaterEqual(p50, 0)
+            self.assertLess(p99, 100)
+        logger.info('p99 delay: %.3fms with, %.3fms without kernel timestamps' % (stats[True], stats[False]))
+
+
 if __name__ == '__main__':
-    sys.stdout.write('hallo')
     unittest.main()
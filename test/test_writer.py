@@ -0,0 +1,199 @@
+from __future__ import division
+
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from libmushu.writer import RecordingWriter, get_writer, read_header, HEADER_SIZE
+
+
+class TestRecordingWriter(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_native_dtype(self):
+        """The data is written in the amp's native data type."""
+        for dtype in np.int16, np.int32, np.float32, np.float64:
+            filename = self.filename + np.dtype(dtype).name
+            writer = RecordingWriter(filename, ['a', 'b', 'c'], 100)
+            data = np.arange(30, dtype=dtype).reshape(-1, 3)
+            writer.write(data[:4], [])
+            writer.write(data[4:], [])
+            writer.close()
+            with open(filename + '.meta') as fh:
+                meta = json.load(fh)
+            self.assertEqual(np.dtype(meta['Data Type']), np.dtype(dtype))
+            self.assertEqual(meta['Samples'], 10)
+            header = read_header(filename + '.eeg')
+            self.assertEqual(header['dtype'], np.dtype(dtype))
+            self.assertEqual(header['samples'], 10)
+            stored = np.fromfile(filename + '.eeg', dtype=dtype, offset=HEADER_SIZE).reshape(-1, 3)
+            np.testing.assert_array_equal(stored, data)
+
+    def test_non_contiguous_data(self):
+        """Non contiguous arrays are written correctly."""
+        writer = RecordingWriter(self.filename, ['a', 'b'], 100)
+        data = np.arange(30, dtype=np.float32).reshape(-1, 3)
+        writer.write(data[:, :2], [])
+        writer.close()
+        stored = np.fromfile(self.filename + '.eeg', dtype=np.float32, offset=HEADER_SIZE).reshape(-1, 2)
+        np.testing.assert_array_equal(stored, data[:, :2])
+
+    def test_memmap(self):
+        """The .eeg file can be memory mapped using only its header."""
+        writer = RecordingWriter(self.filename, ['a', 'b', 'c', 'd'], 500, preallocate=4096)
+        data = np.random.random((1000, 4))
+        for i in range(0, len(data), 7):
+            writer.write(data[i:i+7], [])
+        writer.close()
+        header = read_header(self.filename + '.eeg')
+        self.assertEqual(header['fs'], 500)
+        self.assertEqual(os.path.getsize(self.filename + '.eeg'), HEADER_SIZE + data.nbytes)
+        stored = np.memmap(self.filename + '.eeg', dtype=header['dtype'], mode='r',
+                           offset=HEADER_SIZE, shape=(header['samples'], header['channels']))
+        np.testing.assert_array_equal(stored, data)
+
+    def test_markers(self):
+        """Markers are written as text lines."""
+        writer = RecordingWriter(self.filename, ['a'], 100)
+        writer.write(np.zeros((0, 1)), [[1.5, 'foo'], [20, 'bar']])
+        writer.close()
+        with open(self.filename + '.marker') as fh:
+            self.assertEqual(fh.read(), '1.500000 foo\n20.000000 bar\n')
+
+    def test_update_meta(self):
+        """Additional entries end up in the meta file."""
+        writer = get_writer('thread', self.filename, ['a'], 100)
+        writer.update_meta({'Marker Statistics': {'lost': 1}})
+        writer.close()
+        with open(self.filename + '.meta') as fh:
+            meta = json.load(fh)
+        self.assertEqual(meta['Marker Statistics'], {'lost': 1})
+        self.assertEqual(meta['Sampling Frequency'], 100)
+
+    def test_existing_file(self):
+        """Existing files are not overwritten."""
+        RecordingWriter(self.filename, ['a'], 100).close()
+        with self.assertRaises(IOError):
+            RecordingWriter(self.filename, ['a'], 100)
+
+
+class TestThreadedWriter(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        """All blocks and markers are written in order."""
+        writer = get_writer('thread', self.filename, ['a', 'b'], 100, fsync='close')
+        data = np.arange(2000, dtype=np.int16).reshape(-1, 2)
+        for i in range(0, len(data), 10):
+            writer.write(data[i:i+10], [[i * 10, 'm%d' % i]])
+        writer.write(np.zeros((0, 2)), [])
+        writer.close()
+        stored = np.fromfile(self.filename + '.eeg', dtype=np.int16, offset=HEADER_SIZE).reshape(-1, 2)
+        np.testing.assert_array_equal(stored, data)
+        with open(self.filename + '.marker') as fh:
+            self.assertEqual(len(fh.readlines()), 100)
+        stats = writer.stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['bytes_written'], data.nbytes)
+
+    def test_unknown_writer(self):
+        with self.assertRaises(ValueError):
+            get_writer('foo', self.filename, ['a'], 100)
+
+
+class TestSegmentedWriter(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_rollover_by_duration(self):
+        """Segments have exactly segment_seconds of data."""
+        writer = RecordingWriter(self.filename, ['a', 'b'], 100, segment_seconds=1)
+        data = np.arange(500, dtype=np.float32).reshape(-1, 2)
+        for i in range(0, len(data), 7):
+            writer.write(data[i:i+7], [])
+        writer.close()
+        with open(self.filename + '.manifest') as fh:
+            manifest = json.load(fh)
+        self.assertEqual([s['Samples'] for s in manifest['Segments']], [100, 100, 50])
+        self.assertEqual([s['First Sample'] for s in manifest['Segments']], [0, 100, 200])
+        self.assertFalse(os.path.exists(self.filename + '.eeg'))
+        header = read_header(self.filename + '.0002.eeg')
+        self.assertEqual(header['first_sample'], 200)
+        self.assertEqual(header['samples'], 50)
+
+    def test_rollover_by_size(self):
+        """Segment files do not exceed segment_bytes."""
+        writer = RecordingWriter(self.filename, ['a', 'b'], 100, segment_bytes=HEADER_SIZE + 80)
+        writer.write(np.zeros((25, 2), dtype=np.float32), [])
+        writer.close()
+        sizes = [os.path.getsize(self.filename + '.%04d.eeg' % i) for i in range(3)]
+        self.assertEqual(sizes, [HEADER_SIZE + 80, HEADER_SIZE + 80, HEADER_SIZE + 40])
+
+
+class TestBrainVisionWriter(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        writer = get_writer('thread', self.filename, ['Fp1', 'Fp2'], 5000,
+                            fileformat='brainvision', resolutions=[0.1, 0.5])
+        data = np.arange(200, dtype=np.int16).reshape(-1, 2)
+        writer.write(data[:50], [[0.2, 'S  1']])
+        writer.write(data[50:], [[19.8, 'a,b']])
+        writer.close()
+        stored = np.fromfile(self.filename + '.eeg', dtype='<i2').reshape(-1, 2)
+        np.testing.assert_array_equal(stored, data)
+        with open(self.filename + '.vhdr', encoding='utf-8') as fh:
+            vhdr = fh.read().splitlines()
+        self.assertIn('BinaryFormat=INT_16', vhdr)
+        self.assertIn('SamplingInterval=200.0', vhdr)
+        self.assertIn('Ch2=Fp2,,0.5,µV', vhdr)
+        with open(self.filename + '.vmrk', encoding='utf-8') as fh:
+            vmrk = [l for l in fh.read().splitlines() if l.startswith('Mk')]
+        self.assertTrue(vmrk[0].startswith('Mk1=New Segment,,1,1,0,'))
+        self.assertEqual(vmrk[1:], ['Mk2=Stimulus,S  1,2,1,0', 'Mk3=Stimulus,a\\1b,100,1,0'])
+
+    def test_update_meta(self):
+        """Additional entries end up in the comment section."""
+        writer = get_writer('inline', self.filename, ['a'], 100, fileformat='brainvision')
+        writer.update_meta({'Marker Statistics': {'lost': 1}})
+        writer.close()
+        with open(self.filename + '.vhdr', encoding='utf-8') as fh:
+            vhdr = fh.read().splitlines()
+        self.assertEqual(vhdr[-2:], ['[Comment]', 'Marker Statistics: {"lost": 1}'])
+
+    def test_float_conversion(self):
+        """Unsupported data types are converted to float32."""
+        writer = get_writer('inline', self.filename, ['a'], 100, fileformat='brainvision')
+        writer.write(np.arange(10, dtype=np.float64).reshape(-1, 1), [])
+        writer.close()
+        stored = np.fromfile(self.filename + '.eeg', dtype='<f4')
+        np.testing.assert_array_equal(stored, np.arange(10))
+        with open(self.filename + '.vhdr', encoding='utf-8') as fh:
+            self.assertIn('BinaryFormat=IEEE_FLOAT_32', fh.read())